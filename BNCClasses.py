@@ -1,25 +1,103 @@
-def transcripts2csv(transcripts, outname='temp.tsv'):
+import gzip
+import sys
+
+from profiling import PROFILER
+
+#Columns of the utterance tsv ('tanscript html' is spelled as in 
+#the published spreadsheets)
+UTTERANCE_HEADING = ['tape', 'speaker', 'gender', 'age', 
+        'tape utterance num', 'speaker utterance num', 'transcript num', 
+        'utterance text', 'cleaned text', 'phones', 'start time', 
+        'end time', 'wav fname', 'TextGrid fname', 'tanscript html', 
+        'link', 'clip link', 'padded clip link', 'python clip command', 
+        'python padded clip command']
+
+#Columns of a row that come from the tape, chunk and speaker 
+#(the others are UTTERANCE_VALUES) and how to get each from 
+#a tuple of Transcript.get_transcribed
+ROW_VALUES = {
+        'tape': lambda row: row[0].text,
+        'speaker': lambda row: row[1].speaker,
+        'gender': lambda row: row[4]['gender'],
+        'age': lambda row: row[4]['age'],
+        'tape utterance num': lambda row: row[2],
+        'speaker utterance num': lambda row: row[3],
+        }
+
+def clip_name(textgrid_fname, start, end, padding=0):
+    """Returns the output name of a clip of textgrid_fname 
+    (e.g., D90_1_4.5_6.0 or D90_1_4.5_6.0_pad30)"""
+
+    UID = textgrid_fname.split('.TextGrid')[0]+'_'+str(start)+'_'+str(end)
+    if padding == 0:
+        return UID
+    return UID+'_pad'+str(padding)
+
+def clip_command(textgrid_fname, start, end, padding=0):
+    """Returns the clip.py command that clips start to end 
+    (in seconds) of textgrid_fname and its wav file"""
+
+    UID = clip_name(textgrid_fname, start, end, padding)
+    if padding == 0:
+        return f"python clip.py --start {start} --end {end} --textgrid_fname {textgrid_fname} --out_fname {UID} --getwav"
+    return f"python clip.py --start {start} --end {end} --textgrid_fname {textgrid_fname} --out_fname {UID} --getwav --padding {padding}"
+
+class TSVWriter:
+    """Streams the utterance rows of transcripts to a tsv file. 
+
+    Rows are written to a buffered file as each transcript is 
+    added, so memory does not grow with the corpus. If outname 
+    ends in .gz the file is gzip compressed. columns selects 
+    (and orders) the columns of UTTERANCE_HEADING to write, and 
+    row_filter (a function of an Utterance) which utterances to 
+    write (e.g., lambda u: len(u.words.split()) > 3). 
+    """
+
+    def __init__(self, outname, columns=None, row_filter=None, delim='\t'):
+
+        if columns is None:
+            columns = UTTERANCE_HEADING
+        for column in columns:
+            if column not in UTTERANCE_HEADING:
+                raise ValueError(f"Unknown column: {column}")
+        self.columns = columns
+        self.row_filter = row_filter
+        self.delim = delim
+        self.num_rows = 0
+
+        if outname.endswith('.gz'):
+            self.out = gzip.open(outname, 'wt')
+        else:
+            self.out = open(outname, 'w', buffering=1 << 20)
+        self.out.write(delim.join(columns) + '\n')
 
-    print(f"Formatting transcripts to tsv")
+    def write_transcript(self, transcript, transcript_num):
+        delim = self.delim
+        for entry in transcript.iter_rows(transcript_num, self.row_filter, self.columns):
+            self.out.write(delim.join(map(str, entry)) + '\n')
+            self.num_rows += 1
 
-    if type(transcripts) == dict:
-        transcripts = list(transcripts.values())
+    def close(self):
+        self.out.close()
 
-    groupSize = 10
+    def __enter__(self):
+        return self
 
-    utters_str = ''
-    idx_start = 0
-    for idx, transcript in enumerate(transcripts):
+    def __exit__(self, *exc):
+        self.close()
 
-        utter_heading, utter_str = transcript.to_str('utterance', idx)
-        if idx == 0:
-            utters_str += utter_heading + '\n' + utter_str
-        else:
-            utters_str += utter_str
+def transcripts2csv(transcripts, outname='temp.tsv', columns=None, row_filter=None):
+
+    print(f"Formatting transcripts to tsv")
+
+    if type(transcripts) == dict:
+        transcripts = list(transcripts.values())
 
     print(f"Saving info to {outname}...")
-    with open(outname, 'w') as o:
-        o.write(utters_str)
+    with TSVWriter(outname, columns, row_filter) as writer:
+        for idx, transcript in enumerate(transcripts):
+            with PROFILER.stage('export', item=transcript.html):
+                writer.write_transcript(transcript, idx)
 
 class Transcript:
 
@@ -33,35 +111,45 @@ class Transcript:
         for tape in self.tapes:
             yield tape
 
+    def get_transcribed(self):
+        """Yields (tape, chunk, utterance num, speaker utterance num, 
+        speaker info, utterance) for each aligned utterance"""
+        for tape in self.tapes:
+            for chunk in tape:
+                if chunk.speaker in self.speakers:
+                    speaker_info = self.speakers[chunk.speaker]
+                else:
+                    speaker_info = {}
+                    speaker_info['gender'] = 'u'
+                    speaker_info['age'] = 'unknown'
+                chunk_num = 0
+                for utterance_num, utterance in chunk.get_transcribed():
+                    chunk_num += 1
+                    yield tape, chunk, utterance_num, chunk_num, speaker_info, utterance
+
+    def iter_rows(self, transcript_num=0, row_filter=None, columns=None):
+        """Yields the values of columns (default UTTERANCE_HEADING) 
+        for each aligned utterance (for which row_filter is true, if 
+        given). Only the values of columns are built."""
+
+        if columns is None:
+            columns = UTTERANCE_HEADING
+        getters = [ROW_VALUES.get(column) for column in columns]
+        for row in self.get_transcribed():
+            utterance = row[-1]
+            if row_filter is not None and not row_filter(utterance):
+                continue
+            yield [utterance.get_value(column, transcript_num) if get is None else get(row) 
+                    for column, get in zip(columns, getters)]
+
     def to_str(self, level, transcript_num = 0, delim='\t'):
 
-        heading = ['tape', 'speaker', 'gender', 'age', 
-                'tape utterance num', 'speaker utterance num']
+        heading = delim.join(UTTERANCE_HEADING)
         entries = []
         if level == 'utterance':
-            for tape in self.tapes:
-                for chunk in tape:
-                    chunk_num = 0
-                    for utterance_num, utterance in chunk.get_transcribed():
-                        chunk_num += 1
-                        if chunk.speaker in self.speakers:
-                            speaker_info = self.speakers[chunk.speaker]
-                        else:
-                            speaker_info = {}
-                            speaker_info['gender'] = 'u'
-                            speaker_info['age'] = 'unknown'
-                        entry = [tape.text, chunk.speaker, speaker_info['gender'], 
-                                speaker_info['age'], utterance_num, chunk_num]
-
-                        entry_dict = utterance.get_entry_dict(transcript_num)
-                        entry.extend(list(entry_dict.values()))
-                        if len(heading) < len(entry):
-                            heading.extend(list(entry_dict.keys()))
-
-                        entries.append(delim.join(list(map(lambda x: str(x), entry))))
-
-        heading = delim.join(heading)
-        return heading, '\n'.join(entries)+'\n'
+            for entry in self.iter_rows(transcript_num):
+                entries.append(delim.join(map(str, entry)) + '\n')
+        return heading, ''.join(entries)
 
 class Tape:
 
@@ -91,6 +179,19 @@ class Chunk:
             yield num, utter
 
 class Utterance:
+    """One utterance of a transcript and, once aligned, its 
+    cleaned words, phones and start/end times in the TextGrid. 
+
+    There is one Utterance per utterance in the corpus, so it is 
+    kept small: attributes are slots (no per object dict), file 
+    names and links are interned (shared by all the utterances of 
+    a tape), and the derived strings of a tsv row (links, clip 
+    commands) are only built when they are asked for (see 
+    get_value). 
+    """
+
+    __slots__ = ('text', 'start', 'end', 'words', 'phones', 'word_times', 
+            'phone_times', 'wavfname', 'textgridfname', 'transcriptlink', 'wavlink')
 
     def __init__(self, text):
 
@@ -99,53 +200,78 @@ class Utterance:
         self.end = 0
         self.words = ''
         self.phones = ''
+        #start and end time of each word and of each phone (arrays 
+        #of doubles, start0, end0, start1, end1, ...) once aligned
+        self.word_times = None
+        self.phone_times = None
         self.wavfname = ''
         self.textgridfname = ''
         self.transcriptlink = ''
+        self.wavlink = ''
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ 
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        #Pickles from before slots have (dict, None) or a dict
+        if isinstance(state, tuple):
+            state = {k: v for part in state if part for k, v in part.items()}
+        self.word_times = None
+        self.phone_times = None
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __iter__(self):
         for word in self.words:
             yield word
 
     def set_fnames(self, f):
-        self.textgridfname = f.textgrid.split('/')[-1]
-        self.wavfname = f.wav.split('/')[-1]
-        self.wavlink = f.wav
-        self.transcriptlink = f.html
+        self.textgridfname = sys.intern(f.textgrid.split('/')[-1])
+        self.wavfname = sys.intern(f.wav.split('/')[-1])
+        self.wavlink = sys.intern(f.wav)
+        self.transcriptlink = sys.intern(f.html)
 
-    def get_entry_dict(self, transcript_num, padding=30):
+    def cleaned_text(self):
+        return self.words.strip()
 
+    def phones_str(self):
+        #Some phonemes are lower case?? ae2 in D90_1.TextGrid
+        return '| '+self.phones.strip().upper()
 
-        clean_text = self.words.strip()
+    def clip_link(self, padding=0):
+        if padding == 0:
+            return self.wavlink+'?t='+str(self.start)+','+str(self.end)
+        return self.wavlink+'?t='+str(max(self.start-padding, 0))+','+str(self.end+padding)
 
-        #Some phonemes are lower case?? ae2 in D90_1.TextGrid
-        phones_str = '| '+self.phones.strip().upper()
-
-        link = self.wavlink
-        clip_link = self.wavlink+'?t='+str(self.start)+','+str(self.end)
-        padded_link = self.wavlink+'?t='+str(max(self.start-padding, 0))+','+str(self.end+padding)
-        UID = self.textgridfname.split('.TextGrid')[0]+'_'+str(self.start)+'_'+str(self.end)
-
-        command = f"python clip.py --start {self.start} --end {self.end} --textgrid_fname {self.textgridfname} --out_fname {UID} --getwav"
-
-        UID_pad = self.textgridfname.split('.TextGrid')[0]+'_'+str(self.start)+'_'+str(self.end)+'_pad'+str(padding)
-        pad_command = f"python clip.py --start {self.start} --end {self.end} --textgrid_fname {self.textgridfname} --out_fname {UID_pad} --getwav --padding {padding}"
-
-
-        entry_dict = {
-                'transcript num': transcript_num,
-                'utterance text': self.text, 
-                'cleaned text': clean_text, 
-                'phones': phones_str, 
-                'start time': self.start, 
-                'end time': self.end, 
-                'wav fname': self.wavfname,
-                'TextGrid fname': self.textgridfname,
-                'tanscript html': self.transcriptlink,
-                'link': link, 
-                'clip link': clip_link,
-                'padded clip link': padded_link, 
-                'python clip command': command, 
-                'python padded clip command': pad_command}
-
-        return entry_dict
+    def clip_command(self, padding=0):
+        return clip_command(self.textgridfname, self.start, self.end, padding)
+
+    def get_value(self, column, transcript_num=0, padding=30):
+        """Returns the value of one column of get_entry_dict, 
+        building only what that column needs"""
+        return UTTERANCE_VALUES[column](self, transcript_num, padding)
+
+    def get_entry_dict(self, transcript_num, padding=30):
+
+        return {column: get_value(self, transcript_num, padding) 
+                for column, get_value in UTTERANCE_VALUES.items()}
+
+#Columns of an utterance row (in order) and how to get each from 
+#(utterance, transcript num, padding)
+UTTERANCE_VALUES = {
+        'transcript num': lambda u, num, padding: num,
+        'utterance text': lambda u, num, padding: u.text,
+        'cleaned text': lambda u, num, padding: u.cleaned_text(),
+        'phones': lambda u, num, padding: u.phones_str(),
+        'start time': lambda u, num, padding: u.start,
+        'end time': lambda u, num, padding: u.end,
+        'wav fname': lambda u, num, padding: u.wavfname,
+        'TextGrid fname': lambda u, num, padding: u.textgridfname,
+        'tanscript html': lambda u, num, padding: u.transcriptlink,
+        'link': lambda u, num, padding: u.wavlink,
+        'clip link': lambda u, num, padding: u.clip_link(),
+        'padded clip link': lambda u, num, padding: u.clip_link(padding),
+        'python clip command': lambda u, num, padding: u.clip_command(),
+        'python padded clip command': lambda u, num, padding: u.clip_command(padding),
+        }
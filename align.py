@@ -1,16 +1,152 @@
-import requests
-from collections import namedtuple
-import textgrid
+from array import array
+from collections import namedtuple, deque
 import re
+from time import perf_counter
 
-from BNCClasses import Transcript, Tape, Chunk, Utterance, transcripts2csv
+from BNCClasses import Transcript, Tape, Chunk, Utterance, transcripts2csv, TSVWriter
+from normalize import normalize_utterance, strip_punctuation
+from tiers import load_tiers
+from fetch import iter_pages, ordered_map
+from store import ArtifactStore, unit_key
+from corpus import CorpusWriter, export_corpus
+from profiling import PROFILER, collect
 
 from bs4 import BeautifulSoup
 
 FileSet = namedtuple("FileSet", "textgrid, wav, html")
 
 
-def get_transcripts(htmls):
+def parse_page(content, parser='bs4'):
+    """Returns the headings and the table cells of a transcript 
+    page. Each cell is the list of text strings in it, so 
+    ''.join(cell) is BeautifulSoup's get_text() and joining the 
+    stripped strings is get_text(strip=True). 
+
+    parser is 'bs4' (BeautifulSoup with html.parser) or 'lxml', 
+    which is much faster on large transcripts and gives the 
+    same headings and cells (bench.py parse --check compares them). 
+
+    Returns: 
+        List[str], List[List[List[List[str]]]]: Text of the h4 headings 
+                            (stripped) and, for each table, its rows 
+                            of cells. 
+    """
+
+    if parser == 'bs4':
+        soup = BeautifulSoup(content, "html.parser")
+        headings = [heading.get_text(strip=True) for heading in soup.findAll("h4")]
+        tables = []
+        for table in soup.findAll("table"):
+            tables.append([[list(cell.strings) for cell in row.findAll('td')] 
+                for row in table.findAll("tr")])
+
+    elif parser == 'lxml':
+        import lxml.html
+        from lxml import etree
+        from bs4 import UnicodeDammit
+
+        #Decode like BeautifulSoup does, libxml2 assumes latin-1
+        doc = lxml.html.fromstring(UnicodeDammit(content).unicode_markup)
+        #get_text() skips the text of script and style
+        etree.strip_elements(doc, 'script', 'style', with_tail=False)
+        headings = [''.join(text.strip() for text in heading.itertext()) 
+                for heading in doc.iter('h4')]
+        tables = []
+        for table in doc.iter('table'):
+            tables.append([[list(cell.itertext()) for cell in row.iter('td')] 
+                for row in table.iter('tr')])
+
+    else:
+        raise ValueError(f"Unknown parser: {parser}")
+
+    return headings, tables
+
+def build_transcript(html, headings, tables):
+    """Returns an instance of Transcript for the page html given 
+    its headings and tables (see parse_page). 
+
+    Returns: 
+        Transcript: Speaker info and the Tapes (with Chunks of 
+                    Utterances) of the page. 
+    """
+
+    transcript = Transcript(html)
+
+    hasSpeakerInfo = 1
+    if 'speaker' not in headings[0] and 'recorded' not in headings[0]:
+        hasSpeakerInfo = 0
+
+    speakers = {}
+
+    if hasSpeakerInfo:
+        #Get info from speaker table
+        speaker_table = tables[0]
+        for row in speaker_table:
+            cells = [''.join(text.strip() for text in cell).replace('\n', '') for cell in row]
+            speaker = cells[0].split(' ')[0]
+            ageCat = cells[1]
+            gender = cells[2]
+            extra = cells[3]
+            age = extra.split(',')[1].split(')')[0].replace('age', '').strip()
+
+            speakers[speaker] = {'ageCat': ageCat, 'gender': gender, 'age': age, 'extra': extra}
+        #Dialogues are 3rd table onward
+        dialogues = tables[1:]
+        tapes = headings[2:]
+
+    #No speaker info (e.g., http://bnc.phon.ox.ac.uk/transcripts-html/HYG.html)
+    else:
+        dialogues = tables
+        tapes = headings[1:]
+
+    #add transcript speaker info
+    transcript.speakers = speakers
+
+    #Ensure everything is good
+    assert len(tapes) == len(dialogues), 'Mismatch in tape titles and dialogues'
+
+    re_decimal = re.compile('[0-9_]+')
+
+    for tape, dialogue in zip(tapes, dialogues):
+        TAPE = Tape(tape)
+        transcript.tapes.append(TAPE)
+
+        for row in dialogue:
+            nums = []
+            utterances = []
+
+            cells = [''.join(cell) for cell in row]
+
+            #Sanity check
+            assert len(cells) == 2, "More cells than expected for speech act"
+
+            speaker = cells[0].strip().split('(')[-1].replace(')', '').strip()
+            speech_acts = cells[1].strip().split('\n')
+            for speech_act in speech_acts:
+                speech_act = speech_act.strip().split(' ')
+                num = speech_act[0].replace('[', '').replace(']', '')
+
+                #Get rid of empty spaces
+                words = []
+                for word in speech_act[1:]:
+                    word = word.strip()
+                    if word != '':
+                        words.append(word)
+                utterance = ' '.join(words)
+
+                if re.match(re_decimal, num) is None:
+                    continue
+
+                nums.append(num)
+                utter = Utterance(utterance)
+                utterances.append(utter)
+
+            chunk = Chunk(speaker, nums, utterances)
+            TAPE.chunks.append(chunk)
+    return transcript
+
+def get_transcripts(htmls, cache_path='data/html/', workers=8, 
+        mirror=None, offline=False, parser='bs4'):
     """Returns instances of Transcript organized in a dictionary for
     quick search by html.
 
@@ -22,6 +158,12 @@ def get_transcripts(htmls):
     one speaker. The first unit is spoken by D90PS000 which contains 
     8 utterances (e.g., the 8th is "So Brenda"). 
 
+    The html is fetched with fetch.iter_pages by workers threads and 
+    kept in a local cache under cache_path, so rebuilding transcripts 
+    later needs no network (offline makes this a requirement). mirror 
+    is a directory of saved pages or a base url to fetch from instead 
+    of the BNC site. parser is the html parser backend (see parse_page). 
+
     Returns: 
         Dict[Transcript]: Dict index by html of transcript information. 
                             Transcipt corresponds to all the info from 
@@ -38,92 +180,17 @@ def get_transcripts(htmls):
 
     transcripts = {}
 
-    for html in htmls:
+    pages = iter_pages(htmls, cache_path, workers, mirror=mirror, 
+            offline=offline)
+    for html, content in PROFILER.iterate('fetch', pages, lambda page: page[0]):
 
         print(f"Loading {html}...")
         #if html != 'http://bnc.phon.ox.ac.uk/transcripts-html/HYG.html':
         #    continue
         
-        transcript = Transcript(html)
-        transcripts[html] = transcript
-
-        #Load html
-        soup = BeautifulSoup(requests.get(html).content, "html.parser")
-
-        tables = soup.findAll("table")
-        headings = [heading.get_text(strip=True) for heading in soup.findAll("h4")]
-
-        hasSpeakerInfo = 1
-        if 'speaker' not in headings[0] and 'recorded' not in headings[0]:
-            hasSpeakerInfo = 0
-
-        speakers = {}
-
-        if hasSpeakerInfo:
-            #Get info from speaker table
-            speaker_table = tables[0]
-            for row in speaker_table.findAll("tr"):
-                cells = [cell.get_text(strip=True).replace('\n', '') for cell in row.findAll('td')]
-                speaker = cells[0].split(' ')[0]
-                ageCat = cells[1]
-                gender = cells[2]
-                extra = cells[3]
-                age = extra.split(',')[1].split(')')[0].replace('age', '').strip()
-
-                speakers[speaker] = {'ageCat': ageCat, 'gender': gender, 'age': age, 'extra': extra}
-            #Dialogues are 3rd table onward
-            dialogues = tables[1:]
-            tapes = headings[2:]
-
-        #No speaker info (e.g., http://bnc.phon.ox.ac.uk/transcripts-html/HYG.html)
-        else:
-            dialogues = tables
-            tapes = headings[1:]
-
-        #add transcript speaker info
-        transcript.speakers = speakers
-
-        #Ensure everything is good
-        assert len(tapes) == len(dialogues), 'Mismatch in tape titles and dialogues'
-
-        re_decimal = re.compile('[0-9_]+')
-
-        for tape, dialogue in zip(tapes, dialogues):
-            TAPE = Tape(tape)
-            transcript.tapes.append(TAPE)
-
-            for row in dialogue.findAll("tr"):
-                nums = []
-                utterances = []
-
-                cells = [cell.get_text() for cell in row.findAll('td')]
-
-                #Sanity check
-                assert len(cells) == 2, "More cells than expected for speech act"
-
-                speaker = cells[0].strip().split('(')[-1].replace(')', '').strip()
-                speech_acts = cells[1].strip().split('\n')
-                for speech_act in speech_acts:
-                    speech_act = speech_act.strip().split(' ')
-                    num = speech_act[0].replace('[', '').replace(']', '')
-
-                    #Get rid of empty spaces
-                    words = []
-                    for word in speech_act[1:]:
-                        word = word.strip()
-                        if word != '':
-                            words.append(word)
-                    utterance = ' '.join(words)
-
-                    if re.match(re_decimal, num) is None:
-                        continue
-
-                    nums.append(num)
-                    utter = Utterance(utterance)
-                    utterances.append(utter)
-
-                chunk = Chunk(speaker, nums, utterances)
-                TAPE.chunks.append(chunk)
+        with PROFILER.stage('parse', item=html):
+            headings, tables = parse_page(content, parser)
+            transcripts[html] = build_transcript(html, headings, tables)
     return transcripts
 
 def align_text_transcriptions(utter, words):
@@ -131,39 +198,20 @@ def align_text_transcriptions(utter, words):
     from transcript) with words in TextGrid (textgrid 
     object) 
 
+    words is a deque of the word intervals of the whole 
+    tape, which is shared by all the utterances in the tape. 
+    Aligned intervals are consumed from the left with popleft, 
+    so aligning a tape is linear in its length. 
+
     Returns: 
         List[Tuple]: List of tuples with words in transcript text 
                     aligned with transcribed words. Throws an 
                     AssertationError if alignment fails.
     """
 
-    re_dots = re.compile('[\.]{2,6}')
-    re_brackets = re.compile("\[[a-z\s*\'\+A-Z]*\]")
-    re_dates = re.compile('[0-9]+th')
-
-    utter = utter.replace('/', ' ').replace('-', ' ')
-    utter = utter.replace(' & ', ' and')
-    utter = re.sub(re_brackets, '', utter)
-
-    ###Bunch of random issues
-    utter = utter.replace('—', '')
-    #I could parse this issue away...
-    utter = utter.replace(" 's", "'s")
-    utter = utter.replace(" n't", "n't")
-    utter = utter.replace(" 'll", "'ll")
-    utter = utter.replace("]'s", "] 's")
-    utter = utter.replace(" 'un", "'un")
-    utter = utter.replace("an' ", "an'")
-    utter = utter.replace("o' ", "o'")
-    utter = utter.replace("o 'clock", "o'clock")
-    utter = utter.replace("Now,Mond", "Now, Mond")
-    utter = utter.replace(".ep", "")
-    utter = utter.replace("oiA_011207.tmp", 'oiA_011207 .tmp')
-    utter = utter.replace("smelly's", "smelly 's")
-    utter = utter.replace("0's", "0 's")
-    utter = utter.replace("&;", "")
-    #fix comma without space
-    utter = re.sub(r"(?<=[,])(?=[^\s])", r" ", utter)
+    start = perf_counter()
+    utter = normalize_utterance(utter)
+    PROFILER.add('normalize', perf_counter()-start)
 
     #word in utterance text X list of transcribed words
     utter_words = []
@@ -171,13 +219,13 @@ def align_text_transcriptions(utter, words):
     for text_word in utter.split(' '):
         text_word = text_word.strip()
         #String trailing punctuation
-        plain_word = text_word.translate(str.maketrans('', '', ",.;:?!)(")).lower()
+        plain_word = strip_punctuation(text_word).lower()
 
         if text_word == '' or plain_word == '' or text_word == "'":# or plain_word.isnumeric():
             continue
 
         assert len(words) != 0
-        grid_word = words.pop(0)
+        grid_word = words.popleft()
 
         #Weird coding issue with ed.2 in http://bnc.phon.ox.ac.uk/transcripts-html/KDP.html
         if plain_word == 'ed2':
@@ -210,12 +258,12 @@ def align_text_transcriptions(utter, words):
                     '{gap_anonymization_address}', 
                     '{gap_anonymization_telephonenumber}'}):
                 assert len(words) != 0
-                grid_word = words.pop(0)
+                grid_word = words.popleft()
                 grid_text = grid_word.mark.lower()
             else:
                 grid_words = [grid_word]
                 assert len(words) != 0
-                new_grid_word = words.pop(0)
+                new_grid_word = words.popleft()
                 grid_words.append(new_grid_word)
                 new_text = new_grid_word.mark.lower()
                 if new_text in {'{gap_anonymization}', 
@@ -236,8 +284,279 @@ def align_text_transcriptions(utter, words):
     return utter_words
 
 
+#TextGrid words skipped before a word (at no cost by align_banded) 
+#and dropped when joined to the previous word, as in 
+#align_text_transcriptions
+GAP_MARKS = {'{gap_anonymization}', '{lg}', '{xx}', '{gap_anonymization_name}', 
+        '{cg}', '{br}', '{gap_name}', '{gap_address}', '{gap_anonymization_address}', 
+        '{gap_anonymization_telephonenumber}'}
+JOINED_GAP_MARKS = {'{gap_anonymization}', '{gap_anonymization_name}', '{gap_name}', 
+        '{gap_anonymization_address}', '{lg}'}
+
+#Costs of align_banded: a transcript word with no TextGrid words 
+#costs more than a TextGrid word with no transcript word, and TextGrid 
+#words are cheaper to skip before an utterance (e.g., speech missing 
+#from the transcript) than between its words
+SKIP_TEXT_COST = 3
+SKIP_GRID_COST = 2
+SKIP_LEADING_COST = 1
+#Most TextGrid words one transcript word is joined from (as the 5 
+#tries of align_text_transcriptions) and the width of the band
+MAX_JOIN = 5
+BAND = 8
+
+def text_words(utter):
+    """Returns (text word, plain word) for each word of utter that 
+    is aligned (the words align_text_transcriptions aligns, with 
+    the plain words it compares with the TextGrid)"""
+
+    start = perf_counter()
+    utter = normalize_utterance(utter)
+    PROFILER.add('normalize', perf_counter()-start)
+
+    pairs = []
+    for text_word in utter.split(' '):
+        text_word = text_word.strip()
+        plain_word = strip_punctuation(text_word).lower()
+        if text_word == '' or plain_word == '' or text_word == "'":
+            continue
+        if plain_word == 'ed2':
+            plain_word = 'ed'
+        if plain_word[-1] == "'":
+            plain_word = plain_word[:-1]
+        pairs.append((text_word, plain_word))
+    return pairs
+
+def join_marks(marks):
+    """Returns the text of TextGrid words (lower case marks) joined 
+    the way align_text_transcriptions joins them"""
+
+    text = marks[0]
+    for mark in marks[1:]:
+        text += '' if mark in JOINED_GAP_MARKS else mark
+        if text == 'dyou':
+            text = "d'you"
+    return text
+
+def words_match(plain_word, grid_text):
+    """Returns whether a plain transcript word matches the text of 
+    TextGrid words (with the rules of align_text_transcriptions)"""
+    return (grid_text == plain_word or grid_text == '{oov}' or 
+            plain_word.replace("'", '') == grid_text or 
+            grid_text.replace("'", '') == plain_word or 
+            plain_word.replace("'", '') == grid_text.replace("'", ''))
+
+def align_banded(utter, words, marks, pos, band=BAND):
+    """Aligns the words in utter (string from transcript) with the 
+    TextGrid words from words[pos] on by banded edit distance. 
+
+    words is the list of word intervals of the whole tape and marks 
+    their lower case marks. Each transcript word either matches 1 to 
+    MAX_JOIN consecutive TextGrid words (joined and compared as in 
+    align_text_transcriptions) or is skipped, and TextGrid words can 
+    be skipped in between (gaps like {xx} for free). Of paths with 
+    the same cost, the one that skips fewer transcript words is 
+    best. Only cells within band TextGrid words of the best cell of 
+    each transcript word (and of the best that skipped the fewest 
+    words) are kept, so an utterance of n words costs O(n*band) and 
+    a tape is aligned in one pass. 
+
+    Returns: 
+        List[Tuple], int: Tuples of words in transcript text aligned 
+                    with TextGrid words as from align_text_transcriptions 
+                    (None if some transcript word matched nothing) and the 
+                    position in words the next utterance starts from. This 
+                    is after the last matched TextGrid word, also when the 
+                    alignment fails, or pos if nothing matched.
+    """
+
+    pairs = text_words(utter)
+    if not pairs:
+        return [], pos
+    num_marks = len(marks)
+    joined = {}
+
+    def grid_skips(row, skip_cost=SKIP_GRID_COST):
+        #skip TextGrid words from every cell (in order, so each 
+        #cell is final before it is extended)
+        limit = max(row) + band
+        j = min(row)
+        while j < min(limit, num_marks):
+            if j in row:
+                cost, skipped = row[j][0]
+                score = (cost + (0 if marks[j] in GAP_MARKS else skip_cost), skipped)
+                if j+1 not in row or score < row[j+1][0]:
+                    row[j+1] = (score, j, 'grid')
+            j += 1
+        return row
+
+    def best(row):
+        return min(row, key=lambda j: (row[j][0], j))
+
+    def prune(row):
+        #around the best cell and the best cell of the paths that 
+        #skipped the fewest transcript words (which can be behind 
+        #when TextGrid words were skipped to catch up)
+        centers = [best(row), min(row, key=lambda j: (row[j][0][1], row[j][0][0], j))]
+        return {j: cell for j, cell in row.items() 
+                if any(abs(j-center) <= band for center in centers)}
+
+    #rows[i][j] is ((cost, transcript words skipped), previous j, move) 
+    #of aligning the first i transcript words with the TextGrid words 
+    #from pos to j
+    rows = [prune(grid_skips({pos: ((0, 0), None, None)}, SKIP_LEADING_COST))]
+    for _, plain_word in pairs:
+        row = {}
+        for j in sorted(rows[-1]):
+            cost, skipped = rows[-1][j][0]
+            for k in range(1, min(MAX_JOIN, num_marks-j)+1):
+                if (j, k) not in joined:
+                    joined[j, k] = join_marks(marks[j:j+k])
+                #words are only joined until they match (as greedily)
+                if words_match(plain_word, joined[j, k]):
+                    if j+k not in row or (cost, skipped) < row[j+k][0]:
+                        row[j+k] = ((cost, skipped), j, 'match')
+                    break
+            score = (cost + SKIP_TEXT_COST, skipped + 1)
+            if j not in row or score < row[j][0]:
+                row[j] = (score, j, 'text')
+        rows.append(prune(grid_skips(row)))
+
+    #best score, then fewest TextGrid words (trailing gaps are 
+    #left to the next utterance)
+    j = best(rows[-1])
+    matches = []
+    skipped = False
+    for i in range(len(pairs), 0, -1):
+        #TextGrid words skipped after transcript word i
+        while rows[i][j][2] == 'grid':
+            j = rows[i][j][1]
+        _, prev, move = rows[i][j]
+        if move == 'match':
+            matches.append((pairs[i-1][0], prev, j))
+        else:
+            skipped = True
+        j = prev
+    matches.reverse()
+
+    end = matches[-1][2] if matches else pos
+    if skipped or not matches:
+        return None, end
+    return [(text_word, words[start:stop]) for text_word, start, stop in matches], end
+
+def align_fileset(f, tape, textgrid_path='data/AudioBNCTextGrids/', 
+        cache_path='data/tiercache/', aligner='greedy'):
+    """Aligns the utterances in tape with the word and phone 
+    tiers of the TextGrid in FileSet f. This is the unit of 
+    work for get_aligned_utterances, so it only touches one 
+    Tape and can be run in a separate process. 
+
+    aligner is 'greedy' (align_text_transcriptions, which stops at 
+    the first mismatch and leaves the word tier where it failed) or 
+    'dp' (align_banded, which skips unmatched TextGrid words and 
+    picks up after a failed utterance at its last matched word). 
+    The two can differ even where greedy has no issues: after a gap 
+    ({xx}, {br}, ...) dp takes the times and phones of the word, 
+    greedy those of the gap. 
+
+    Returns: 
+        Tape, List[str], List[str]: The tape with transcribed_utterances 
+                            filled in, lines for errorful_textgrids.txt, 
+                            and lines for alignment_issues.txt. 
+    """
+
+    errors = []
+    alignment_issues = []
+
+    textgrid_fname = textgrid_path+f.textgrid.split('/')[-1]
+    try:
+        with PROFILER.stage('textgrid', item=textgrid_fname):
+            tg = load_tiers(textgrid_fname, cache_path)
+        phones, words = tg[0], tg[1]
+    except:
+        errors.append(f.textgrid+'\n')
+        tg = None
+
+    if tg is None:
+        return tape, errors, alignment_issues
+
+    #safety check
+    assert tg[0].name == 'phone' and tg[1].name == 'word'
+
+    #Filter out pauses and make
+    #queue of intervals
+    words = deque(filter(lambda x: not (x.mark == 'sp'), words))#or x.mark[0] == '{'), words))
+    if aligner == 'dp':
+        words = list(words)
+        marks = [w.mark.lower() for w in words]
+        pos = 0
+    start = perf_counter()
+    num_utterances = 0
+    for chunk in tape:
+        for utterance in chunk:
+            num_utterances += 1
+            utter = utterance.text
+            utterance.set_fnames(f)
+            if aligner == 'dp':
+                utter_words, pos = align_banded(utter, words, marks, pos)
+                if utter_words is None:
+                    alignment_issues.append(f"utterance {utter} textgrid: {f.textgrid} html: {f.html}\n")
+                    continue
+            else:
+                try:
+                    utter_words = align_text_transcriptions(utter, words)
+                except AssertionError:
+                    alignment_issues.append(f"utterance {utter} textgrid: {f.textgrid} html: {f.html}\n")
+                    continue
+
+            #words and phones are joined once per utterance 
+            #(as ' word' and 'phones | ' per word)
+            utter_text = []
+            utter_phones = []
+            utter_times = array('d')
+            utter_phone_times = array('d')
+            try:
+                for idx, w in enumerate(utter_words):
+                    w_text, intervals = w
+                    utter_text.append(strip_punctuation(w_text).lower())
+
+                    w_start = intervals[0].minTime
+                    w_end = intervals[-1].maxTime
+                    if idx == 0:
+                        utterance.start = w_start
+                    phone_start, phone_end = phones.span(w_start, w_end)
+                    utter_phones.append(' '.join(phones.marks[phone_start:phone_end]))
+                    for phone_idx in range(phone_start, phone_end):
+                        utter_phone_times.append(phones.starts[phone_idx])
+                        utter_phone_times.append(phones.ends[phone_idx])
+                    utter_times.append(w_start)
+                    utter_times.append(w_end)
+            except ValueError:
+                #a word boundary in a hole of the phone tier
+                alignment_issues.append(f"utterance {utter} textgrid: {f.textgrid} html: {f.html}\n")
+                continue
+
+            if utter_text:
+                utterance.words = ' ' + ' '.join(utter_text)
+                utterance.phones = ' | '.join(utter_phones) + ' | '
+                utterance.word_times = utter_times
+                utterance.phone_times = utter_phone_times
+            utterance.end = w_end
+            chunk.transcribed_utterances.append(utterance)
+
+    PROFILER.add('align', perf_counter()-start, num_utterances, textgrid_fname)
+    return tape, errors, alignment_issues
+
+def _align_fileset_job(job):
+    """Unpacks a (FileSet, Tape, textgrid_path, cache_path, aligner) 
+    job for executor.map in get_aligned_utterances, returning the 
+    result of align_fileset and the stages it recorded (see 
+    profiling.collect)"""
+    return collect(align_fileset, *job)
+
 def get_aligned_utterances(files, transcripts, 
-        textgrid_path='data/AudioBNCTextGrids/'):
+        textgrid_path='data/AudioBNCTextGrids/', workers=1, 
+        cache_path='data/tiercache/', aligner='greedy'):
     """Returns updated instances of Transcript, with 
     word and phone level transcriptions aligned, 
     organized in a dictionary for quick search by html.
@@ -254,8 +573,18 @@ def get_aligned_utterances(files, transcripts,
     other details (e.g., word alignments, were removed). 
     Running clip.py will align words with clipped audio, however.
 
+    Each FileSet (TextGrid and its Tape) is aligned independently 
+    by align_fileset. With workers > 1 the FileSets are spread 
+    over a process pool and the aligned tapes (and log lines) 
+    are merged back in the order of files, so the output is 
+    the same as a serial run. 
+
+    TextGrids are read with tiers.load_tiers, which keeps a binary 
+    cache of the parsed tiers under cache_path (None turns it off). 
+    aligner is 'greedy' or 'dp' (see align_fileset). 
+
     Note: This catches assertation errors from get_aligned_utterances 
-            and errors from loading TextGrids with textgrid. The former 
+            and errors from loading TextGrids. The former 
             is recorded in alignment_issues.txt, and the later 
             is recorded in errorful_textgrids.txt.
 
@@ -275,74 +604,284 @@ def get_aligned_utterances(files, transcripts,
                             at the natural groupings. 
     """
 
-    errors = open('errorful_textgrids.txt', 'w')
-    alignment_issues = open('alignment_issues.txt', 'w')
-
+    #(transcript, tape index) and (FileSet, Tape, textgrid_path, cache_path, 
+    #aligner) for each FileSet, in the order of files
+    targets = []
+    jobs = []
     for f in files:
         if f.html not in transcripts:
             continue
 
-        print(f"aligning {f.textgrid}...")
-
         transcript = transcripts[f.html]
         tape_num = int(f.textgrid.split('.TextGrid')[0].split('_')[-1])
         tape = transcript.tapes[tape_num-1]
 
-        textgrid_fname = textgrid_path+f.textgrid.split('/')[-1]
-        try:
-            tg = textgrid.TextGrid.fromFile(textgrid_fname)
-        except:
-            errors.write(f.textgrid+'\n')
-            tg = None
-
-        if tg is None:
-            continue
+        targets.append((transcript, tape_num-1))
+        jobs.append((f, tape, textgrid_path, cache_path, aligner))
 
-        phones, words = tg[0], tg[1]
-        #safety check
-        assert tg[0].name == 'phone' and tg[1].name == 'word'
-
-        #Filter out pauses and make
-        #list of intervals
-        words = list(filter(lambda x: not (x.mark == 'sp'), words))#or x.mark[0] == '{'), words))
-        for chunk in tape:
-            for utterance in chunk:
-                utter = utterance.text
-                utterance.set_fnames(f)
-                try:
-                    utter_words = align_text_transcriptions(utter, words)
-                except AssertionError:
-                    alignment_issues.write(f"utterance {utter} textgrid: {f.textgrid} html: {f.html}\n")
-                    continue
-
-                for idx, w in enumerate(utter_words):
-                    w_text, intervals = w
-                    w_original = w_text
-                    w_text = w_text.translate(str.maketrans('','', ",.;:?!)(")).lower()
-                    #utterance.words.append(w_text)
-                    utterance.words += ' ' +w_text
+    errors = open('errorful_textgrids.txt', 'w')
+    alignment_issues = open('alignment_issues.txt', 'w')
 
-                    w_start = intervals[0].minTime
-                    w_end = intervals[-1].maxTime
-                    if idx == 0:
-                        utterance.start = w_start
-                    start_idx = phones.indexContaining(w_start)+1
-                    end_idx = phones.indexContaining(w_end)+1
-                    phones_str = []
-                    for p in phones[start_idx:end_idx]:
-                        phones_str.append(p.mark)
-                    phones_str = ' '.join(phones_str)
-                    #utterance.phones.append(phones_str)
-                    utterance.phones += phones_str + ' | '
-
-                utterance.end = w_end
-                chunk.transcribed_utterances.append(utterance)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_align_fileset_job, jobs)
+    else:
+        executor = None
+        results = map(_align_fileset_job, jobs)
+
+    #map yields in submission order, so logs and 
+    #tapes are merged back deterministically
+    for (transcript, tape_idx), job, result in zip(targets, jobs, results):
+        print(f"aligning {job[0].textgrid}...")
+        (tape, tape_errors, tape_issues), stages = result
+        PROFILER.merge(stages)
+        #a TextGrid that failed to load leaves the tape untouched
+        if not tape_errors:
+            transcript.tapes[tape_idx] = tape
+        errors.writelines(tape_errors)
+        alignment_issues.writelines(tape_issues)
+
+    if executor is not None:
+        executor.shutdown()
 
     errors.close()
     alignment_issues.close()
     return transcripts
 
-def get_utterances(path='data/'):
+def align_transcript(html, content, files, parser='bs4', 
+        textgrid_path='data/AudioBNCTextGrids/', cache_path='data/tiercache/', 
+        aligner='greedy'):
+    """Parses the page of transcript html and aligns its tapes with 
+    their TextGrids (files are the FileSets of html). This is the 
+    unit of work for stream_utterances. 
+
+    Returns: 
+        Transcript, List[List[str]], List[List[str]]: The aligned 
+                            transcript and, for each FileSet in files, 
+                            its lines for errorful_textgrids.txt and 
+                            alignment_issues.txt. 
+    """
+
+    with PROFILER.stage('parse', item=html):
+        transcript = build_transcript(html, *parse_page(content, parser))
+
+    errors = []
+    alignment_issues = []
+    for f in files:
+        tape_num = int(f.textgrid.split('.TextGrid')[0].split('_')[-1])
+        tape = transcript.tapes[tape_num-1]
+        _, tape_errors, tape_issues = align_fileset(f, tape, textgrid_path, 
+                cache_path, aligner)
+        errors.append(tape_errors)
+        alignment_issues.append(tape_issues)
+    return transcript, errors, alignment_issues
+
+def aligner_version(parser='bs4', aligner='greedy'):
+    """Returns a hash of the code and rules that turn a page and its 
+    TextGrids into an aligned transcript: the parsing and alignment 
+    functions here, the classes of BNCClasses they fill in, all of 
+    normalize.py and tiers.py (rules, Normalizer, strip_punctuation, 
+    Tier lookups and the TextGrid reader) and the versions of the 
+    html parser libraries. Stored artifacts built with a different 
+    version are rebuilt. 
+
+    Returns: 
+        str: hex digest
+    """
+
+    import hashlib
+    import inspect
+    import bs4
+    import normalize
+    import tiers
+
+    functions = [parse_page, build_transcript, align_text_transcriptions, 
+            align_fileset, align_transcript, Transcript, Tape, Chunk, 
+            Utterance, normalize, tiers]
+    libraries = [bs4.__version__]
+    if parser == 'lxml':
+        from lxml import etree
+        libraries.append(etree.LXML_VERSION)
+    if aligner == 'dp':
+        functions += [text_words, join_marks, words_match, align_banded]
+        parser = (parser, aligner, sorted(GAP_MARKS), sorted(JOINED_GAP_MARKS), 
+                SKIP_TEXT_COST, SKIP_GRID_COST, SKIP_LEADING_COST, MAX_JOIN, BAND)
+    source = [inspect.getsource(function) for function in functions]
+    return hashlib.sha256(repr((parser, libraries, source)).encode('utf-8')).hexdigest()
+
+def _align_transcript_job(job):
+    """Runs align_transcript for a job from stream_utterances. If 
+    store_path is given, the stored artifact of the transcript is 
+    reused when its inputs (html, TextGrids, parser and aligner) 
+    and the aligner version are unchanged, and otherwise replaced. 
+    With realign_issues, an artifact of another aligner version is 
+    still reused if it has no alignment issues, so a rule fix only 
+    realigns the transcripts with issues. 
+
+    Returns: 
+        Tuple, bool, Dict: The result of align_transcript, whether it 
+                    came from the store and the stages it recorded 
+                    (see profiling.collect). 
+    """
+
+    args, store_path, version, realign_issues = job
+    html, content, files, parser, textgrid_path, cache_path, aligner = args
+
+    def run():
+        if store_path is None:
+            return align_transcript(*args), False
+
+        with PROFILER.stage('store', item=html):
+            store = ArtifactStore(store_path)
+            key = unit_key(content, [textgrid_path+f.textgrid.split('/')[-1] for f in files], 
+                    (parser, aligner))
+            stored = store.get(html, key)
+        if stored is not None:
+            stored_version, result = stored
+            if stored_version == version or (realign_issues and not any(result[2])):
+                return result, True
+
+        result = align_transcript(*args)
+        #counted with the lookup
+        with PROFILER.stage('store', items=0, item=html):
+            store.put(html, key, version, result)
+        return result, False
+
+    (result, stored), stages = collect(run)
+    return result, stored, stages
+
+def stream_utterances(outname='BNCAudio_utterances.tsv', path='data/', 
+        workers=1, fetch_workers=8, mirror=None, offline=False, parser='bs4', 
+        textgrid_path='data/AudioBNCTextGrids/', cache_path='data/tiercache/', 
+        store_path='data/artifacts/', realign_issues=False, corpus_path=None, 
+        columns=None, row_filter=None, aligner='greedy', htmls=None, log_path=''):
+    """Builds the tsv of aligned utterances in one pass, without 
+    the transcripts.pkl and aligned_transcripts.pkl checkpoints. 
+
+    Each transcript is aligned as soon as its page is parsed 
+    (see align_transcript) and its rows are written to outname 
+    straight away, so only the transcripts being worked on are 
+    in memory. With workers > 1, transcripts are parsed and aligned 
+    in a process pool and written in order. The tsv and the log 
+    files are the same as from get_utterances and transcripts2csv. 
+
+    Aligned transcripts are kept in an ArtifactStore under store_path 
+    (None turns it off), keyed by hashes of the html, the TextGrids, 
+    parser and aligner, with the version of the aligner code (see 
+    aligner_version). A rerun realigns the transcripts whose key or 
+    version changed and reassembles the tsv and logs from the stored 
+    pieces. With realign_issues, a new version only realigns the 
+    transcripts with entries in alignment_issues.txt. 
+
+    If corpus_path is given, the rows are also written to a columnar 
+    corpus store there (see corpus.py). columns and row_filter select 
+    the columns and rows of the tsv (see BNCClasses.TSVWriter). 
+    aligner is 'greedy' or 'dp' (see align_fileset). htmls limits 
+    the build to some of the transcripts (e.g., a shard, see 
+    shard.py); they keep the transcript nums of the full build. 
+    The log files are written under log_path. 
+
+    Returns: 
+        int: Number of transcripts written. 
+    """
+
+    files, all_htmls = get_aligned_fnames(path)
+    all_htmls.sort()
+    htmls = all_htmls if htmls is None else sorted(htmls)
+
+    pages = PROFILER.iterate('fetch', iter_pages(htmls, workers=fetch_workers, 
+        mirror=mirror, offline=offline), lambda page: page[0])
+    html_files = _html_files(files)
+    version = aligner_version(parser, aligner)
+    jobs = (((html, content, [files[idx] for idx in html_files[html]], 
+        parser, textgrid_path, cache_path, aligner), store_path, version, 
+        realign_issues) for html, content in pages)
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = ordered_map(executor, _align_transcript_job, jobs, 2*workers)
+    else:
+        executor = None
+        results = map(_align_transcript_job, jobs)
+
+    try:
+        return write_aligned(results, files, all_htmls, outname, corpus_path, 
+                columns, row_filter, log_path)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def _html_files(files):
+    """Returns the indices (into files) of the FileSets of each transcript"""
+    html_files = {}
+    for idx, f in enumerate(files):
+        html_files.setdefault(f.html, []).append(idx)
+    return html_files
+
+def write_aligned(results, files, htmls, outname='BNCAudio_utterances.tsv', 
+        corpus_path=None, columns=None, row_filter=None, log_path=''):
+    """Writes the tsv (and corpus store) of aligned transcripts and 
+    the log files under log_path. results are (result of 
+    align_transcript, whether it was stored, stages recorded) in 
+    the order of htmls, which are all the transcripts of files 
+    (sorted) so transcript nums are the same whichever of them 
+    results has. This is the output of stream_utterances and of 
+    shard.merge_shards, so a merged build is the same as one run. 
+
+    Returns: 
+        int: Number of transcripts written. 
+    """
+
+    transcript_nums = {html: idx for idx, html in enumerate(htmls)}
+    html_files = _html_files(files)
+
+    #log lines of each FileSet, written in the order of files 
+    #at the end (as in get_aligned_utterances)
+    errors = [[] for _ in files]
+    alignment_issues = [[] for _ in files]
+
+    writer = None
+    if corpus_path is not None:
+        writer = CorpusWriter(corpus_path)
+
+    print(f"Saving info to {outname}...")
+    num = 0
+    with TSVWriter(outname, columns, row_filter) as tsv:
+        for result, stored, stages in results:
+            transcript, tape_errors, tape_issues = result
+            idx = transcript_nums[transcript.html]
+            PROFILER.merge(stages)
+            if stored:
+                print(f"reused {transcript.html}...")
+            else:
+                print(f"aligned {transcript.html}...")
+            with PROFILER.stage('export', item=transcript.html):
+                tsv.write_transcript(transcript, idx)
+            if writer is not None:
+                with PROFILER.stage('corpus', item=transcript.html):
+                    writer.add_transcript(transcript, idx)
+
+            for file_idx, e, a in zip(html_files[transcript.html], tape_errors, tape_issues):
+                errors[file_idx] = e
+                alignment_issues[file_idx] = a
+            num += 1
+
+    if writer is not None:
+        writer.close()
+
+    with open(log_path+'errorful_textgrids.txt', 'w') as f:
+        for lines in errors:
+            f.writelines(lines)
+    with open(log_path+'alignment_issues.txt', 'w') as f:
+        for lines in alignment_issues:
+            f.writelines(lines)
+
+    return num
+
+def get_utterances(path='data/', workers=1, fetch_workers=8, 
+        mirror=None, offline=False, parser='bs4', aligner='greedy'):
     """Returns instances of Transcript, with 
     word and phone level transcriptions aligned, 
     organized in a dictionary for quick search by html.
@@ -356,6 +895,12 @@ def get_utterances(path='data/'):
     8 utterances (e.g., the 8th is "So Brenda"). These utterances 
     are mapped to BNCClasses Utterance objects. 
 
+    workers is the number of processes used for alignment 
+    (see get_aligned_utterances). fetch_workers, mirror and offline 
+    control how the transcript html is fetched and parser which html 
+    parser is used (see get_transcripts). aligner is 'greedy' or 
+    'dp' (see align_fileset). 
+
     Returns: 
         Dict[Transcript]: Dict index by html of transcript information. 
                             Transcipt corresponds to all the info from 
@@ -384,24 +929,26 @@ def get_utterances(path='data/'):
     transcripts_fname = 'data/transcripts.pkl'
     if exists(transcripts_fname):
         print(f"Loading {transcripts_fname}...")
-        with open(transcripts_fname, 'rb') as f:
+        with open(transcripts_fname, 'rb') as f, PROFILER.stage('checkpoint', item=transcripts_fname):
             transcripts = dill.load(f)
     else:
-        transcripts = get_transcripts(htmls)
+        transcripts = get_transcripts(htmls, workers=fetch_workers, 
+                mirror=mirror, offline=offline, parser=parser)
         print(f"Saving {transcripts_fname}...")
-        with open(transcripts_fname, 'wb') as f:
+        with open(transcripts_fname, 'wb') as f, PROFILER.stage('checkpoint', item=transcripts_fname):
             dill.dump(transcripts, f)
 
     ##Align transcript utterances with TextGrids and audio
     aligned_transcripts_fname = 'data/aligned_transcripts.pkl'
     if exists(aligned_transcripts_fname):
         print(f"Loading {aligned_transcripts_fname}...")
-        with open(aligned_transcripts_fname, 'rb') as f:
+        with open(aligned_transcripts_fname, 'rb') as f, PROFILER.stage('checkpoint', item=aligned_transcripts_fname):
             transcripts = dill.load(f)
     else:
-        transcripts = get_aligned_utterances(files, transcripts)
+        transcripts = get_aligned_utterances(files, transcripts, 
+                workers=workers, aligner=aligner)
         print(f"Saving {aligned_transcripts_fname}...")
-        with open(aligned_transcripts_fname, 'wb') as f:
+        with open(aligned_transcripts_fname, 'wb') as f, PROFILER.stage('checkpoint', item=aligned_transcripts_fname):
             dill.dump(transcripts, f)
 
     return transcripts
@@ -452,6 +999,106 @@ def get_aligned_fnames(path='data/'):
 
 if __name__ == "__main__":
 
-    transcripts = get_utterances()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Aligning BNC Audio transcripts with TextGrids')
+
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used for alignment')
+
+    parser.add_argument('--fetch_workers', type=int, default=8,
+                        help='number of concurrent requests for transcript html')
+    parser.add_argument('--mirror', type=str, default=None,
+                        help='directory or base url to fetch transcript html from instead')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use transcript html from the local cache')
+
+    parser.add_argument('--parser', type=str, default='bs4',
+                        choices=['bs4', 'lxml'],
+                        help='html parser for transcript pages')
+
+    parser.add_argument('--aligner', type=str, default='greedy',
+                        choices=['greedy', 'dp'],
+                        help='align words greedily or by banded edit distance (recovers after mismatches)')
+
+    parser.add_argument('--stream', action='store_true',
+                        help='align each transcript as it is parsed and write the tsv directly (no pkl files)')
+    parser.add_argument('--store', type=str, default='data/artifacts/',
+                        help='directory of per transcript artifacts for --stream (none to turn off)')
+    parser.add_argument('--realign_issues', action='store_true',
+                        help='with --stream, after a change to the aligner code only realign transcripts with alignment issues')
+    parser.add_argument('--out', type=str, default='BNCAudio_utterances.tsv',
+                        help='output tsv (gzip compressed if it ends in .gz)')
+    parser.add_argument('--columns', type=str, nargs='+', default=None,
+                        help='columns of the tsv to write (default all)')
+    parser.add_argument('--min_words', type=int, default=0,
+                        help='only write utterances with more than this many words')
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='also export the aligned utterances to a columnar corpus store in this directory')
+
+    parser.add_argument('--shard', type=str, default=None,
+                        help='build only shard i/N of the transcripts (0 <= i < N) into --shards, for --merge')
+    parser.add_argument('--shard_by', type=str, default='hash',
+                        choices=['hash', 'transcript'],
+                        help='split transcripts into shards by a hash of the html or into runs of sorted transcripts')
+    parser.add_argument('--shards', type=str, default='data/shards/',
+                        help='directory of the shard builds')
+    parser.add_argument('--merge', type=int, default=None, metavar='N',
+                        help='merge the N shards in --shards into --out (and --corpus)')
+    parser.add_argument('--index', type=str, default=None,
+                        help='with --merge and --corpus, also build the word and phone indexes in this directory')
+
+    parser.add_argument('--report', type=str, default=None,
+                        help='write a JSON run report (time, items/sec and slowest items of each stage, peak RSS) to this file')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='run under cProfile and dump the stats to this file (use --workers 1)')
+
+    args = parser.parse_args()
+
+    row_filter = None
+    if args.min_words > 0:
+        row_filter = lambda utterance: len(utterance.words.split()) > args.min_words
+
+    def build():
+        if args.merge is not None:
+            from shard import merge_shards
+            merge_shards(args.merge, args.shards, args.out, corpus_path=args.corpus, 
+                    index_path=args.index, columns=args.columns, row_filter=row_filter)
+        elif args.shard is not None:
+            from shard import build_shard, parse_shard
+            index, num_shards = parse_shard(args.shard)
+            build_shard(index, num_shards, args.shard_by, args.shards, 
+                    workers=args.workers, fetch_workers=args.fetch_workers, 
+                    mirror=args.mirror, offline=args.offline, parser=args.parser, 
+                    realign_issues=args.realign_issues, columns=args.columns, 
+                    row_filter=row_filter, aligner=args.aligner)
+        elif args.stream:
+            store_path = None if args.store == 'none' else args.store
+            stream_utterances(args.out, workers=args.workers, 
+                    fetch_workers=args.fetch_workers, mirror=args.mirror, 
+                    offline=args.offline, parser=args.parser, 
+                    store_path=store_path, realign_issues=args.realign_issues, 
+                    corpus_path=args.corpus, columns=args.columns, 
+                    row_filter=row_filter, aligner=args.aligner)
+        else:
+            transcripts = get_utterances(workers=args.workers, 
+                    fetch_workers=args.fetch_workers, mirror=args.mirror, 
+                    offline=args.offline, parser=args.parser, aligner=args.aligner)
+
+            transcripts2csv(transcripts, args.out, args.columns, row_filter)
+
+            if args.corpus is not None:
+                print(f"Exporting corpus to {args.corpus}...")
+                with PROFILER.stage('corpus'):
+                    export_corpus(transcripts, args.corpus)
+
+    if args.profile is not None:
+        from profiling import run_profiled
+        run_profiled(args.profile, build)
+    else:
+        build()
 
-    transcripts2csv(transcripts, 'BNCAudio_utterances.tsv')
+    if args.report is not None:
+        import sys
+        PROFILER.write(args.report, command=sys.argv, workers=args.workers, 
+                aligner=args.aligner, parser=args.parser, stream=args.stream)
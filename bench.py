@@ -0,0 +1,471 @@
+import argparse
+import random
+import re
+import sys
+import time
+from collections import namedtuple, deque
+
+from align import align_text_transcriptions, parse_page, build_transcript
+from normalize import normalize_utterance
+
+#Stand in for textgrid.Interval (only the attributes the aligner uses)
+Word = namedtuple("Word", "minTime, maxTime, mark")
+
+#(transcript word, TextGrid word marks)
+VOCAB = [('the', ['the']), ('cat', ['cat']), ("don't", ['do', "n't"]),
+        ('sat', ['sat']), ('on', ['on']), ("it's", ["it's"]),
+        ('mat', ['mat']), ('Brenda', ['brenda']), ('so', ['so']),
+        ("cannot", ['can', 'not']), ('gronnies', ['gronnies']),
+        ('handyman', ['handyman'])]
+
+
+def synthetic_tape(n_words, words_per_utterance=8, seed=0):
+    """Returns a synthetic tape with roughly n_words words.
+
+    Returns:
+        List[str], List[Word]: utterance texts in transcript style and
+                            the matching word tier of the TextGrid
+                            (including gap tokens).
+    """
+
+    rng = random.Random(seed)
+    utterances = []
+    words = []
+    t = 0.
+    while len(words) < n_words:
+        text = []
+        for _ in range(words_per_utterance):
+            text_word, marks = rng.choice(VOCAB)
+            text.append(text_word)
+            for mark in marks:
+                words.append(Word(t, t+0.25, mark))
+                t += 0.25
+        if rng.random() < 0.1:
+            words.append(Word(t, t+0.5, '{gap_anonymization}'))
+            t += 0.5
+        utterances.append(' '.join(text).capitalize()+'.')
+    return utterances, words
+
+def bench_align(sizes, repeat=3):
+    """Times align_text_transcriptions over synthetic tapes
+    of increasing length. Time per word should stay flat
+    (i.e. time per tape is linear in tape length)."""
+
+    print(f"{'words':>10} {'seconds':>10} {'us/word':>10}")
+    for size in sizes:
+        utterances, tier = synthetic_tape(size)
+        best = None
+        for _ in range(repeat):
+            words = deque(tier)
+            start = time.perf_counter()
+            for utter in utterances:
+                align_text_transcriptions(utter, words)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print(f"{len(tier):>10} {best:>10.4f} {1e6*best/len(tier):>10.2f}")
+
+def legacy_normalize(utter):
+    """The original chain of replacements at the top of
+    align_text_transcriptions, kept as the reference for
+    normalize_utterance"""
+
+    re_brackets = re.compile(r"\[[a-z\s*'\+A-Z]*\]")
+
+    utter = utter.replace('/', ' ').replace('-', ' ')
+    utter = utter.replace(' & ', ' and')
+    utter = re.sub(re_brackets, '', utter)
+
+    utter = utter.replace('—', '')
+    utter = utter.replace(" 's", "'s")
+    utter = utter.replace(" n't", "n't")
+    utter = utter.replace(" 'll", "'ll")
+    utter = utter.replace("]'s", "] 's")
+    utter = utter.replace(" 'un", "'un")
+    utter = utter.replace("an' ", "an'")
+    utter = utter.replace("o' ", "o'")
+    utter = utter.replace("o 'clock", "o'clock")
+    utter = utter.replace("Now,Mond", "Now, Mond")
+    utter = utter.replace(".ep", "")
+    utter = utter.replace("oiA_011207.tmp", 'oiA_011207 .tmp')
+    utter = utter.replace("smelly's", "smelly 's")
+    utter = utter.replace("0's", "0 's")
+    utter = utter.replace("&;", "")
+    utter = re.sub(r"(?<=[,])(?=[^\s])", r" ", utter)
+    return utter
+
+def corpus_utterances(transcripts_fname):
+    """Returns the text of every utterance in a transcripts pickle
+    (e.g., data/transcripts.pkl)"""
+
+    import dill
+
+    with open(transcripts_fname, 'rb') as f:
+        transcripts = dill.load(f)
+    texts = []
+    for transcript in transcripts.values():
+        for tape in transcript:
+            for chunk in tape:
+                for utterance in chunk:
+                    texts.append(utterance.text)
+    return texts
+
+def bench_normalize(utterances, repeat=3, check=False):
+    """Reports normalize_utterance throughput in utterances/sec
+    (against the legacy chain of replacements). With check,
+    asserts both give identical output on every utterance."""
+
+    if check:
+        mismatches = 0
+        for utter in utterances:
+            if normalize_utterance(utter) != legacy_normalize(utter):
+                mismatches += 1
+                print(f"mismatch: {utter}")
+        print(f"{len(utterances)} utterances, {mismatches} mismatches")
+        assert mismatches == 0
+
+    for name, normalize in [('legacy', legacy_normalize), 
+            ('normalizer', normalize_utterance)]:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for utter in utterances:
+                normalize(utter)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print(f"{name:>10} {len(utterances)/best:>12.0f} utterances/sec")
+
+def transcript_tuple(transcript):
+    """Returns the speakers, tapes, chunks and utterance texts of
+    transcript as nested tuples for comparing parser output"""
+    return (transcript.html, transcript.speakers, 
+            [(tape.text, [(chunk.speaker, chunk.nums, [u.text for u in chunk]) 
+                for chunk in tape]) for tape in transcript])
+
+def saved_pages(pages_path):
+    """Returns (url, body) for each page in a directory of saved
+    pages or an html cache made by fetch.py"""
+
+    import os
+    from fetch import PageCache
+
+    if os.path.exists(os.path.join(pages_path, 'index.tsv')):
+        cache = PageCache(pages_path)
+        return [(url, cache.get(url)) for url in sorted(cache.index)]
+
+    pages = []
+    for name in sorted(os.listdir(pages_path)):
+        with open(os.path.join(pages_path, name), 'rb') as f:
+            pages.append((name, f.read()))
+    return pages
+
+def bench_parse(pages, repeat=3, check=False):
+    """Reports pages/sec for each html parser backend. With
+    check, asserts every backend builds the same Transcript
+    as bs4 for every page."""
+
+    parsers = ['bs4', 'lxml']
+
+    if check:
+        mismatches = 0
+        for url, content in pages:
+            reference = transcript_tuple(build_transcript(url, *parse_page(content, 'bs4')))
+            for parser in parsers[1:]:
+                other = transcript_tuple(build_transcript(url, *parse_page(content, parser)))
+                if other != reference:
+                    mismatches += 1
+                    print(f"mismatch: {parser} {url}")
+        print(f"{len(pages)} pages, {mismatches} mismatches")
+        assert mismatches == 0
+
+    size = sum(len(content) for _, content in pages)
+    for parser in parsers:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for url, content in pages:
+                build_transcript(url, *parse_page(content, parser))
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print(f"{parser:>10} {len(pages)/best:>10.1f} pages/sec {size/best/1e6:>8.2f} MB/sec")
+
+class LegacyUtterance:
+    """The original dict backed Utterance (words and phones built 
+    with +=, every row string built by get_entry_dict), kept as 
+    the reference for the memory benchmark"""
+
+    def __init__(self, text):
+
+        self.text = text
+        self.start = 0
+        self.end = 0
+        self.words = ''
+        self.phones = ''
+        self.wavfname = ''
+        self.textgridfname = ''
+        self.transcriptlink = ''
+
+    def set_fnames(self, f):
+        self.textgridfname = f.textgrid.split('/')[-1]
+        self.wavfname = f.wav.split('/')[-1]
+        self.wavlink = f.wav
+        self.transcriptlink = f.html
+
+    def get_entry_dict(self, transcript_num, padding=30):
+
+        UID = self.textgridfname.split('.TextGrid')[0]+'_'+str(self.start)+'_'+str(self.end)
+        UID_pad = UID+'_pad'+str(padding)
+        return {
+                'transcript num': transcript_num,
+                'utterance text': self.text, 
+                'cleaned text': self.words.strip(), 
+                'phones': '| '+self.phones.strip().upper(), 
+                'start time': self.start, 
+                'end time': self.end, 
+                'wav fname': self.wavfname,
+                'TextGrid fname': self.textgridfname,
+                'tanscript html': self.transcriptlink,
+                'link': self.wavlink, 
+                'clip link': self.wavlink+'?t='+str(self.start)+','+str(self.end),
+                'padded clip link': self.wavlink+'?t='+str(max(self.start-padding, 0))+','+str(self.end+padding), 
+                'python clip command': f"python clip.py --start {self.start} --end {self.end} --textgrid_fname {self.textgridfname} --out_fname {UID} --getwav",
+                'python padded clip command': f"python clip.py --start {self.start} --end {self.end} --textgrid_fname {self.textgridfname} --out_fname {UID_pad} --getwav --padding {padding}"}
+
+def synthetic_utterances(cls, n_utterances, utterances_per_tape=500, seed=0):
+    """Returns n_utterances aligned utterances of class cls 
+    (built the way align_fileset builds them, legacy with += 
+    and Utterance with join)"""
+
+    from align import FileSet
+
+    rng = random.Random(seed)
+    utterances = []
+    t = 0.
+    for idx in range(n_utterances):
+        tape = idx // utterances_per_tape
+        f = FileSet(f'http://bnc.phon.ox.ac.uk/data/KDP_{tape}.TextGrid', 
+                'http://bnc.phon.ox.ac.uk/data/021A-C0897X0004XX-AAZZP0.wav', 
+                'http://bnc.phon.ox.ac.uk/transcripts-html/KDP.html')
+        words = [rng.choice(VOCAB)[0] for _ in range(8)]
+        phones = [' '.join(rng.choice(['DH', 'AH0', 'K', 'AE1', 'T']) 
+            for _ in range(3)) for _ in words]
+
+        utterance = cls(' '.join(words).capitalize()+'.')
+        utterance.set_fnames(f)
+        if cls is LegacyUtterance:
+            for word, phone in zip(words, phones):
+                utterance.words += ' ' + word.lower()
+                utterance.phones += phone + ' | '
+        else:
+            utterance.words = ' ' + ' '.join(word.lower() for word in words)
+            utterance.phones = ' | '.join(phones) + ' | '
+        utterance.start = round(t, 5)
+        t += 2.
+        utterance.end = round(t, 5)
+        utterances.append(utterance)
+    return utterances
+
+def bench_memory(sizes, columns=('cleaned text', 'start time', 'end time')):
+    """Reports the memory (tracemalloc) held by aligned utterances, 
+    legacy against slotted Utterance, and the time to build tsv 
+    rows of columns from them: legacy builds every column of 
+    get_entry_dict, Utterance.get_value only the ones asked for."""
+
+    import gc
+    import tracemalloc
+    from BNCClasses import Utterance
+
+    print(f"{'utterances':>10} {'class':>10} {'MB held':>10} {'B/utter':>10} {'row secs':>10}")
+    for size in sizes:
+        for name, cls in [('legacy', LegacyUtterance), ('slots', Utterance)]:
+            gc.collect()
+            tracemalloc.start()
+            utterances = synthetic_utterances(cls, size)
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            start = time.perf_counter()
+            if cls is LegacyUtterance:
+                for u in utterances:
+                    entry = u.get_entry_dict(0)
+                    row = [entry[column] for column in columns]
+            else:
+                for u in utterances:
+                    row = [u.get_value(column) for column in columns]
+            elapsed = time.perf_counter() - start
+            del utterances
+
+            print(f"{size:>10} {name:>10} {held/1e6:>10.1f} {held/size:>10.0f} {elapsed:>10.3f}")
+
+#Stages of the suite, timed separately
+SUITE_STAGES = ['parse', 'align', 'export', 'index']
+
+def run_suite(root):
+    """Runs parse, align, export and index over the synthetic
+    corpus under root (see synth.write_corpus), fully offline,
+    and checks the aligned text against root/expected.tsv.
+
+    Returns:
+        Dict[float], int: Seconds of each stage and the number of
+                        utterances written.
+    """
+
+    import csv
+    import os
+    from align import get_aligned_fnames, align_fileset
+    from BNCClasses import TSVWriter
+    from corpus import CorpusWriter
+    from search import build_word_index, build_phone_index
+
+    data_path = os.path.join(root, 'data')+'/'
+    textgrid_path = os.path.join(data_path, 'AudioBNCTextGrids')+'/'
+    corpus_path = os.path.join(root, 'corpus')+'/'
+    tsv_fname = os.path.join(root, 'utterances.tsv')
+
+    files, htmls = get_aligned_fnames(data_path)
+    htmls.sort()
+    pages = []
+    for html in htmls:
+        with open(os.path.join(root, 'pages', html.split('/')[-1]), 'rb') as f:
+            pages.append((html, f.read()))
+    seconds = {}
+
+    start = time.perf_counter()
+    transcripts = [build_transcript(html, *parse_page(content)) for html, content in pages]
+    seconds['parse'] = time.perf_counter() - start
+
+    #no tier cache, so every run reads the TextGrids
+    start = time.perf_counter()
+    by_html = {transcript.html: transcript for transcript in transcripts}
+    issues = 0
+    for f in files:
+        tape_num = int(f.textgrid.split('.TextGrid')[0].split('_')[-1])
+        tape = by_html[f.html].tapes[tape_num-1]
+        _, tape_errors, tape_issues = align_fileset(f, tape, textgrid_path, None)
+        issues += len(tape_errors) + len(tape_issues)
+    seconds['align'] = time.perf_counter() - start
+    assert issues == 0, f"{issues} errors and alignment issues"
+
+    start = time.perf_counter()
+    with TSVWriter(tsv_fname) as tsv, CorpusWriter(corpus_path) as writer:
+        for idx, transcript in enumerate(transcripts):
+            tsv.write_transcript(transcript, idx)
+            writer.add_transcript(transcript, idx)
+    seconds['export'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    build_word_index(corpus_path, os.path.join(root, 'index', 'words')+'/')
+    build_phone_index(corpus_path, os.path.join(root, 'index', 'phones')+'/')
+    seconds['index'] = time.perf_counter() - start
+
+    with open(tsv_fname, 'r', newline='') as f:
+        got = [(row['tanscript html'], row['tape'], row['tape utterance num'], row['cleaned text'])
+                for row in csv.DictReader(f, delimiter='\t')]
+    with open(os.path.join(root, 'expected.tsv'), 'r') as f:
+        expected = [tuple(line.rstrip('\n').split('\t')) for line in f]
+    assert got == expected, "aligned text differs from expected.tsv"
+    return seconds, len(got)
+
+def bench_suite(sizes, repeat=3, baseline=None, save_baseline=None, tolerance=0.2):
+    """Times each stage of run_suite on synthetic corpora of sizes
+    transcripts (written to a temporary directory, best of repeat)
+    and reports utterances/sec. With save_baseline the throughputs
+    are saved to that json file; with baseline they are compared to
+    a saved one, and a stage more than tolerance (a fraction) slower
+    is reported as a regression.
+
+    Returns:
+        bool: Whether there were no regressions.
+    """
+
+    import json
+    import os
+    import tempfile
+    from synth import write_corpus
+
+    results = {}
+    print(f"{'transcripts':>12} {'utterances':>10} " + ' '.join(f"{stage:>10}" for stage in SUITE_STAGES)
+            + '  (utterances/sec)')
+    for size in sizes:
+        best = {}
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as root:
+                write_corpus(root, size)
+                seconds, num = run_suite(root)
+            for stage in SUITE_STAGES:
+                best[stage] = min(best.get(stage, seconds[stage]), seconds[stage])
+        results[str(size)] = {stage: num/best[stage] for stage in SUITE_STAGES}
+        print(f"{size:>12} {num:>10} " + ' '.join(f"{results[str(size)][stage]:>10.0f}"
+            for stage in SUITE_STAGES))
+
+    if save_baseline is not None:
+        with open(save_baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Saved baseline to {save_baseline}")
+
+    ok = True
+    if baseline is not None:
+        with open(baseline, 'r') as f:
+            reference = json.load(f)
+        for size, stages in results.items():
+            for stage, throughput in stages.items():
+                if stage not in reference.get(size, {}):
+                    continue
+                ratio = throughput/reference[size][stage]
+                if ratio < 1-tolerance:
+                    ok = False
+                    print(f"regression: {stage} at {size} transcripts {ratio:.2f}x of baseline")
+        print("no regressions" if ok else "regressions against "+baseline)
+    return ok
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmarks for BNC Audio alignment')
+
+    parser.add_argument('stage', nargs='?', default='align',
+                        choices=['align', 'normalize', 'parse', 'memory', 'suite'],
+                        help='stage to benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='number of TextGrid words per synthetic tape (utterances for memory)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timing repeats (best is reported)')
+
+    parser.add_argument('--transcripts', type=str, default=None,
+                        help='transcripts pickle to take utterances from (default is synthetic)')
+    parser.add_argument('--pages', type=str, default='data/html/',
+                        help='directory of saved pages or html cache for the parse stage')
+    parser.add_argument('--check', action='store_true',
+                        help='check the output is the same as the reference (legacy normalizer, bs4 parser)')
+
+    parser.add_argument('--corpus_sizes', type=int, nargs='+', default=[4, 16, 64],
+                        help='number of transcripts of the synthetic corpora for the suite stage')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='json of suite throughputs to compare to (exits with 1 on a regression)')
+    parser.add_argument('--save_baseline', type=str, default=None,
+                        help='json file to save the suite throughputs to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction slower than the baseline counted as a regression')
+
+    args = parser.parse_args()
+
+    if args.stage == 'align':
+        bench_align(args.sizes, args.repeat)
+    elif args.stage == 'normalize':
+        if args.transcripts is not None:
+            utterances = corpus_utterances(args.transcripts)
+        else:
+            utterances = []
+            for size in args.sizes:
+                utterances.extend(synthetic_tape(size)[0])
+        bench_normalize(utterances, args.repeat, args.check)
+    elif args.stage == 'parse':
+        bench_parse(saved_pages(args.pages), args.repeat, args.check)
+    elif args.stage == 'memory':
+        bench_memory(args.sizes)
+    elif args.stage == 'suite':
+        if not bench_suite(args.corpus_sizes, args.repeat, args.baseline, 
+                args.save_baseline, args.tolerance):
+            sys.exit(1)
@@ -2,69 +2,203 @@ import textgrid
 import requests
 import pathlib
 import argparse
-
-parser = argparse.ArgumentParser(description='Clipping Audio and TextGrids from BNC Audio')
-
-parser.add_argument('--start', type=float, 
-                    help='start time')
-parser.add_argument('--end', type=float, 
-                    help='end time')
-parser.add_argument('--padding', type=float, default=0.,
-                    help='amount of padding time')
-parser.add_argument('--textgrid_fname', type=str, 
-                    help='TextGrid filename')
-parser.add_argument('--out_fname', type=str, 
-                    help='TextGrid (and wav) output filename')
-parser.add_argument('--getwav', action='store_true',
-                    help='Specify whether to get wav')
-
-args = parser.parse_args()
-
-#Code
-outpath = 'data/downloads/'
-if args.getwav:
-    wav_path = 'http://bnc.phon.ox.ac.uk/data/'
-    wavlink = wav_path+args.textgrid_fname.split('_')[0]+'.wav'+'?t='+str(max(args.start-args.padding, 0))+','+str(args.end+args.padding)
-    r = requests.get(wavlink, allow_redirects=True)
+import csv
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from tiers import load_tiers
+from BNCClasses import clip_name
+from wav import slice_wav
+
+WAV_PATH = 'http://bnc.phon.ox.ac.uk/data/'
+TEXTGRID_PATH = 'data/AudioBNCTextGrids/'
+OUTPATH = 'data/downloads/'
+
+def wav_link(textgrid_fname, start, end, padding=0., wav_path=WAV_PATH):
+    """Returns the link to the wav of start to end (plus padding)
+    of the recording of textgrid_fname"""
+    return wav_path+textgrid_fname.split('_')[0]+'.wav'+'?t='+str(max(start-padding, 0))+','+str(end+padding)
+
+def get_wav(textgrid_fname, start, end, out_fname, padding=0.,
+        session=requests, outpath=OUTPATH, wav_dir=None):
+    """Saves the wav of a clip to outpath/audio/out_fname.wav. If 
+    the full recording is in wav_dir, the clip is sliced from it 
+    (see wav.slice_wav), otherwise it is downloaded."""
 
     outwav_path = outpath+'audio/'
     pathlib.Path(outwav_path).mkdir(parents=True, exist_ok=True)
-    with open(outwav_path+args.out_fname+'.wav', 'wb') as f:
-        f.write(r.content)
-
-path = 'data/AudioBNCTextGrids/'
-tg = textgrid.TextGrid.fromFile(path+args.textgrid_fname)
-
-phones = tg.getFirst('phone')
-words = tg.getFirst('word')
-
-phone_start_idx = phones.indexContaining(args.start)+1
-phone_end_idx = phones.indexContaining(args.end)+1
 
-word_start_idx = words.indexContaining(args.start)+1
-word_end_idx = words.indexContaining(args.end)+1
+    if wav_dir is not None:
+        wav_fname = os.path.join(wav_dir, textgrid_fname.split('_')[0]+'.wav')
+        if os.path.exists(wav_fname):
+            slice_wav(wav_fname, max(start-padding, 0), end+padding, 
+                    outwav_path+out_fname+'.wav')
+            return
 
-target_phones = phones[phone_start_idx:phone_end_idx]
-target_word = words[word_start_idx:word_end_idx]
+    r = session.get(wav_link(textgrid_fname, start, end, padding), allow_redirects=True)
+    r.raise_for_status()
 
-args.start -= args.padding
-args.end += args.padding
-
-phone_tier = textgrid.IntervalTier(name='phone', maxTime=args.end-args.start)
-word_tier = textgrid.IntervalTier(name='word', maxTime=args.end-args.start)
-
-outGrid = textgrid.TextGrid(maxTime = args.end-args.start)
-outGrid.append(phone_tier)
-outGrid.append(word_tier)
-
-for p in target_phones:
-    p.__isub__(args.start)
-    phone_tier.addInterval(p)
-
-for w in target_word:
-    w.__isub__(args.start)
-    word_tier.addInterval(w)
+    with open(outwav_path+out_fname+'.wav', 'wb') as f:
+        f.write(r.content)
 
-outgrid_path = outpath+'textgrids/'
-pathlib.Path(outgrid_path).mkdir(parents=True, exist_ok=True)
-outGrid.write(outgrid_path+args.out_fname+'.TextGrid')
+def clip_tiers(tg, start, end, padding=0.):
+    """Returns a TextGrid with the phone and word intervals of
+    tiers tg (as from load_tiers) from start to end, with times
+    relative to start-padding"""
+
+    phones = next(tier for tier in tg if tier.name == 'phone')
+    words = next(tier for tier in tg if tier.name == 'word')
+
+    phone_start_idx, phone_end_idx = phones.span(start, end)
+    word_start_idx, word_end_idx = words.span(start, end)
+
+    start -= padding
+    end += padding
+
+    phone_tier = textgrid.IntervalTier(name='phone', maxTime=end-start)
+    word_tier = textgrid.IntervalTier(name='word', maxTime=end-start)
+
+    outGrid = textgrid.TextGrid(maxTime = end-start)
+    outGrid.append(phone_tier)
+    outGrid.append(word_tier)
+
+    for idx in range(phone_start_idx, phone_end_idx):
+        phone_tier.addInterval(textgrid.Interval(phones.starts[idx]-start,
+            phones.ends[idx]-start, phones.marks[idx]))
+
+    for idx in range(word_start_idx, word_end_idx):
+        word_tier.addInterval(textgrid.Interval(words.starts[idx]-start,
+            words.ends[idx]-start, words.marks[idx]))
+
+    return outGrid
+
+def write_clip(tg, start, end, out_fname, padding=0., outpath=OUTPATH):
+    """Writes the clipped TextGrid to outpath/textgrids/out_fname.TextGrid"""
+
+    outgrid_path = outpath+'textgrids/'
+    pathlib.Path(outgrid_path).mkdir(parents=True, exist_ok=True)
+    clip_tiers(tg, start, end, padding).write(outgrid_path+out_fname+'.TextGrid')
+
+def read_manifest(fname, padding=0.):
+    """Returns the clips in a tsv with a heading. The columns are
+    textgrid_fname, start, end and optionally padding and out_fname,
+    or those of the utterance tsv or search.py/query.py output
+    ('TextGrid fname', 'start time', 'end time'). Missing padding
+    is padding and missing out_fname is clip_name.
+
+    Returns:
+        List[Tuple]: (textgrid_fname, start, end, padding, out_fname)
+                    for each row.
+    """
+
+    clips = []
+    with open(fname, 'r', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            textgrid_fname = row.get('textgrid_fname', row.get('TextGrid fname'))
+            start = float(row.get('start', row.get('start time')))
+            end = float(row.get('end', row.get('end time')))
+            row_padding = float(row['padding']) if row.get('padding') else padding
+            out_fname = row.get('out_fname') or clip_name(textgrid_fname, start, end, row_padding)
+            clips.append((textgrid_fname, start, end, row_padding, out_fname))
+    return clips
+
+def clip_batch(clips, getwav=False, workers=8, textgrid_path=TEXTGRID_PATH,
+        outpath=OUTPATH, wav_dir=None):
+    """Writes the TextGrid (and with getwav the wav) of each clip
+    in clips (as from read_manifest). Clips are grouped by TextGrid,
+    so each TextGrid is loaded once. Wavs are downloaded by a pool
+    of workers threads (sharing one connection pool) while the
+    TextGrids are written (or sliced from the recordings in 
+    wav_dir, when they are there). A clip that fails (e.g., its 
+    TextGrid is missing or its wav cannot be downloaded) is 
+    recorded and the batch goes on. 
+
+    Returns:
+        List[Tuple]: (out_fname, error) for each part of a clip 
+                    that failed, in the order of clips.
+    """
+
+    from fetch import make_session
+
+    grouped = OrderedDict()
+    for clip in clips:
+        grouped.setdefault(clip[0], []).append(clip)
+
+    session = make_session(workers)
+    #(clip index, out_fname, error)
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        idx = 0
+        for textgrid_fname, group in grouped.items():
+            print(f"Clipping {len(group)} from {textgrid_fname}...")
+            if getwav:
+                for k, (_, start, end, padding, out_fname) in enumerate(group):
+                    futures.append((idx+k, out_fname, executor.submit(get_wav, textgrid_fname,
+                        start, end, out_fname, padding, session, outpath, wav_dir)))
+
+            try:
+                tg = load_tiers(textgrid_path+textgrid_fname)
+            except Exception as e:
+                failed.extend((idx+k, out_fname, f"TextGrid {textgrid_fname}: {e!r}")
+                        for k, (_, _, _, _, out_fname) in enumerate(group))
+                idx += len(group)
+                continue
+            for _, start, end, padding, out_fname in group:
+                try:
+                    write_clip(tg, start, end, out_fname, padding, outpath)
+                except Exception as e:
+                    failed.append((idx, out_fname, f"TextGrid: {e!r}"))
+                idx += 1
+
+        for idx, out_fname, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                #requests errors or OSErrors slicing a local wav
+                failed.append((idx, out_fname, f"wav: {e!r}"))
+    session.close()
+    return [(out_fname, error) for _, out_fname, error in sorted(failed, key=lambda x: x[0])]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Clipping Audio and TextGrids from BNC Audio')
+
+    parser.add_argument('--start', type=float,
+                        help='start time')
+    parser.add_argument('--end', type=float,
+                        help='end time')
+    parser.add_argument('--padding', type=float, default=0.,
+                        help='amount of padding time')
+    parser.add_argument('--textgrid_fname', type=str,
+                        help='TextGrid filename')
+    parser.add_argument('--out_fname', type=str,
+                        help='TextGrid (and wav) output filename')
+    parser.add_argument('--getwav', action='store_true',
+                        help='Specify whether to get wav')
+    parser.add_argument('--batch', type=str, default=None,
+                        help='tsv of clips to make (e.g., output of search.py) instead of one clip')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent wav downloads with --batch')
+    parser.add_argument('--wav_dir', type=str, default=None,
+                        help='directory of full wav files to slice clips from (downloaded if missing)')
+
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        clips = read_manifest(args.batch, args.padding)
+        failed = clip_batch(clips, args.getwav, args.workers, wav_dir=args.wav_dir)
+        for out_fname, error in failed:
+            print(f"Failed {out_fname}: {error}", file=sys.stderr)
+        print(f"{len(clips)-len(set(out_fname for out_fname, _ in failed))} of {len(clips)} clips made", 
+                file=sys.stderr)
+        if failed:
+            sys.exit(1)
+    else:
+        if args.getwav:
+            get_wav(args.textgrid_fname, args.start, args.end, args.out_fname, args.padding, 
+                    wav_dir=args.wav_dir)
+        tg = load_tiers(TEXTGRID_PATH+args.textgrid_fname)
+        write_clip(tg, args.start, args.end, args.out_fname, args.padding)
@@ -0,0 +1,327 @@
+import json
+import mmap
+import os
+from array import array
+
+#Columns of the corpus store, one row per aligned utterance.
+#Kinds: 'f8' (float64), 'i4' (int32), 'str' (utf-8 strings with
+#offsets), 'f8s' (variable length float64 arrays with offsets) and 
+#'pool' (int32 codes into a pool of distinct strings, for columns 
+#with few distinct values such as file names)
+COLUMNS = [
+    ('transcript num', 'i4'),
+    ('tape', 'pool'),
+    ('speaker', 'pool'),
+    ('gender', 'pool'),
+    ('age', 'pool'),
+    ('tape utterance num', 'pool'),
+    ('speaker utterance num', 'i4'),
+    ('utterance text', 'str'),
+    ('cleaned text', 'str'),
+    ('phones', 'str'),
+    ('start time', 'f8'),
+    ('end time', 'f8'),
+    ('wav fname', 'pool'),
+    ('TextGrid fname', 'pool'),
+    ('transcript html', 'pool'),
+    ('link', 'pool'),
+    ('word times', 'f8s'),
+    ('phone times', 'f8s'),
+]
+
+def _fname(name):
+    return name.replace(' ', '_')
+
+def utterance_rows(transcript, transcript_num):
+    """Yields a dict of the COLUMNS for each aligned utterance
+    in transcript (in the same order and with the same values
+    as the tsv from Transcript.to_str). 'word times' has the start 
+    and end of each word of 'cleaned text' (start0, end0, start1, ...); 
+    utterances aligned before word times were kept get the start 
+    and end of the utterance for each word. 'phone times' has the 
+    start and end of each phone (empty if they were not kept)."""
+
+    for tape, chunk, utterance_num, chunk_num, speaker_info, utterance in transcript.get_transcribed():
+        word_times = utterance.word_times
+        if word_times is None:
+            word_times = array('d', [utterance.start, utterance.end]*len(utterance.words.split()))
+        phone_times = utterance.phone_times
+        if phone_times is None:
+            phone_times = array('d')
+        yield {
+                'transcript num': transcript_num,
+                'tape': tape.text,
+                'speaker': chunk.speaker,
+                'gender': speaker_info['gender'],
+                'age': speaker_info['age'],
+                'tape utterance num': utterance_num,
+                'speaker utterance num': chunk_num,
+                'utterance text': utterance.text,
+                'cleaned text': utterance.cleaned_text(),
+                'phones': utterance.phones_str(),
+                'start time': utterance.start,
+                'end time': utterance.end,
+                'wav fname': utterance.wavfname,
+                'TextGrid fname': utterance.textgridfname,
+                'transcript html': utterance.transcriptlink,
+                'link': utterance.wavlink,
+                'word times': word_times,
+                'phone times': phone_times}
+
+
+class CorpusWriter:
+    """Writes utterance rows to a columnar corpus store.
+
+    Each column is its own file (or pair of files) in path, appended
+    to as rows come in, so a whole corpus can be exported while it
+    is being built. close() writes the string pools and manifest.json.
+    """
+
+    def __init__(self, path='data/corpus/', columns=COLUMNS, flush_every=65536):
+
+        self.path = path
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.num_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+        self.files = {}
+        self.buffers = {}
+        self.pools = {}
+        self.offsets = {}
+        for name, kind in self.columns:
+            base = os.path.join(path, _fname(name))
+            if kind == 'str':
+                self.files[name] = (open(base+'.off', 'wb'), open(base+'.str', 'wb'))
+                self.buffers[name] = (array('q'), [])
+                self.offsets[name] = 0
+                self.files[name][0].write(array('q', [0]).tobytes())
+            elif kind == 'f8s':
+                self.files[name] = (open(base+'.off', 'wb'), open(base+'.f8', 'wb'))
+                self.buffers[name] = (array('q'), array('d'))
+                self.offsets[name] = 0
+                self.files[name][0].write(array('q', [0]).tobytes())
+            else:
+                typecode = 'd' if kind == 'f8' else 'i'
+                self.files[name] = open(base+'.'+('f8' if kind == 'f8' else 'i4'), 'wb')
+                self.buffers[name] = array(typecode)
+                if kind == 'pool':
+                    self.pools[name] = {}
+
+    def add(self, row):
+        """Appends a row (dict of column values)"""
+
+        for name, kind in self.columns:
+            value = row[name]
+            if kind == 'str':
+                encoded = value.encode('utf-8')
+                self.offsets[name] += len(encoded)
+                offsets, blobs = self.buffers[name]
+                offsets.append(self.offsets[name])
+                blobs.append(encoded)
+            elif kind == 'f8s':
+                self.offsets[name] += len(value)
+                offsets, values = self.buffers[name]
+                offsets.append(self.offsets[name])
+                values.extend(value)
+            elif kind == 'pool':
+                pool = self.pools[name]
+                code = pool.get(value)
+                if code is None:
+                    code = pool[value] = len(pool)
+                self.buffers[name].append(code)
+            else:
+                self.buffers[name].append(value)
+
+        self.num_rows += 1
+        if self.num_rows % self.flush_every == 0:
+            self.flush()
+
+    def add_transcript(self, transcript, transcript_num):
+        """Appends the rows of an aligned transcript"""
+        for row in utterance_rows(transcript, transcript_num):
+            self.add(row)
+
+    def flush(self):
+        for name, kind in self.columns:
+            if kind == 'str':
+                offsets, blobs = self.buffers[name]
+                self.files[name][0].write(offsets.tobytes())
+                self.files[name][1].write(b''.join(blobs))
+                del offsets[:]
+                del blobs[:]
+            elif kind == 'f8s':
+                offsets, values = self.buffers[name]
+                self.files[name][0].write(offsets.tobytes())
+                self.files[name][1].write(values.tobytes())
+                del offsets[:]
+                del values[:]
+            else:
+                self.files[name].write(self.buffers[name].tobytes())
+                del self.buffers[name][:]
+
+    def close(self):
+        self.flush()
+        for name, kind in self.columns:
+            if kind in ('str', 'f8s'):
+                self.files[name][0].close()
+                self.files[name][1].close()
+            else:
+                self.files[name].close()
+            if kind == 'pool':
+                pool = json.dumps(list(self.pools[name]), ensure_ascii=False)
+                with open(os.path.join(self.path, _fname(name)+'.pool.json'), 'w') as f:
+                    f.write(pool)
+
+        manifest = {'rows': self.num_rows, 'columns': self.columns}
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _map(fname):
+    """Returns a read only memoryview of fname (memory mapped)"""
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def column_array(column, dtype):
+    """Returns a numpy view of a memory mapped column (e.g., the 
+    codes of a PooledColumn or the offsets or data of an ArrayColumn)"""
+    import numpy as np
+    return np.frombuffer(column, dtype) if len(column) else np.zeros(0, dtype)
+
+
+class StringColumn:
+    """Memory mapped string column; values are decoded on access"""
+
+    def __init__(self, base):
+        self.offsets = _map(base+'.off').cast('q')
+        self.data = _map(base+'.str')
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return bytes(self.data[self.offsets[i]:self.offsets[i+1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ArrayColumn:
+    """Memory mapped column of float64 arrays; values are 
+    memoryviews into the map"""
+
+    def __init__(self, base):
+        self.offsets = _map(base+'.off').cast('q')
+        self.data = _map(base+'.f8').cast('d')
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class PooledColumn:
+    """Memory mapped int32 codes into a small list of strings"""
+
+    def __init__(self, base):
+        self.codes = _map(base+'.i4').cast('i')
+        with open(base+'.pool.json', 'r') as f:
+            self.pool = json.load(f)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.pool[self.codes[i]]
+
+    def __iter__(self):
+        pool = self.pool
+        for code in self.codes:
+            yield pool[code]
+
+
+class CorpusStore:
+    """Read side of a corpus store written by CorpusWriter.
+
+    Only manifest.json is read when the store is opened. A column
+    is memory mapped the first time it is asked for, so loading the
+    store is fast and only the columns used are paged in. Numeric
+    columns are memoryviews (float64 or int32); string columns
+    decode values on access.
+    """
+
+    def __init__(self, path='data/corpus/'):
+
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        self.num_rows = manifest['rows']
+        self.kinds = dict(manifest['columns'])
+        self.names = [name for name, _ in manifest['columns']]
+        self._columns = {}
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, name):
+        """Returns column name (mapped on first use)"""
+
+        if name not in self._columns:
+            kind = self.kinds[name]
+            base = os.path.join(self.path, _fname(name))
+            if kind == 'str':
+                column = StringColumn(base)
+            elif kind == 'f8s':
+                column = ArrayColumn(base)
+            elif kind == 'pool':
+                column = PooledColumn(base)
+            elif kind == 'f8':
+                column = _map(base+'.f8').cast('d')
+            else:
+                column = _map(base+'.i4').cast('i')
+            self._columns[name] = column
+        return self._columns[name]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def row(self, i, columns=None):
+        """Returns row i as a dict (of columns, default all)"""
+        if columns is None:
+            columns = self.names
+        return {name: self.column(name)[i] for name in columns}
+
+def export_corpus(transcripts, path='data/corpus/'):
+    """Writes aligned transcripts (dict as returned by get_utterances)
+    to a corpus store in path
+
+    Returns:
+        int: Number of rows written.
+    """
+
+    if type(transcripts) == dict:
+        transcripts = list(transcripts.values())
+
+    with CorpusWriter(path) as writer:
+        for idx, transcript in enumerate(transcripts):
+            writer.add_transcript(transcript, idx)
+    return writer.num_rows
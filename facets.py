@@ -0,0 +1,216 @@
+import re
+import sys
+
+import numpy as np
+
+from corpus import CorpusStore, column_array
+
+#Facets and the column of the corpus store each is keyed by (the
+#age band is derived from the age, see age_band)
+FACETS = {'speaker': 'speaker', 'gender': 'gender', 'age band': 'age',
+        'transcript': 'transcript html', 'tape': 'TextGrid fname'}
+
+#Age bands of the BNC age categories (Ag0 to Ag5) as (label,
+#first age, last age)
+AGE_BANDS = [('0-14', 0, 14), ('15-24', 15, 24), ('25-34', 25, 34),
+        ('35-44', 35, 44), ('45-59', 45, 59), ('60+', 60, float('inf'))]
+UNKNOWN = 'unknown'
+
+
+def parse_age(age):
+    """Returns the age in years in an age of the speaker table
+    (e.g., '34', 'c. 40' or '60+'), or None if it has no number
+    (e.g., 'unknown')"""
+    match = re.search(r'\d+', age)
+    return int(match.group()) if match else None
+
+def age_band(age):
+    """Returns the label of the AGE_BANDS an age (in years, or
+    None) is in"""
+    if age is None:
+        return UNKNOWN
+    for label, first, last in AGE_BANDS:
+        if first <= age <= last:
+            return label
+    return UNKNOWN
+
+def _label(facet, value):
+    """Returns the label of a value of the column of facet
+    (transcripts are labelled by their code, e.g., KDP)"""
+    if facet == 'transcript':
+        return value.split('/')[-1].split('.html')[0]
+    return value
+
+
+class FacetIndex:
+    """Facet indexes over the rows of a corpus store, for filtering
+    utterances by speaker metadata.
+
+    For each facet the rows of every value are kept as a sorted
+    array (a stable sort of the pool codes of its column), and ages
+    are parsed to numbers and sorted for age ranges. Filters are
+    bitmaps (Python ints, bit i for row i): the bitmap of a value is
+    built from its rows the first time it is asked for, and values
+    are combined with | within a facet and & across facets, which
+    takes microseconds even for the whole corpus. Use filter_hits
+    or mask to apply a bitmap to the hits of search.py or query.py.
+    """
+
+    def __init__(self, corpus_path='data/corpus/'):
+
+        self.corpus = CorpusStore(corpus_path)
+        self.num_rows = len(self.corpus)
+        self.num_bytes = (self.num_rows+7)//8
+
+        self.labels = {}
+        self.values = {}
+        self.order = {}
+        self.offsets = {}
+        for facet, column in FACETS.items():
+            pooled = self.corpus[column]
+            codes = column_array(pooled.codes, np.int32)
+            if facet == 'age band':
+                labels = [label for label, _, _ in AGE_BANDS] + [UNKNOWN]
+                bands = [labels.index(age_band(parse_age(age))) for age in pooled.pool]
+                codes = np.array(bands, np.int32)[codes] if bands else codes
+            else:
+                labels = [_label(facet, value) for value in pooled.pool]
+            self.labels[facet] = labels
+            self.values[facet] = {label: code for code, label in enumerate(labels)}
+            #rows of value code are order[offsets[code]:offsets[code+1]]
+            self.order[facet] = np.argsort(codes, kind='stable')
+            self.offsets[facet] = np.concatenate([[0],
+                np.cumsum(np.bincount(codes, minlength=len(labels)))])
+
+        #ages of the rows (nan if unknown), sorted for age ranges
+        pooled = self.corpus['age']
+        ages = np.array([np.nan if parse_age(age) is None else parse_age(age)
+            for age in pooled.pool] + [np.nan])[column_array(pooled.codes, np.int32)]
+        self.age_order = np.argsort(ages, kind='stable')
+        self.sorted_ages = ages[self.age_order]
+
+        self.all = (1 << self.num_rows) - 1
+        self._bitmaps = {}
+
+    def counts(self, facet):
+        """Returns the number of rows of each value of facet
+
+        Returns:
+            Dict[int]: Number of rows by value label.
+        """
+        sizes = np.diff(self.offsets[facet])
+        return {label: int(sizes[code]) for code, label in enumerate(self.labels[facet])}
+
+    def rows(self, facet, value):
+        """Returns the sorted rows where facet is value (empty if
+        there are none)"""
+        code = self.values[facet].get(value)
+        if code is None:
+            return self.order[facet][0:0]
+        return self.order[facet][self.offsets[facet][code]:self.offsets[facet][code+1]]
+
+    def to_bitmap(self, rows):
+        """Returns the bitmap of rows"""
+        mask = np.zeros(self.num_rows, bool)
+        mask[rows] = True
+        return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+    def bitmap(self, facet, value):
+        """Returns the bitmap of the rows where facet is value"""
+        key = (facet, value)
+        if key not in self._bitmaps:
+            self._bitmaps[key] = self.to_bitmap(self.rows(facet, value))
+        return self._bitmaps[key]
+
+    def age_bitmap(self, first=None, last=None):
+        """Returns the bitmap of the rows whose speaker is aged from
+        first to last (inclusive, None for no limit); unknown ages
+        never match"""
+        start = 0 if first is None else np.searchsorted(self.sorted_ages, first, 'left')
+        end = (np.searchsorted(self.sorted_ages, np.inf, 'right') if last is None else
+                np.searchsorted(self.sorted_ages, last, 'right'))
+        return self.to_bitmap(self.age_order[start:end])
+
+    def select(self, filters=None, ages=None):
+        """Returns the bitmap of the rows matching every facet in
+        filters (dict of facet to a list of values, any of which
+        matches) and, if given, the age range ages (first, last)"""
+
+        bitmap = self.all
+        for facet, values in (filters or {}).items():
+            if facet not in FACETS:
+                raise ValueError(f"Unknown facet: {facet}")
+            selected = 0
+            for value in values:
+                selected |= self.bitmap(facet, value)
+            bitmap &= selected
+        if ages is not None:
+            bitmap &= self.age_bitmap(*ages)
+        return bitmap
+
+    def mask(self, bitmap):
+        """Returns bitmap as a numpy bool array over the rows"""
+        packed = np.frombuffer(bitmap.to_bytes(self.num_bytes, 'little'), np.uint8)
+        return np.unpackbits(packed, count=self.num_rows, bitorder='little').astype(bool)
+
+    def selected_rows(self, bitmap):
+        """Returns the sorted rows set in bitmap"""
+        return np.flatnonzero(self.mask(bitmap))
+
+    def filter_hits(self, hits, bitmap):
+        """Returns the hits (of search.py or query.py) whose
+        utterance is set in bitmap"""
+        keep = self.mask(bitmap)
+        return [hit for hit in hits if keep[hit.utterance]]
+
+def add_facet_arguments(parser):
+    """Adds the facet filter options (read by facet_filters) to
+    an argparse parser"""
+
+    for facet in FACETS:
+        parser.add_argument('--'+facet.replace(' ', '_'), type=str, nargs='+', default=None,
+                            help=f'only utterances with any of these {facet} values')
+    parser.add_argument('--ages', type=float, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='only utterances of speakers aged from FIRST to LAST')
+
+def facet_filters(args):
+    """Returns the filters and age range of the options added
+    by add_facet_arguments (None if none were given)"""
+
+    filters = {facet: getattr(args, facet.replace(' ', '_')) for facet in FACETS
+            if getattr(args, facet.replace(' ', '_')) is not None}
+    if not filters and args.ages is None:
+        return None
+    return filters, args.ages
+
+if __name__ == "__main__":
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Speaker metadata facets of aligned BNC utterances')
+
+    parser.add_argument('--corpus', type=str, default='data/corpus/',
+                        help='corpus store made with align.py --corpus')
+    parser.add_argument('--counts', type=str, default=None,
+                        choices=[facet.replace(' ', '_') for facet in FACETS],
+                        help='print the number of selected utterances for each value of this facet')
+    add_facet_arguments(parser)
+
+    args = parser.parse_args()
+
+    index = FacetIndex(args.corpus)
+    selection = facet_filters(args) or ({}, None)
+    start = time.perf_counter()
+    bitmap = index.select(*selection)
+    elapsed = time.perf_counter() - start
+
+    if args.counts is not None:
+        facet = args.counts.replace('_', ' ')
+        keep = index.mask(bitmap)
+        for label in index.labels[facet]:
+            count = int(keep[index.rows(facet, label)].sum())
+            if count:
+                print(f"{label}\t{count}")
+    print(f"{bin(bitmap).count('1')} of {index.num_rows} utterances selected in {1e6*elapsed:.0f} us",
+            file=sys.stderr)
@@ -0,0 +1,162 @@
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PageCache:
+    """Content addressed cache of fetched pages.
+
+    Page bodies are stored under objects/ named by their sha256, and
+    index.tsv maps each url to the digest of its body (appended to, so
+    the last line for a url wins). Pages that did not change between
+    fetches share one file.
+    """
+
+    def __init__(self, path='data/html/'):
+
+        self.path = path
+        self.objects_path = os.path.join(path, 'objects')
+        self.index_fname = os.path.join(path, 'index.tsv')
+        self.index = {}
+
+        os.makedirs(self.objects_path, exist_ok=True)
+        if os.path.exists(self.index_fname):
+            with open(self.index_fname, 'r') as f:
+                for line in f:
+                    url, digest = line.rstrip('\n').split('\t')
+                    self.index[url] = digest
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def get(self, url):
+        """Returns the cached body of url, or None"""
+        if url not in self.index:
+            return None
+        try:
+            with open(os.path.join(self.objects_path, self.index[url]), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content):
+        """Stores content as the body of url and returns its digest"""
+        digest = hashlib.sha256(content).hexdigest()
+        fname = os.path.join(self.objects_path, digest)
+        if not os.path.exists(fname):
+            with open(fname+'.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(fname+'.tmp', fname)
+        if self.index.get(url) != digest:
+            self.index[url] = digest
+            with open(self.index_fname, 'a') as f:
+                f.write(f"{url}\t{digest}\n")
+        return digest
+
+
+def ordered_map(executor, fn, iterable, window):
+    """Like executor.map, but iterable is consumed lazily and at 
+    most window calls are in flight (or waiting to be yielded), 
+    so memory stays bounded for long inputs. Results are yielded 
+    in the order of iterable."""
+
+    futures = deque()
+    for item in iterable:
+        futures.append(executor.submit(fn, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+def make_session(workers=8, retries=3, backoff=0.5):
+    """Returns a requests Session with a connection pool of size
+    workers that retries failed requests with exponential backoff"""
+
+    retry = Retry(total=retries, backoff_factor=backoff,
+            status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers,
+            max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_page(url, session, mirror=None, timeout=30):
+    """Returns the body of url. If mirror is given, the page is
+    instead taken from mirror + the last part of url, where mirror
+    is either a directory of saved pages or a base url (e.g., a
+    local http.server)."""
+
+    if mirror is not None:
+        name = url.split('/')[-1]
+        if os.path.isdir(mirror):
+            with open(os.path.join(mirror, name), 'rb') as f:
+                return f.read()
+        url = mirror.rstrip('/')+'/'+name
+
+    r = session.get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
+
+def iter_pages(urls, cache_path='data/html/', workers=8, retries=3,
+        backoff=0.5, mirror=None, offline=False):
+    """Yields (url, body) for each url, in the order of urls.
+
+    Pages in the cache are read from disk; the others are fetched
+    by a pool of workers threads sharing one connection pool and
+    added to the cache. Only a few pages ahead of the consumer
+    are fetched, so urls can be long. urls can be any iterable
+    (it is read into a list first). With offline, a page missing
+    from the cache raises a KeyError instead of being fetched.
+    """
+
+    urls = list(urls)
+    cache = PageCache(cache_path)
+    missing = [url for url in urls if url not in cache]
+    if offline and missing:
+        raise KeyError(f"{len(missing)} pages not in {cache_path} (e.g., {missing[0]})")
+
+    session = make_session(workers, retries, backoff)
+
+    def fetch(url):
+        content = cache.get(url)
+        if content is None:
+            return fetch_page(url, session, mirror), True
+        return content, False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = ordered_map(executor, fetch, urls, 2*workers)
+        for url, (content, fetched) in zip(urls, results):
+            #only the main thread writes to the cache index
+            if fetched:
+                cache.put(url, content)
+            yield url, content
+    session.close()
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fetching BNC transcript html into the local cache')
+
+    parser.add_argument('--path', type=str, default='data/',
+                        help='directory with filelist-html.txt')
+    parser.add_argument('--cache_path', type=str, default='data/html/',
+                        help='directory of the html cache')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent requests')
+    parser.add_argument('--mirror', type=str, default=None,
+                        help='directory or base url to fetch pages from instead')
+
+    args = parser.parse_args()
+
+    with open(args.path+'filelist-html.txt', 'r') as f:
+        urls = sorted(set(filter(None, map(lambda x: x.strip(), f.readlines()))))
+
+    for url, content in iter_pages(urls, args.cache_path, args.workers, mirror=args.mirror):
+        print(f"Fetched {url} ({len(content)} bytes)")
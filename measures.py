@@ -0,0 +1,355 @@
+import mmap
+import os
+
+import numpy as np
+
+from tiers import read_textgrid
+from wav import read_format
+
+#Analysis parameters (and defaults) of the form in getMeasures.praat
+PARAMS = {
+    'time_step': 0.01,
+    'maximum_number_of_formants': 5,
+    'maximum_formant': 5500.,
+    'window_length': 0.025,
+    'preemphasis_from': 50.,
+    'pitch_time_step': 0.01,
+    'minimum_pitch': 75.,
+    'maximum_pitch': 600.,
+    #To Intensity... 100 0
+    'intensity_minimum_pitch': 100.,
+    #Praat's defaults for To Pitch (ac)
+    'silence_threshold': 0.03,
+    'voicing_threshold': 0.45,
+    'octave_cost': 0.01,
+}
+
+#Columns of praat_measures.csv
+HEADER = ['fname', 'word', 'phone', 'start', 'end', 'midpoint', 'duration',
+        'f0_mid', 'intensity_mid', 'f0_max', 'f0_min', 'f0_mean', 'f0_std',
+        'intensity_max', 'intensity_min', 'intensity_mean', 'intensity_std',
+        'F1_mid', 'F2_mid']
+
+#How Praat writes a missing value
+UNDEFINED = '--undefined--'
+
+
+def read_wav(fname):
+    """Returns the samples of a PCM wav file (channels averaged,
+    scaled to -1..1 like Praat) and its sampling rate
+
+    Returns:
+        np.ndarray, int
+    """
+
+    with open(fname, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        wav = read_format(buf)
+        channels, = np.frombuffer(wav.fmt[2:4], '<u2')
+        width = wav.block_align // channels
+        data = np.frombuffer(buf, np.uint8, wav.data_size - wav.data_size % wav.block_align,
+                wav.data_offset).copy()
+    finally:
+        buf.close()
+
+    if width == 1:
+        samples = (data.astype(np.float64)-128)/128
+    elif width == 3:
+        data = data.reshape(-1, 3)
+        ints = (data[:, 0].astype(np.int32) | (data[:, 1].astype(np.int32) << 8) |
+                (data[:, 2].astype(np.int8).astype(np.int32) << 16))
+        samples = ints/float(1 << 23)
+    else:
+        dtype = {2: '<i2', 4: '<i4'}[width]
+        samples = data.view(dtype)/float(1 << (8*width-1))
+    return samples.reshape(-1, channels).mean(axis=1), int(wav.rate)
+
+def frame_times(duration, window, step):
+    """Returns the centres of the analysis frames of window
+    seconds every step seconds, centred in duration (as Praat)"""
+    num_frames = int(np.floor((duration-window)/step)) + 1
+    if num_frames < 1:
+        return np.zeros(0)
+    first = (duration - (num_frames-1)*step)/2
+    return first + step*np.arange(num_frames)
+
+def frames(samples, rate, times, window):
+    """Returns the samples of window seconds around each of times
+    as rows of a matrix (zero padded at the edges)"""
+    n = int(round(window*rate))
+    starts = np.round(times*rate).astype(int) - n//2
+    padded = np.concatenate([np.zeros(n), samples, np.zeros(n)])
+    idx = starts[:, None] + n + np.arange(n)[None, :]
+    return padded[np.clip(idx, 0, len(padded)-1)]
+
+def pitch_track(samples, rate, params=PARAMS):
+    """Returns frame times and f0 (nan where unvoiced) estimated
+    by autocorrelation (Boersma 1993, as Praat's To Pitch (ac),
+    without the path finder): each frame of 3 periods of the
+    minimum pitch is Hanning windowed, its autocorrelation
+    (by FFT, for all frames at once) is divided by that of the
+    window, and the best lag in the pitch range (with Praat's
+    octave cost) is refined by parabolic interpolation. Frames
+    whose peak is below the voicing threshold or that are
+    silent are unvoiced."""
+
+    window = 3/params['minimum_pitch']
+    times = frame_times(len(samples)/rate, window, params['pitch_time_step'])
+    if len(times) == 0:
+        return times, np.zeros(0)
+
+    x = frames(samples, rate, times, window)
+    n = x.shape[1]
+    local_peak = np.abs(x - x.mean(axis=1, keepdims=True)).max(axis=1)
+    global_peak = np.abs(samples - samples.mean()).max()
+
+    hann = np.hanning(n)
+    x = (x - x.mean(axis=1, keepdims=True))*hann
+    nfft = 1 << int(np.ceil(np.log2(2*n)))
+    r = np.fft.irfft(np.abs(np.fft.rfft(x, nfft))**2, nfft)
+    rw = np.fft.irfft(np.abs(np.fft.rfft(hann, nfft))**2, nfft)
+
+    min_lag = max(int(np.floor(rate/params['maximum_pitch'])), 1)
+    max_lag = min(int(np.ceil(rate/params['minimum_pitch'])), n-2)
+    lags = np.arange(min_lag, max_lag+1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm = r[:, :max_lag+2]/r[:, :1]/(rw[:max_lag+2]/rw[0])
+    norm = np.nan_to_num(norm)
+
+    #strength with the octave cost favouring higher pitch
+    strength = norm[:, lags] - params['octave_cost']*np.log2(params['minimum_pitch']*lags/rate)
+    best = lags[np.argmax(strength, axis=1)]
+    rows = np.arange(len(times))
+    left, mid, right = norm[rows, best-1], norm[rows, best], norm[rows, best+1]
+    denom = left - 2*mid + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(denom < 0, 0.5*(left-right)/denom, 0.)
+    peak = mid - 0.25*(left-right)*shift
+
+    f0 = rate/(best+shift)
+    voiced = ((peak > params['voicing_threshold']) &
+            (local_peak > params['silence_threshold']*global_peak) &
+            (f0 >= params['minimum_pitch']) & (f0 <= params['maximum_pitch']))
+    return times, np.where(voiced, f0, np.nan)
+
+def intensity_track(samples, rate, params=PARAMS):
+    """Returns frame times and intensity (dB re 2e-5 Pa) as Praat's
+    To Intensity: mean subtracted, Kaiser windowed frames of
+    6.4/minimum pitch seconds every 0.8/minimum pitch seconds"""
+
+    min_pitch = params['intensity_minimum_pitch']
+    window = 6.4/min_pitch
+    times = frame_times(len(samples)/rate, window, 0.8/min_pitch)
+    if len(times) == 0:
+        return times, np.zeros(0)
+
+    x = frames(samples, rate, times, window)
+    w = np.kaiser(x.shape[1], 20)
+    mean = (x*w).sum(axis=1, keepdims=True)/w.sum()
+    power = (((x-mean)**2)*w).sum(axis=1)/w.sum()
+    with np.errstate(divide='ignore'):
+        return times, np.maximum(10*np.log10(power/4e-10), -300.)
+
+def resample(samples, rate, new_rate):
+    """Returns samples resampled to new_rate (by FFT)"""
+    n = int(round(len(samples)*new_rate/rate))
+    spectrum = np.fft.rfft(samples)
+    keep = n//2 + 1
+    spectrum = spectrum[:keep] if len(spectrum) >= keep else np.pad(spectrum, (0, keep-len(spectrum)))
+    return np.fft.irfft(spectrum, n)*n/len(samples)
+
+def burg(x, order):
+    """Returns the LPC coefficients (a[0] = 1) of each row of x
+    by Burg's method, all rows at once
+
+    Returns:
+        np.ndarray: (rows, order+1)
+    """
+
+    a = np.zeros((x.shape[0], order+1))
+    a[:, 0] = 1
+    f, b = x[:, 1:], x[:, :-1]
+    for m in range(order):
+        num = -2*(f*b).sum(axis=1)
+        den = (f*f + b*b).sum(axis=1)
+        k = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+        a[:, :m+2] = a[:, :m+2] + k[:, None]*a[:, m+1::-1]
+        f, b = (f + k[:, None]*b)[:, 1:], (b + k[:, None]*f)[:, :-1]
+    return a
+
+def formant_track(samples, rate, params=PARAMS):
+    """Returns frame times and F1 and F2 (nan if missing) as
+    Praat's To Formant (burg): resampled to twice the maximum
+    formant, pre-emphasised, Gaussian windowed frames of twice
+    the window length, 2 * number of formants LPC poles by Burg's
+    method, and formants from the roots above 50 Hz and below
+    the maximum formant - 50 Hz"""
+
+    new_rate = 2*params['maximum_formant']
+    if rate > new_rate:
+        samples, rate = resample(samples, rate, new_rate), new_rate
+    alpha = np.exp(-2*np.pi*params['preemphasis_from']/rate)
+    samples = np.concatenate([samples[:1], samples[1:] - alpha*samples[:-1]])
+
+    window = 2*params['window_length']
+    times = frame_times(len(samples)/rate, window, params['time_step'])
+    if len(times) == 0:
+        return times, np.zeros(0), np.zeros(0)
+
+    x = frames(samples, rate, times, window)
+    n = x.shape[1]
+    edge = np.exp(-12.)
+    gauss = (np.exp(-48*((np.arange(n)+0.5)/n - 0.5)**2) - edge)/(1 - edge)
+    a = burg(x*gauss, 2*params['maximum_number_of_formants'])
+
+    #roots of all frames at once as eigenvalues of companion matrices
+    order = a.shape[1]-1
+    companion = np.zeros((len(times), order, order))
+    companion[:, 0, :] = -a[:, 1:]
+    companion[:, np.arange(1, order), np.arange(order-1)] = 1
+    roots = np.linalg.eigvals(companion)
+
+    freqs = np.angle(roots)*rate/(2*np.pi)
+    valid = (roots.imag > 0) & (freqs > 50) & (freqs < rate/2-50)
+    freqs = np.sort(np.where(valid, freqs, np.inf), axis=1)
+    freqs[np.isinf(freqs)] = np.nan
+    return times, freqs[:, 0], freqs[:, 1]
+
+def value_at(times, values, t):
+    """Returns values linearly interpolated at t (nan if t is
+    outside the frames or next to an undefined frame)"""
+    if len(times) == 0 or t < times[0] or t > times[-1]:
+        return np.nan
+    return float(np.interp(t, times, values))
+
+def values_between(times, values, start, end):
+    """Returns the defined values of frames from start to end"""
+    selected = values[(times >= start) & (times <= end)]
+    return selected[~np.isnan(selected)]
+
+def _fmt(value):
+    if value is None or np.isnan(value):
+        return UNDEFINED
+    return repr(float(value))
+
+def measure(wav_fname, textgrid_fname, params=PARAMS):
+    """Returns the rows of praat_measures.csv for one sound file
+    and its TextGrid: one row per labelled interval of the phone
+    tier (tier 1), measured at its midpoint and over the interval,
+    with the word (tier 2) at the midpoint.
+
+    Returns:
+        List[List[str]]: Values of HEADER for each interval.
+    """
+
+    samples, rate = read_wav(wav_fname)
+    tg = read_textgrid(textgrid_fname)
+    phones, words = tg[0], tg[1]
+
+    pitch_times, f0 = pitch_track(samples, rate, params)
+    intensity_times, intensity = intensity_track(samples, rate, params)
+    formant_times, f1, f2 = formant_track(samples, rate, params)
+
+    soundname = os.path.splitext(os.path.basename(wav_fname))[0]
+    rows = []
+    for start, end, phone in zip(phones.starts, phones.ends, phones.marks):
+        if phone == "":
+            continue
+        duration = end-start
+        midpoint = (start + end)/2
+        word_idx = words.index_containing(midpoint)
+        word = words.marks[word_idx] if word_idx is not None else ''
+
+        pitch = values_between(pitch_times, f0, start, end)
+        level = values_between(intensity_times, intensity, start, end)
+        if len(level):
+            level_mean = 10*np.log10(np.mean(10**(level/10)))
+        values = [value_at(pitch_times, f0, midpoint),
+                value_at(intensity_times, intensity, midpoint),
+                pitch.max() if len(pitch) else None,
+                pitch.min() if len(pitch) else None,
+                pitch.mean() if len(pitch) else None,
+                pitch.std(ddof=1) if len(pitch) > 1 else None,
+                level.max() if len(level) else None,
+                level.min() if len(level) else None,
+                level_mean if len(level) else None,
+                level.std(ddof=1) if len(level) > 1 else None,
+                value_at(formant_times, f1, midpoint),
+                value_at(formant_times, f2, midpoint)]
+        rows.append([soundname, word, phone, repr(start), repr(end), repr(midpoint),
+            repr(duration)] + [_fmt(value) for value in values])
+    return rows
+
+def _measure_job(job):
+    """Unpacks a (wav_fname, textgrid_fname, params) job for
+    executor.map in measure_directory"""
+    return measure(*job)
+
+def measure_directory(sound_directory='data/downloads/audio/',
+        textgrid_directory='data/downloads/textgrids/',
+        resultsfile='praat_measures.csv', workers=1, params=PARAMS,
+        sound_file_extension='.wav', textgrid_file_extension='.TextGrid'):
+    """Measures every sound file in sound_directory that has a
+    TextGrid of the same name in textgrid_directory (like
+    getMeasures.praat) and writes the rows to resultsfile. With
+    workers > 1 files are measured in a process pool; rows are
+    written in the order of the files either way.
+
+    Returns:
+        int: Number of rows written.
+    """
+
+    jobs = []
+    for fname in sorted(os.listdir(sound_directory)):
+        if not fname.endswith(sound_file_extension):
+            continue
+        gridfile = textgrid_directory+fname[:-len(sound_file_extension)]+textgrid_file_extension
+        if os.path.exists(gridfile):
+            jobs.append((sound_directory+fname, gridfile, params))
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_measure_job, jobs)
+    else:
+        executor = None
+        results = map(_measure_job, jobs)
+
+    num_rows = 0
+    with open(resultsfile, 'w') as f:
+        f.write(','.join(HEADER)+'\n')
+        for job, rows in zip(jobs, results):
+            print(f"Measured {job[0]}...")
+            for row in rows:
+                f.write(','.join(row)+'\n')
+            num_rows += len(rows)
+
+    if executor is not None:
+        executor.shutdown()
+    return num_rows
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Getting pitch, formants, intensity and duration of labelled phones (like getMeasures.praat)')
+
+    parser.add_argument('--sound_directory', type=str, default='data/downloads/audio/',
+                        help='directory of sound files')
+    parser.add_argument('--textgrid_directory', type=str, default='data/downloads/textgrids/',
+                        help='directory of TextGrid files')
+    parser.add_argument('--resultsfile', type=str, default='praat_measures.csv',
+                        help='resulting csv file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to measure files with')
+    for name, default in PARAMS.items():
+        parser.add_argument('--'+name, type=type(default), default=default,
+                            help=f'analysis parameter (default {default})')
+
+    args = parser.parse_args()
+
+    params = {name: getattr(args, name) for name in PARAMS}
+    num_rows = measure_directory(args.sound_directory, args.textgrid_directory,
+            args.resultsfile, args.workers, params)
+    print(f"Saved {num_rows} measurements to {args.resultsfile}")
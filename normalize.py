@@ -0,0 +1,72 @@
+import re
+
+#Characters stripped from words before comparing them with TextGrid words
+PUNCTUATION = ",.;:?!)("
+PUNCTUATION_TABLE = str.maketrans('', '', PUNCTUATION)
+
+#Rewrite rules applied (in order) to transcript utterances before
+#they are aligned with the word tier of a TextGrid. Each rule is
+#(kind, pattern, replacement) where kind is 'replace' (literal
+#substring) or 'regex'.
+UTTERANCE_RULES = [
+    ('replace', '/', ' '),
+    ('replace', '-', ' '),
+    ('replace', ' & ', ' and'),
+    ('regex', r"\[[a-z\s*\'\+A-Z]*\]", ''),
+    ###Bunch of random issues
+    ('replace', '—', ''),
+    #I could parse this issue away...
+    ('replace', " 's", "'s"),
+    ('replace', " n't", "n't"),
+    ('replace', " 'll", "'ll"),
+    ('replace', "]'s", "] 's"),
+    ('replace', " 'un", "'un"),
+    ('replace', "an' ", "an'"),
+    ('replace', "o' ", "o'"),
+    ('replace', "o 'clock", "o'clock"),
+    ('replace', "Now,Mond", "Now, Mond"),
+    ('replace', ".ep", ""),
+    ('replace', "oiA_011207.tmp", 'oiA_011207 .tmp'),
+    ('replace', "smelly's", "smelly 's"),
+    ('replace', "0's", "0 's"),
+    ('replace', "&;", ""),
+    #fix comma without space
+    ('regex', r"(?<=[,])(?=[^\s])", " "),
+]
+
+
+class Normalizer:
+    """Applies an ordered table of rewrite rules to strings.
+
+    The table is compiled once when the Normalizer is built 
+    (regexes are precompiled), so calling it is one pass over 
+    the rules with no per call setup. Calling the Normalizer 
+    gives the same result as applying the rules one after another.
+    """
+
+    def __init__(self, rules):
+
+        self.rules = list(rules)
+        self.passes = []
+
+        for kind, pattern, replacement in self.rules:
+            if kind == 'replace':
+                self.passes.append((False, pattern, replacement))
+            elif kind == 'regex':
+                self.passes.append((True, re.compile(pattern), replacement))
+            else:
+                raise ValueError(f"Unknown rule kind: {kind}")
+
+    def __call__(self, text):
+        for is_regex, pattern, replacement in self.passes:
+            if is_regex:
+                text = pattern.sub(replacement, text)
+            else:
+                text = text.replace(pattern, replacement)
+        return text
+
+normalize_utterance = Normalizer(UTTERANCE_RULES)
+
+def strip_punctuation(word):
+    """Returns word without the characters in PUNCTUATION"""
+    return word.translate(PUNCTUATION_TABLE)
@@ -0,0 +1,181 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+from heapq import heappush, heapreplace
+
+
+class Profiler:
+    """Wall time, item counts and slowest items of the stages of a
+    build (e.g., fetch, parse, textgrid, normalize, align, export).
+
+    Stages are recorded with add, the stage context manager or
+    iterate. Each stage keeps its total seconds and items and the
+    slowest items (e.g., transcripts or tapes) it was recorded with.
+    Stages can nest (normalize is part of align), so their seconds
+    do not add up to the wall time. Work done in other processes is
+    recorded there and merged back (see collect).
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds, items=1, item=None):
+        """Records seconds spent on items of stage (item names
+        the work for the slowest list, e.g., a transcript html)"""
+
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0., 0, []]
+        entry[0] += seconds
+        entry[1] += items
+        if item is not None:
+            self._keep(entry[2], seconds, item)
+
+    def _keep(self, heap, seconds, item):
+        if len(heap) < self.slowest:
+            heappush(heap, (seconds, item))
+        elif seconds > heap[0][0]:
+            heapreplace(heap, (seconds, item))
+
+    @contextmanager
+    def stage(self, name, items=1, item=None):
+        """Records the time spent in the with block under stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter()-start, items, item)
+
+    def iterate(self, name, iterable, key=None):
+        """Yields the items of iterable, recording the time waiting
+        for each under stage name (named by key(item) if key is given)"""
+
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter()-start, 1,
+                    None if key is None else key(value))
+            yield value
+
+    def take(self):
+        """Returns the recorded stages and clears them"""
+        stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages):
+        """Adds stages (as from take) to the recorded stages"""
+
+        for name, (seconds, items, heap) in stages.items():
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = [0., 0, []]
+            entry[0] += seconds
+            entry[1] += items
+            for item_seconds, item in heap:
+                self._keep(entry[2], item_seconds, item)
+
+    def report(self, **info):
+        """Returns the run report: info, wall and cpu seconds, peak
+        RSS (of this process and of its largest worker process) and
+        for each stage its seconds, items, items/sec and slowest items
+
+        Returns:
+            Dict
+        """
+
+        report = dict(info)
+        report['wall seconds'] = time.perf_counter() - self.start
+        report.update(_usage())
+        stages = {}
+        for name, (seconds, items, heap) in self.stages.items():
+            stages[name] = {'seconds': seconds, 'items': items,
+                    'items/sec': items/seconds if seconds else None,
+                    'slowest': [{'item': item, 'seconds': item_seconds}
+                        for item_seconds, item in sorted(heap, reverse=True)]}
+        report['stages'] = stages
+        return report
+
+    def write(self, fname, **info):
+        """Writes the report (see report) to fname as JSON and a
+        summary of the stages to stderr"""
+
+        report = self.report(**info)
+        with open(fname, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        print(f"{'stage':<12}{'seconds':>10}{'items':>10}{'items/sec':>12}  slowest", file=sys.stderr)
+        for name, stage in report['stages'].items():
+            rate = '' if stage['items/sec'] is None else f"{stage['items/sec']:.1f}"
+            slowest = ''
+            if stage['slowest']:
+                slowest = f"{stage['slowest'][0]['item']} ({stage['slowest'][0]['seconds']:.2f}s)"
+            print(f"{name:<12}{stage['seconds']:>10.2f}{stage['items']:>10}{rate:>12}  {slowest}",
+                    file=sys.stderr)
+        print(f"{report['wall seconds']:.2f}s wall, peak RSS {report['peak rss mb']:.0f} MB "
+                f"(workers {report['peak rss children mb']:.0f} MB), report in {fname}", file=sys.stderr)
+        return report
+
+def _usage():
+    """Returns the cpu seconds and peak RSS (in MB) of this process
+    and of its (finished) worker processes"""
+
+    try:
+        import resource
+    except ImportError:
+        #not on Windows
+        return {'cpu seconds': time.process_time(), 'peak rss mb': float('nan'),
+                'children cpu seconds': float('nan'), 'peak rss children mb': float('nan')}
+
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1/2**20 if sys.platform == 'darwin' else 1/2**10
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'cpu seconds': usage.ru_utime + usage.ru_stime,
+            'peak rss mb': usage.ru_maxrss*scale,
+            'children cpu seconds': children.ru_utime + children.ru_stime,
+            'peak rss children mb': children.ru_maxrss*scale}
+
+#Profiler of this process, used by the build pipeline (align.py,
+#BNCClasses.transcripts2csv)
+PROFILER = Profiler()
+
+def collect(function, *args):
+    """Returns function(*args) and the stages it recorded in PROFILER,
+    leaving PROFILER as it was. Jobs run in worker processes return
+    the stages so they can be merged into the PROFILER of the main
+    process (and in the main process this keeps them from being
+    counted twice).
+
+    Returns:
+        Any, Dict: The result and the stages (as from Profiler.take).
+    """
+
+    saved = PROFILER.take()
+    try:
+        result = function(*args)
+        return result, PROFILER.take()
+    finally:
+        PROFILER.merge(saved)
+
+def run_profiled(fname, function, *args, **kwargs):
+    """Returns function(*args, **kwargs), run under cProfile. The
+    stats are dumped to fname (for pstats or snakeviz) and the top
+    functions by cumulative time printed to stderr. Only this process
+    is profiled, so run with one worker to see the alignment."""
+
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        profile.dump_stats(fname)
+        pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
@@ -0,0 +1,210 @@
+import re
+import sys
+import time
+from functools import lru_cache
+from itertools import groupby
+
+from corpus import CorpusStore
+from fetch import ordered_map
+from search import (Hit, HIT_COLUMNS, PhonePattern, hit_rows, open_index)
+
+
+class WordPattern:
+    """A word sequence query over the cleaned text of utterances.
+
+    Tokens are separated by spaces: a word matches itself, a word
+    with * matches any word it globs (e.g., hand*), . matches any
+    one word, and X ~N Y matches X and Y (in either order) at most
+    N words apart (N >= 1; a ~N joins two words, so it cannot be
+    chained). For example 'thank ~3 much' or 'the . man'.
+    The pattern is compiled to a regex over the words of an
+    utterance (each followed by a space), and its plain words are
+    the words every matching utterance must have.
+    """
+
+    def __init__(self, query):
+
+        self.query = query
+        self.tokens = query.lower().split()
+        if not self.tokens or self.tokens[0].startswith('~') or self.tokens[-1].startswith('~'):
+            raise ValueError(f"Bad word pattern: {query}")
+
+        #words every match must have (for the index)
+        self.words = {token for token in self.tokens
+                if token != '.' and '*' not in token and not token.startswith('~')}
+
+        parts = []
+        idx = 0
+        while idx < len(self.tokens):
+            token = self.tokens[idx]
+            if token.startswith('~'):
+                #a chain (a ~2 b ~2 c) or two ~N in a row
+                raise ValueError(f"Bad word pattern, ~N can only join two words: {query}")
+            if idx+2 < len(self.tokens) and self.tokens[idx+1].startswith('~'):
+                distance = self.tokens[idx+1][1:]
+                if not distance.isdigit() or int(distance) < 1:
+                    raise ValueError(f"Bad word pattern, ~N needs a number N >= 1: {query}")
+                distance = int(distance)
+                if self.tokens[idx+2].startswith('~'):
+                    raise ValueError(f"Bad word pattern, ~N can only join two words: {query}")
+                left, right = word_regex(token), word_regex(self.tokens[idx+2])
+                gap = r'(?:\S+ ){0,%d}' % (distance-1)
+                parts.append(f'(?:{left} {gap}{right} |{right} {gap}{left} )')
+                idx += 3
+            else:
+                parts.append(word_regex(token)+' ')
+                idx += 1
+        #every start of a word, overlapping matches included
+        self.regex = re.compile(r'(?:^|(?<= ))(?=(' + ''.join(parts) + '))')
+
+    def match(self, text):
+        """Returns (first word, last word) of each match in a
+        'cleaned text' value (words are counted from 0)"""
+
+        text = text + ' '
+        spans = []
+        for m in self.regex.finditer(text):
+            first = text.count(' ', 0, m.start(1))
+            last = text.count(' ', 0, m.end(1))-1
+            spans.append((first, last))
+        return spans
+
+def word_regex(token):
+    """Returns the regex of a word token of a WordPattern"""
+    if token == '.':
+        return r'\S+'
+    return r'\S*'.join(re.escape(part) for part in token.split('*'))
+
+
+#Column of the corpus store each kind of pattern is matched against
+PATTERNS = {'words': (WordPattern, 'cleaned text'),
+        'phones': (PhonePattern, 'phones')}
+
+@lru_cache(maxsize=None)
+def _open(corpus_path):
+    return CorpusStore(corpus_path)
+
+@lru_cache(maxsize=None)
+def _open_index(corpus_path, index_path, kind):
+    return open_index(corpus_path, index_path, kind)
+
+@lru_cache(maxsize=16)
+def compile_pattern(kind, query):
+    """Returns the WordPattern or PhonePattern of query"""
+    return PATTERNS[kind][0](query)
+
+def match_rows(corpus_path, kind, query, rows):
+    """Returns the Hits of query in rows of the corpus store"""
+
+    corpus = _open(corpus_path)
+    pattern = compile_pattern(kind, query)
+    values = corpus[PATTERNS[kind][1]]
+    times = corpus['word times']
+    hits = []
+    for row in rows:
+        spans = pattern.match(values[row])
+        if not spans:
+            continue
+        word_times = times[row]
+        for first, last in spans:
+            hits.append(Hit(row, first, word_times[2*first], word_times[2*last+1]))
+    return hits
+
+def _match_rows_job(job):
+    """Unpacks a (corpus_path, kind, query, rows) job for
+    executor.map in run_query"""
+    return match_rows(*job)
+
+def candidate_rows(corpus_path, kind, query, index_path=None):
+    """Returns the sorted rows that can match query, using the
+    word index (rows with every plain word of a WordPattern) or
+    the phone index (rows with every n-gram of a PhonePattern)"""
+
+    pattern = compile_pattern(kind, query)
+    if index_path is None:
+        index_path = f'data/index/{kind}/'
+    index = _open_index(corpus_path, index_path, kind)
+
+    if kind == 'phones':
+        return index.candidates(pattern)
+
+    lists = sorted((index.rows(word) for word in pattern.words), key=len)
+    if not lists:
+        return range(len(index.corpus))
+    rows = set(lists[0])
+    for utterances in lists[1:]:
+        rows.intersection_update(utterances)
+        if not rows:
+            break
+    return sorted(rows)
+
+def run_query(corpus_path, kind, query, workers=1, index_path=None, keep=None, 
+        executor=None):
+    """Yields the Hits of query (a WordPattern or PhonePattern,
+    depending on kind) in the corpus store, in corpus order.
+
+    Candidate rows come from the index of kind and are split
+    by tape (TextGrid), so each tape is one job. With workers > 1
+    the jobs run in a process pool and their hits are yielded as
+    they come back (in order), so output can start before the
+    whole corpus is searched. keep (a bool array over the rows, 
+    e.g., FacetIndex.mask) drops candidates before they are matched. 
+    A long running caller (e.g., server.py) can pass its own process 
+    pool as executor, which is used instead of starting one. 
+    """
+
+    rows = candidate_rows(corpus_path, kind, query, index_path)
+    if keep is not None:
+        rows = [row for row in rows if keep[row]]
+    tapes = _open(corpus_path)['TextGrid fname'].codes
+    jobs = ((corpus_path, kind, query, list(tape_rows))
+            for _, tape_rows in groupby(rows, key=lambda row: tapes[row]))
+
+    if executor is not None:
+        for hits in ordered_map(executor, _match_rows_job, jobs, 4*max(workers, 1)):
+            yield from hits
+    elif workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for hits in ordered_map(executor, _match_rows_job, jobs, 4*workers):
+                yield from hits
+    else:
+        for job in jobs:
+            yield from _match_rows_job(job)
+
+if __name__ == "__main__":
+
+    import argparse
+    from facets import FacetIndex, add_facet_arguments, facet_filters
+
+    parser = argparse.ArgumentParser(description='Pattern search over the words or phones of aligned BNC utterances')
+
+    parser.add_argument('kind', type=str, choices=['words', 'phones'],
+                        help='match the pattern against the cleaned words or the phones')
+    parser.add_argument('pattern', type=str,
+                        help='e.g., "thank ~3 much" or "[V2] N |" (see WordPattern and PhonePattern)')
+    parser.add_argument('--corpus', type=str, default='data/corpus/',
+                        help='corpus store made with align.py --corpus')
+    parser.add_argument('--index', type=str, default=None,
+                        help='directory of the index (default data/index/words/ or data/index/phones/)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to match tapes with')
+    parser.add_argument('--padding', type=float, default=0,
+                        help='padding (in seconds) for the clip commands')
+    add_facet_arguments(parser)
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    keep = None
+    selection = facet_filters(args)
+    if selection is not None:
+        facets = FacetIndex(args.corpus)
+        keep = facets.mask(facets.select(*selection))
+    hits = run_query(args.corpus, args.kind, args.pattern, args.workers, args.index, keep)
+    num_hits = 0
+    print('\t'.join(['utterance'] + HIT_COLUMNS + ['start time', 'end time', 'python clip command']))
+    for row in hit_rows(_open(args.corpus), hits, args.padding):
+        print('\t'.join(map(str, row)))
+        num_hits += 1
+    print(f"{num_hits} hits in {1000*(time.perf_counter()-start):.1f} ms", file=sys.stderr)
@@ -0,0 +1,491 @@
+import json
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from BNCClasses import clip_command
+from corpus import CorpusStore, _map
+
+#A match of a query: row of the utterance in the corpus store,
+#position of its first word in 'cleaned text' (split on spaces),
+#and the start and end time of the matched words
+Hit = namedtuple("Hit", "utterance, position, start, end")
+
+#Columns of the rows printed for each hit (besides the hit times)
+HIT_COLUMNS = ['tape', 'speaker', 'TextGrid fname', 'cleaned text']
+
+
+def _words(text):
+    return text.split(' ')
+
+def build_word_index(corpus_path='data/corpus/', index_path='data/index/words/'):
+    """Builds an inverted index of the cleaned words of the
+    utterances in a corpus store (see corpus.py).
+
+    Each term maps to its postings: the utterance (row of the
+    corpus store), the position of the word in the utterance and
+    the start and end time of the word, sorted by utterance and
+    position. The terms are sorted (so prefixes are a range of
+    terms) and the postings are stored as arrays in the order of
+    the terms, so the index is two passes over the corpus and
+    is memory mapped when searched.
+
+    Returns:
+        int: Number of postings.
+    """
+
+    corpus = CorpusStore(corpus_path)
+    texts = corpus['cleaned text']
+    times = corpus['word times']
+
+    #First pass counts the postings of each term
+    counts = {}
+    for text in texts:
+        for word in _words(text):
+            if word:
+                counts[word] = counts.get(word, 0) + 1
+
+    terms = sorted(counts)
+    offsets = array('q', [0])
+    cursor = {}
+    for term in terms:
+        cursor[term] = offsets[-1]
+        offsets.append(offsets[-1]+counts[term])
+    num_postings = offsets[-1]
+
+    #Second pass puts each posting in its term's slot
+    utterances = array('i', [0])*num_postings
+    positions = array('i', [0])*num_postings
+    starts = array('d', [0.])*num_postings
+    ends = array('d', [0.])*num_postings
+    for row in range(len(corpus)):
+        word_times = times[row]
+        for position, word in enumerate(_words(texts[row])):
+            if not word:
+                continue
+            idx = cursor[word]
+            cursor[word] += 1
+            utterances[idx] = row
+            positions[idx] = position
+            starts[idx] = word_times[2*position]
+            ends[idx] = word_times[2*position+1]
+
+    os.makedirs(index_path, exist_ok=True)
+    with open(os.path.join(index_path, 'terms.json'), 'w') as f:
+        json.dump(terms, f, ensure_ascii=False)
+    for name, values in [('postings.off', offsets), ('utterance.i4', utterances),
+            ('position.i4', positions), ('start.f8', starts), ('end.f8', ends)]:
+        with open(os.path.join(index_path, name), 'wb') as f:
+            f.write(values.tobytes())
+
+    manifest = {'corpus': os.path.abspath(corpus_path), 'rows': len(corpus),
+            'terms': len(terms), 'postings': num_postings}
+    with open(os.path.join(index_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return num_postings
+
+
+class WordIndex:
+    """Read side of an index written by build_word_index.
+
+    The sorted terms are loaded and the postings memory mapped,
+    so a query is a bisect for each term and a slice of the
+    posting arrays. Phrases start from the postings of their
+    rarest word and check the other words against the cleaned
+    text of the utterance in the corpus store.
+    """
+
+    def __init__(self, path='data/index/words/', corpus_path=None):
+
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'terms.json'), 'r') as f:
+            self.terms = json.load(f)
+        self.offsets = _map(os.path.join(path, 'postings.off')).cast('q')
+        self.utterances = _map(os.path.join(path, 'utterance.i4')).cast('i')
+        self.positions = _map(os.path.join(path, 'position.i4')).cast('i')
+        self.starts = _map(os.path.join(path, 'start.f8')).cast('d')
+        self.ends = _map(os.path.join(path, 'end.f8')).cast('d')
+
+        if corpus_path is None:
+            corpus_path = self.manifest['corpus']
+        self.corpus = CorpusStore(corpus_path)
+
+    def term_range(self, first, last):
+        """Returns the range of term ids from first (inclusive)
+        to last (exclusive) in sorted order"""
+        return range(bisect_left(self.terms, first), bisect_left(self.terms, last))
+
+    def postings(self, term_id):
+        """Returns the Hits of term_id"""
+        start, end = self.offsets[term_id], self.offsets[term_id+1]
+        return [Hit(u, p, s, e) for u, p, s, e in zip(self.utterances[start:end],
+            self.positions[start:end], self.starts[start:end], self.ends[start:end])]
+
+    def rows(self, term):
+        """Returns the utterances (rows) of the postings of term, 
+        in order (with repeats for words used more than once)"""
+        term_id = bisect_left(self.terms, term)
+        if term_id == len(self.terms) or self.terms[term_id] != term:
+            return self.utterances[0:0]
+        return self.utterances[self.offsets[term_id]:self.offsets[term_id+1]]
+
+    def count(self, term):
+        """Returns the number of postings of term"""
+        term_id = bisect_left(self.terms, term)
+        if term_id == len(self.terms) or self.terms[term_id] != term:
+            return 0
+        return self.offsets[term_id+1]-self.offsets[term_id]
+
+    def exact(self, term):
+        """Returns the Hits of the word term"""
+        term_id = bisect_left(self.terms, term)
+        if term_id == len(self.terms) or self.terms[term_id] != term:
+            return []
+        return self.postings(term_id)
+
+    def prefix(self, prefix):
+        """Returns the Hits of every word starting with prefix
+        (sorted by utterance and position)"""
+        hits = []
+        for term_id in self.term_range(prefix, prefix+'\U0010ffff'):
+            hits.extend(self.postings(term_id))
+        hits.sort()
+        return hits
+
+    def phrase(self, words):
+        """Returns the Hits of the words in sequence (start of
+        the first to end of the last)"""
+
+        if len(words) == 1:
+            return self.exact(words[0])
+
+        counts = [self.count(word) for word in words]
+        if min(counts) == 0:
+            return []
+        rarest = counts.index(min(counts))
+
+        texts = self.corpus['cleaned text']
+        times = self.corpus['word times']
+        hits = []
+        for hit in self.exact(words[rarest]):
+            position = hit.position - rarest
+            if position < 0:
+                continue
+            if _words(texts[hit.utterance])[position:position+len(words)] != words:
+                continue
+            word_times = times[hit.utterance]
+            hits.append(Hit(hit.utterance, position, word_times[2*position],
+                word_times[2*(position+len(words))-1]))
+        return hits
+
+    def search(self, query):
+        """Returns the Hits of query: several words are a phrase,
+        a word ending in * a prefix, otherwise an exact word
+        (all lower case, as in 'cleaned text')"""
+
+        words = query.lower().split()
+        if not words:
+            raise ValueError("empty query")
+        if len(words) > 1:
+            return self.phrase(words)
+        if words[0].endswith('*'):
+            return self.prefix(words[0][:-1])
+        return self.exact(words[0])
+
+#Word boundary in phone sequences (| in the phones column)
+BOUNDARY = '#'
+STRESS = re.compile(r'\d+$')
+
+def phone_tokens(phones):
+    """Returns the phones of a 'phones' value (e.g., '| DH AH0 | K AE1 T |') 
+    as a list of tokens with BOUNDARY between (and around) words"""
+    return phones.replace('|', ' '+BOUNDARY+' ').split()
+
+def strip_stress(token):
+    return STRESS.sub('', token)
+
+def phone_ngrams(tokens, n=3):
+    """Returns the set of stress stripped n-grams (joined by
+    spaces) of a list of phone tokens"""
+    tokens = [strip_stress(token) for token in tokens]
+    return {' '.join(tokens[i:i+n]) for i in range(len(tokens)-n+1)}
+
+def build_phone_index(corpus_path='data/corpus/', index_path='data/index/phones/', n=3):
+    """Builds an n-gram index of the phones of the utterances in
+    a corpus store. Each n-gram of phones (stress stripped, with
+    word boundaries as tokens, e.g., 'M AE N', 'AE N #') maps to
+    the sorted utterances (rows) it occurs in. Like the word index,
+    n-grams are sorted and the postings are one array in their order.
+
+    Returns:
+        int: Number of postings.
+    """
+
+    corpus = CorpusStore(corpus_path)
+
+    #utterances of each n-gram, in order of utterance
+    postings = {}
+    for row, phones in enumerate(corpus['phones']):
+        for gram in phone_ngrams(phone_tokens(phones), n):
+            postings.setdefault(gram, array('i')).append(row)
+
+    grams = sorted(postings)
+    offsets = array('q', [0])
+    utterances = array('i')
+    for gram in grams:
+        utterances.extend(postings[gram])
+        offsets.append(len(utterances))
+
+    os.makedirs(index_path, exist_ok=True)
+    with open(os.path.join(index_path, 'terms.json'), 'w') as f:
+        json.dump(grams, f, ensure_ascii=False)
+    for name, values in [('postings.off', offsets), ('utterance.i4', utterances)]:
+        with open(os.path.join(index_path, name), 'wb') as f:
+            f.write(values.tobytes())
+
+    manifest = {'corpus': os.path.abspath(corpus_path), 'rows': len(corpus),
+            'n': n, 'terms': len(grams), 'postings': len(utterances)}
+    with open(os.path.join(index_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return len(utterances)
+
+
+def phone_regex(phone):
+    """Returns the regex of a phone (any stress if it has no 
+    stress digit)"""
+    if STRESS.search(phone):
+        return re.escape(phone)
+    return re.escape(phone)+r'\d*'
+
+def phone_class(name):
+    """Returns the regex of a phone class (see PhonePattern)"""
+    phone = f'[^ {BOUNDARY}\\d]+'
+    if not name or '' in name.split('|'):
+        raise ValueError(f"Empty phone class: [{name}]")
+    if name == 'V':
+        return phone+r'\d+'
+    if name[0] == 'V' and name[1:].isdigit():
+        return phone+name[1:]
+    if name == 'C':
+        return phone
+    return '(?:' + '|'.join(phone_regex(phone) for phone in name.split('|')) + ')'
+
+class PhonePattern:
+    """A phone sequence query, e.g., 'M AE2 N |'.
+
+    Tokens are separated by spaces: a phone without a stress
+    digit (AE) matches any stress and with one (AE2) only that
+    stress, . matches any one phone, * any number of phones
+    within a word, and | a word boundary. Classes in brackets 
+    match one phone: [V] any vowel (phones with a stress digit), 
+    [V2] any vowel with stress 2, [C] any consonant and 
+    [AE|EH2] any of the phones listed. The pattern is compiled
+    to a regex over the tokens of an utterance (each followed by
+    a space), and its runs of phones and boundaries give the
+    n-grams every matching utterance must have.
+    """
+
+    def __init__(self, query):
+
+        self.query = query
+        self.tokens = query.upper().split()
+        if not self.tokens:
+            raise ValueError("empty query")
+        if not any(token not in ('|', '*') for token in self.tokens):
+            raise ValueError(f"Pattern has no phones: {query}")
+
+        parts = []
+        #runs of literal tokens (stress stripped) for the n-grams
+        self.runs = [[]]
+        for token in self.tokens:
+            if token == '|':
+                parts.append(BOUNDARY+' ')
+                self.runs[-1].append(BOUNDARY)
+            elif token == '.':
+                parts.append(f'[^ {BOUNDARY}]+ ')
+                self.runs.append([])
+            elif token == '*':
+                parts.append(f'(?:[^ {BOUNDARY}]+ )*')
+                self.runs.append([])
+            elif token.startswith('[') and token.endswith(']'):
+                parts.append(phone_class(token[1:-1])+' ')
+                self.runs.append([])
+            else:
+                parts.append(phone_regex(token)+' ')
+                self.runs[-1].append(strip_stress(token))
+        #every start of a token, overlapping matches included
+        self.regex = re.compile(r'(?:^|(?<= ))(?=(' + ''.join(parts) + '))')
+
+    def ngrams(self, n=3):
+        """Returns the n-grams every match contains"""
+        grams = set()
+        for run in self.runs:
+            grams.update(' '.join(run[i:i+n]) for i in range(len(run)-n+1))
+        return grams
+
+    def match(self, phones):
+        """Returns (first word, last word) of each match in a
+        'phones' value (words are counted from 0)"""
+
+        text = ' '.join(phone_tokens(phones)) + ' '
+        spans = []
+        for m in self.regex.finditer(text):
+            start, end = m.start(1), m.end(1)
+            #word boundaries at the edges of a match are not words
+            while text.startswith(BOUNDARY+' ', start) and start < end:
+                start += 2
+            while end-start >= 2 and text.startswith(BOUNDARY+' ', end-2):
+                end -= 2
+            first = text.count(BOUNDARY, 0, start+1)-1
+            last = text.count(BOUNDARY, 0, max(end-1, start))-1
+            spans.append((first, max(first, last)))
+        return spans
+
+
+class PhoneIndex:
+    """Read side of an index written by build_phone_index.
+
+    A query is compiled to a PhonePattern, the utterances that
+    have all of its n-grams are found by intersecting their
+    postings (every utterance if the pattern has no run of n
+    phones), and the pattern is matched against the phones of
+    each of these. Hits have the times of the matched words.
+    """
+
+    def __init__(self, path='data/index/phones/', corpus_path=None):
+
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'terms.json'), 'r') as f:
+            self.terms = json.load(f)
+        self.n = self.manifest['n']
+        self.offsets = _map(os.path.join(path, 'postings.off')).cast('q')
+        self.utterances = _map(os.path.join(path, 'utterance.i4')).cast('i')
+
+        if corpus_path is None:
+            corpus_path = self.manifest['corpus']
+        self.corpus = CorpusStore(corpus_path)
+
+    def postings(self, gram):
+        """Returns the utterances with n-gram gram"""
+        term_id = bisect_left(self.terms, gram)
+        if term_id == len(self.terms) or self.terms[term_id] != gram:
+            return self.utterances[0:0]
+        return self.utterances[self.offsets[term_id]:self.offsets[term_id+1]]
+
+    def candidates(self, pattern):
+        """Returns the sorted utterances that can match pattern"""
+
+        lists = sorted((self.postings(gram) for gram in pattern.ngrams(self.n)), key=len)
+        if not lists:
+            return range(len(self.corpus))
+        rows = set(lists[0])
+        for utterances in lists[1:]:
+            rows.intersection_update(utterances)
+            if not rows:
+                break
+        return sorted(rows)
+
+    def search(self, query):
+        """Returns the Hits of the phone pattern query"""
+
+        pattern = PhonePattern(query)
+        phones = self.corpus['phones']
+        times = self.corpus['word times']
+        hits = []
+        for row in self.candidates(pattern):
+            spans = pattern.match(phones[row])
+            if not spans:
+                continue
+            word_times = times[row]
+            for first, last in spans:
+                hits.append(Hit(row, first, word_times[2*first], word_times[2*last+1]))
+        return hits
+
+#Builder and reader of each kind of index
+INDEXES = {'words': (build_word_index, WordIndex), 
+        'phones': (build_phone_index, PhoneIndex)}
+
+def open_index(corpus_path='data/corpus/', index_path='data/index/words/', kind='words'):
+    """Returns the index (WordIndex or PhoneIndex) of corpus_path, 
+    (re)building it if it is missing or older than the corpus store"""
+
+    build, reader = INDEXES[kind]
+    manifest = os.path.join(index_path, 'manifest.json')
+    corpus_manifest = os.path.join(corpus_path, 'manifest.json')
+    if (not os.path.exists(manifest) or
+            os.path.getmtime(manifest) < os.path.getmtime(corpus_manifest)):
+        print(f"Building {kind} index of {corpus_path} in {index_path}...", file=sys.stderr)
+        build(corpus_path, index_path)
+    return reader(index_path, corpus_path)
+
+def hit_rows(corpus, hits, padding=0):
+    """Yields the values of HIT_COLUMNS, start and end time and
+    the clip.py command of each hit"""
+    for hit in hits:
+        row = corpus.row(hit.utterance, HIT_COLUMNS)
+        yield ([hit.utterance] + [row[column] for column in HIT_COLUMNS] +
+                [hit.start, hit.end, clip_command(row['TextGrid fname'], hit.start, hit.end, padding)])
+
+if __name__ == "__main__":
+
+    import argparse
+    from facets import FacetIndex, add_facet_arguments, facet_filters
+
+    parser = argparse.ArgumentParser(description='Searching the words and phones of aligned BNC utterances')
+
+    parser.add_argument('query', type=str, nargs='?', default=None,
+                        help='word, prefix (e.g., hand*) or phrase (e.g., "the cat") to search for, '
+                        'or with --phones a phone pattern (e.g., "M AE2 N |")')
+    parser.add_argument('--phones', action='store_true',
+                        help='search for a phone pattern instead of words')
+    parser.add_argument('--corpus', type=str, default='data/corpus/',
+                        help='corpus store made with align.py --corpus')
+    parser.add_argument('--index', type=str, default=None,
+                        help='directory of the index (default data/index/words/ or data/index/phones/)')
+    parser.add_argument('--build', action='store_true',
+                        help='rebuild the index')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only print the first limit hits')
+    parser.add_argument('--padding', type=float, default=0,
+                        help='padding (in seconds) for the clip commands')
+    add_facet_arguments(parser)
+
+    args = parser.parse_args()
+    if args.query is None and not args.build:
+        parser.error('give a query (or --build)')
+
+    kind = 'phones' if args.phones else 'words'
+    if args.index is None:
+        args.index = f'data/index/{kind}/'
+
+    if args.build:
+        start = time.perf_counter()
+        num_postings = INDEXES[kind][0](args.corpus, args.index)
+        print(f"Indexed {num_postings} {kind} postings in {time.perf_counter()-start:.1f}s", file=sys.stderr)
+        if args.query is None:
+            sys.exit()
+
+    index = open_index(args.corpus, args.index, kind)
+    start = time.perf_counter()
+    try:
+        hits = index.search(args.query)
+    except ValueError as e:
+        parser.error(str(e))
+    selection = facet_filters(args)
+    if selection is not None:
+        facets = FacetIndex(args.corpus)
+        hits = facets.filter_hits(hits, facets.select(*selection))
+    elapsed = time.perf_counter() - start
+
+    print('\t'.join(['utterance'] + HIT_COLUMNS + ['start time', 'end time', 'python clip command']))
+    for row in hit_rows(index.corpus, hits[:args.limit], args.padding):
+        print('\t'.join(map(str, row)))
+    print(f"{len(hits)} hits in {1000*elapsed:.1f} ms", file=sys.stderr)
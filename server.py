@@ -0,0 +1,357 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+
+from BNCClasses import clip_name
+from facets import FACETS, FacetIndex
+from search import Hit, HIT_COLUMNS, INDEXES, hit_rows, open_index
+
+#Columns of the rows of hits (as printed by search.py and query.py)
+ROW_COLUMNS = ['utterance'] + HIT_COLUMNS + ['start time', 'end time', 'python clip command']
+
+#Columns of a clip.py --batch manifest
+MANIFEST_COLUMNS = ['textgrid_fname', 'start', 'end', 'padding', 'out_fname']
+
+#Parameters that select a page or format of the hits rather than
+#the hits (not part of the cache key)
+PAGE_PARAMS = {'offset', 'limit', 'format', 'padding'}
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+        405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class Latencies:
+    """Request count, errors, cache hits and the latencies (in ms)
+    of the last window requests of a route"""
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.times = deque(maxlen=window)
+
+    def add(self, ms, error=False, cache_hit=False):
+        self.count += 1
+        self.errors += error
+        self.cache_hits += cache_hit
+        self.times.append(ms)
+
+    def summary(self):
+        """Returns the counts and the mean, median, 90th and 99th
+        percentile and maximum latency (of the window)"""
+
+        times = sorted(self.times)
+        summary = {'requests': self.count, 'errors': self.errors, 'cache hits': self.cache_hits}
+        if times:
+            summary.update({'mean ms': sum(times)/len(times),
+                'p50 ms': times[len(times)//2],
+                'p90 ms': times[min(int(0.9*len(times)), len(times)-1)],
+                'p99 ms': times[min(int(0.99*len(times)), len(times)-1)],
+                'max ms': times[-1]})
+        return summary
+
+
+class SearchServer:
+    """Serves word, phone and metadata queries over a corpus store.
+
+    The corpus store, the word and phone indexes and the facet
+    indexes are opened once, so a query only pays for the search.
+    The hits of recent queries (keyed by everything but the page
+    and format) are kept in an LRU cache of cache_size entries, so
+    paging through results does not search again, and identical
+    requests that arrive while it is being searched wait for that
+    search instead of repeating it. With workers > 1, /query
+    patterns are matched in a process pool started once for the
+    server (shut down by close).
+
+    Routes (GET, parameters in the query string):
+        /search     q, kind (words or phones): search.py queries
+        /query      pattern, kind: query.py patterns
+        /meta       utterances matching the facet filters only
+        /facets     facet: utterance counts of each value
+        /metrics    request latencies and cache statistics
+
+    Every query route takes the facet filters (speaker, gender,
+    age_band, transcript and tape, repeated or comma separated,
+    and ages=FIRST,LAST). Hit routes take offset, limit (default
+    100), padding and format: json, tsv (search.py output) or
+    manifest (a clip.py --batch manifest).
+    """
+
+    def __init__(self, corpus_path='data/corpus/', index_path='data/index/',
+            cache_size=128, workers=1):
+
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self.workers = workers
+        self.indexes = {kind: open_index(corpus_path, f'{index_path}{kind}/', kind)
+                for kind in INDEXES}
+        self.corpus = self.indexes['words'].corpus
+        self.facets = FacetIndex(corpus_path)
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        #events of the keys being computed
+        self.pending = {}
+        #requests are answered in threads (see handle)
+        self.lock = threading.Lock()
+        self.executor = None
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.metrics = {}
+        self.routes = {'/search': self.search, '/query': self.query,
+                '/meta': self.meta, '/facets': self.facet_counts,
+                '/metrics': self.get_metrics}
+
+    def cached(self, key, compute):
+        """Returns the cached value of key, computing (and caching)
+        it if it is not there, and whether it was cached. If key
+        is already being computed, waits for that instead."""
+
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key], True
+            event = self.pending.get(key)
+            computing = event is None
+            if computing:
+                event = self.pending[key] = threading.Event()
+
+        if not computing:
+            event.wait()
+            #computed now, unless it failed (or was evicted already)
+            return self.cached(key, compute)
+
+        try:
+            value = compute()
+            with self.lock:
+                self.cache[key] = value
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+        return value, False
+
+    def close(self):
+        """Shuts down the process pool of /query"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def selection(self, params):
+        """Returns the facet bitmap of params (None if there are no
+        filters)"""
+
+        filters = {}
+        for facet in FACETS:
+            values = [value for param in params.get(facet.replace(' ', '_'), [])
+                    for value in param.split(',')]
+            if values:
+                filters[facet] = values
+        ages = None
+        if 'ages' in params:
+            try:
+                first, last = map(float, params['ages'][0].split(','))
+            except ValueError:
+                raise BadRequest("ages should be FIRST,LAST")
+            ages = (first, last)
+        if not filters and ages is None:
+            return None
+        return self.facets.select(filters, ages)
+
+    def search(self, params):
+        kind = _param(params, 'kind', 'words')
+        if kind not in self.indexes:
+            raise BadRequest(f"Unknown kind: {kind}")
+        hits = self.indexes[kind].search(_param(params, 'q'))
+        bitmap = self.selection(params)
+        if bitmap is not None:
+            hits = self.facets.filter_hits(hits, bitmap)
+        return hits
+
+    def query(self, params):
+        from query import run_query
+
+        kind = _param(params, 'kind', 'words')
+        if kind not in self.indexes:
+            raise BadRequest(f"Unknown kind: {kind}")
+        bitmap = self.selection(params)
+        keep = None if bitmap is None else self.facets.mask(bitmap)
+        return list(run_query(self.corpus_path, kind, _param(params, 'pattern'),
+            self.workers, f'{self.index_path}{kind}/', keep, self.executor))
+
+    def meta(self, params):
+        bitmap = self.selection(params)
+        if bitmap is None:
+            raise BadRequest("give at least one facet filter")
+        starts, ends = self.corpus['start time'], self.corpus['end time']
+        return [Hit(row, 0, starts[row], ends[row])
+                for row in self.facets.selected_rows(bitmap).tolist()]
+
+    def facet_counts(self, params):
+        facet = _param(params, 'facet').replace('_', ' ')
+        if facet not in FACETS:
+            raise BadRequest(f"Unknown facet: {facet}")
+        bitmap = self.selection(params)
+        if bitmap is None:
+            return self.facets.counts(facet)
+        keep = self.facets.mask(bitmap)
+        counts = {}
+        for label in self.facets.labels[facet]:
+            count = int(keep[self.facets.rows(facet, label)].sum())
+            if count:
+                counts[label] = count
+        return counts
+
+    def get_metrics(self, params):
+        return {'routes': {route: latencies.summary() for route, latencies in self.metrics.items()},
+                'cache entries': len(self.cache), 'cache size': self.cache_size}
+
+    def respond(self, path, params):
+        """Returns the status, content type and body of a request
+        and whether its result came from the cache"""
+
+        if path not in self.routes:
+            return 404, 'application/json', json.dumps({'error': f"Unknown route: {path}"}), False
+        if path == '/metrics':
+            return 200, 'application/json', json.dumps(self.get_metrics(params)), False
+
+        key = (path,) + tuple(sorted((name, tuple(values)) for name, values in params.items()
+            if name not in PAGE_PARAMS))
+        result, cache_hit = self.cached(key, lambda: self.routes[path](params))
+        fmt = _param(params, 'format', 'json')
+
+        if path == '/facets':
+            if fmt == 'tsv':
+                return 200, 'text/tab-separated-values', ''.join(f"{label}\t{count}\n"
+                        for label, count in result.items()), cache_hit
+            return 200, 'application/json', json.dumps(result), cache_hit
+
+        try:
+            offset = int(_param(params, 'offset', 0))
+            limit = int(_param(params, 'limit', 100))
+            padding = float(_param(params, 'padding', 0))
+        except ValueError:
+            raise BadRequest("offset, limit and padding should be numbers")
+        page = result[offset:offset+limit]
+
+        if fmt == 'manifest':
+            rows = [(row['TextGrid fname'], hit.start, hit.end, padding,
+                clip_name(row['TextGrid fname'], hit.start, hit.end, padding))
+                for hit, row in ((hit, self.corpus.row(hit.utterance, ['TextGrid fname'])) for hit in page)]
+            return 200, 'text/tab-separated-values', _tsv(MANIFEST_COLUMNS, rows), cache_hit
+
+        rows = hit_rows(self.corpus, page, padding)
+        if fmt == 'tsv':
+            return 200, 'text/tab-separated-values', _tsv(ROW_COLUMNS, rows), cache_hit
+        if fmt != 'json':
+            raise BadRequest(f"Unknown format: {fmt}")
+        return 200, 'application/json', json.dumps({'total': len(result), 'offset': offset,
+            'limit': limit, 'hits': [dict(zip(ROW_COLUMNS, row)) for row in rows]}), cache_hit
+
+    async def handle(self, reader, writer):
+        """Answers one HTTP request on a connection"""
+
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        if len(request_line) < 2:
+            writer.close()
+            return
+
+        start = time.perf_counter()
+        method, target = request_line[0], request_line[1]
+        url = urlsplit(target)
+        cache_hit = False
+        if method != 'GET':
+            status, content_type, body = 405, 'application/json', json.dumps({'error': 'only GET'})
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                #searches run in a thread so the server keeps accepting
+                status, content_type, body, cache_hit = await loop.run_in_executor(None,
+                        self.respond, url.path, parse_qs(url.query))
+            except ValueError as e:
+                #BadRequest or, e.g., a malformed pattern
+                status, content_type, body = 400, 'application/json', json.dumps({'error': str(e)})
+            except Exception as e:
+                print(f"Error in {target}: {e!r}", file=sys.stderr)
+                status, content_type, body = 500, 'application/json', json.dumps({'error': repr(e)})
+
+        body = body.encode('utf-8')
+        writer.write((f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+        if url.path in self.routes:
+            self.metrics.setdefault(url.path, Latencies()).add(1000*(time.perf_counter()-start),
+                    status != 200, cache_hit)
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {self.corpus_path} on http://{host}:{port}/", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+def _param(params, name, default=None):
+    """Returns the first value of name in params (as from
+    parse_qs), or default"""
+    if name in params:
+        return params[name][0]
+    if default is None:
+        raise BadRequest(f"Missing parameter: {name}")
+    return default
+
+def _tsv(columns, rows):
+    return '\t'.join(columns) + '\n' + ''.join('\t'.join(map(str, row)) + '\n' for row in rows)
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local search server for aligned BNC utterances')
+
+    parser.add_argument('--corpus', type=str, default='data/corpus/',
+                        help='corpus store made with align.py --corpus')
+    parser.add_argument('--index', type=str, default='data/index/',
+                        help='directory of the words/ and phones/ indexes (built if missing)')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on')
+    parser.add_argument('--cache_size', type=int, default=128,
+                        help='number of recent query results to keep')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes for /query patterns')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    server = SearchServer(args.corpus, args.index, args.cache_size, args.workers)
+    print(f"Loaded {len(server.corpus)} utterances in {time.perf_counter()-start:.1f}s", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+
+from align import _html_files, aligner_version, get_aligned_fnames, stream_utterances, write_aligned
+from profiling import PROFILER
+from store import ArtifactStore
+
+#Ways of splitting the transcripts into shards (see partition)
+SHARD_BY = ['hash', 'transcript']
+
+
+def parse_shard(spec):
+    """Returns the index and number of shards of a shard spec i/N
+    (0 <= i < N)"""
+    try:
+        index, num_shards = map(int, spec.split('/'))
+    except ValueError:
+        raise ValueError(f"shard should be i/N: {spec}")
+    if not 0 <= index < num_shards:
+        raise ValueError(f"shard index should be from 0 to {num_shards-1}: {spec}")
+    return index, num_shards
+
+def partition(files, num_shards, by='hash'):
+    """Returns the transcripts (htmls) of each of num_shards shards
+    of the FileSets files. A transcript is never split, as its tapes
+    are aligned together.
+
+    by is 'hash' (each transcript goes to the shard given by a hash
+    of its html, so adding transcripts does not move the others) or
+    'transcript' (the sorted transcripts are cut into runs with about
+    the same number of TextGrids).
+
+    Returns:
+        List[List[str]]: Sorted htmls of each shard.
+    """
+
+    html_files = _html_files(files)
+    shards = [[] for _ in range(num_shards)]
+    if by == 'hash':
+        for html in sorted(html_files):
+            digest = hashlib.sha256(html.encode('utf-8')).digest()
+            shards[int.from_bytes(digest[:8], 'big') % num_shards].append(html)
+    elif by == 'transcript':
+        done = 0
+        for html in sorted(html_files):
+            shards[min(num_shards-1, num_shards*done//len(files))].append(html)
+            done += len(html_files[html])
+    else:
+        raise ValueError(f"Unknown sharding: {by}")
+    return shards
+
+def shard_path(shards_path, index, num_shards):
+    return os.path.join(shards_path, f'{index}-of-{num_shards}', '')
+
+def build_shard(index, num_shards, by='hash', shards_path='data/shards/',
+        path='data/', **kwargs):
+    """Aligns the transcripts of shard index of num_shards (see
+    partition) with stream_utterances. Shards can run on different
+    machines (each needs the data directory and the TextGrids) and
+    only write under shard_path: their ArtifactStore (artifacts/),
+    their rows of the tsv (utterances.tsv), their log files and
+    shard.json, which records the transcripts and aligner version
+    of the shard and is written last, so a shard without it has not
+    finished. kwargs are passed to stream_utterances (e.g., workers,
+    offline, parser or aligner).
+
+    Returns:
+        int: Number of transcripts aligned.
+    """
+
+    files, _ = get_aligned_fnames(path)
+    htmls = partition(files, num_shards, by)[index]
+    out_path = shard_path(shards_path, index, num_shards)
+    os.makedirs(out_path, exist_ok=True)
+
+    manifest_fname = out_path+'shard.json'
+    if os.path.exists(manifest_fname):
+        os.remove(manifest_fname)
+
+    num = stream_utterances(out_path+'utterances.tsv', path,
+            store_path=out_path+'artifacts/', htmls=htmls, log_path=out_path, **kwargs)
+
+    manifest = {'shard': index, 'shards': num_shards, 'by': by,
+            'version': aligner_version(kwargs.get('parser', 'bs4'), kwargs.get('aligner', 'greedy')),
+            'htmls': htmls}
+    with open(manifest_fname+'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_fname+'.tmp', manifest_fname)
+    return num
+
+def merge_shards(num_shards, shards_path='data/shards/', outname='BNCAudio_utterances.tsv',
+        path='data/', corpus_path=None, index_path=None, columns=None, row_filter=None):
+    """Merges the shards of a build in num_shards shards (see
+    build_shard) into the tsv and log files of the whole corpus and,
+    if corpus_path is given, its corpus store (and, if index_path is
+    given, the word and phone indexes in index_path words/ and
+    phones/). The aligned transcripts are read from the artifacts of
+    the shards in the order of a single build and written with
+    align.write_aligned, so the output is byte for byte that of
+    align.py --stream on one machine. Raises a ValueError if a shard
+    is missing or unfinished, if the shards were built differently
+    or if a transcript is in none of them.
+
+    Returns:
+        int: Number of transcripts written.
+    """
+
+    files, htmls = get_aligned_fnames(path)
+    htmls.sort()
+
+    stores = {}
+    builds = set()
+    for index in range(num_shards):
+        fname = shard_path(shards_path, index, num_shards)+'shard.json'
+        if not os.path.exists(fname):
+            raise ValueError(f"Shard {index}/{num_shards} is missing or unfinished: {fname}")
+        with open(fname, 'r') as f:
+            manifest = json.load(f)
+        builds.add((manifest['by'], manifest['version']))
+        store = ArtifactStore(shard_path(shards_path, index, num_shards)+'artifacts/')
+        for html in manifest['htmls']:
+            stores[html] = store
+    if len(builds) > 1:
+        raise ValueError("Shards were built with different sharding or aligner versions")
+    missing = [html for html in htmls if html not in stores]
+    if missing:
+        raise ValueError(f"{len(missing)} transcripts are in no shard (e.g., {missing[0]})")
+
+    def results():
+        for html in htmls:
+            with PROFILER.stage('store', item=html):
+                stored = stores[html].load(html)
+            if stored is None:
+                raise ValueError(f"No artifact for {html} in its shard")
+            yield stored[2], True, {}
+
+    num = write_aligned(results(), files, htmls, outname, corpus_path, columns, row_filter)
+
+    if corpus_path is not None and index_path is not None:
+        from search import build_word_index, build_phone_index
+
+        print(f"Indexing {corpus_path}...")
+        with PROFILER.stage('index'):
+            build_word_index(corpus_path, os.path.join(index_path, 'words', ''))
+            build_phone_index(corpus_path, os.path.join(index_path, 'phones', ''))
+    return num
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Shards of the transcripts for a sharded build (align.py --shard)')
+
+    parser.add_argument('num_shards', type=int,
+                        help='number of shards')
+    parser.add_argument('--by', type=str, default='hash', choices=SHARD_BY,
+                        help='split transcripts by a hash of the html or into runs of sorted transcripts')
+
+    args = parser.parse_args()
+
+    files, _ = get_aligned_fnames()
+    html_files = _html_files(files)
+    for index, htmls in enumerate(partition(files, args.num_shards, args.by)):
+        print(f"{index}/{args.num_shards}\t{len(htmls)} transcripts\t"
+                f"{sum(len(html_files[html]) for html in htmls)} TextGrids")
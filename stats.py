@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from corpus import CorpusStore, _fname, column_array
+
+#Columns of the corpus store a group can be keyed by (besides phone);
+#a TextGrid is one tape of a recording
+GROUPS = ['speaker', 'gender', 'age', 'TextGrid fname', 'transcript html']
+
+#Columns of the corpus store the statistics are computed from
+SOURCE_COLUMNS = ['phones', 'phone times', 'word times', 'start time',
+        'end time'] + GROUPS
+
+
+def corpus_key(corpus_path):
+    """Returns a hash of the manifest and of the size and mtime
+    of the column files of the corpus store the statistics are
+    computed from, so cached statistics are recomputed when the
+    corpus is rebuilt"""
+
+    key = hashlib.sha256()
+    with open(os.path.join(corpus_path, 'manifest.json'), 'rb') as f:
+        key.update(f.read())
+    for fname in sorted(os.listdir(corpus_path)):
+        if any(fname.startswith(_fname(column)+'.') for column in SOURCE_COLUMNS):
+            stat = os.stat(os.path.join(corpus_path, fname))
+            key.update(f"{fname} {stat.st_size} {stat.st_mtime_ns}".encode('utf-8'))
+    return key.hexdigest()
+
+def build_tables(corpus_path='data/corpus/'):
+    """Returns the arrays the statistics are computed from: for
+    each phone its utterance (row), label and duration, and for
+    each utterance its number of words and phones, duration (first
+    word start to last word end) and time between its words.
+
+    Everything except the phone labels is computed with numpy
+    from the time columns of the corpus store. Utterances whose
+    phones do not match their phone times (e.g., aligned before
+    phone times were kept) have no phones.
+
+    Returns:
+        Dict[np.ndarray], List[str]: Arrays by name and the phone
+                            labels (indexed by the label codes).
+    """
+
+    corpus = CorpusStore(corpus_path)
+    num_rows = len(corpus)
+
+    word_times = corpus['word times']
+    word_offsets = column_array(word_times.offsets, np.int64)
+    words = column_array(word_times.data, np.float64).reshape(-1, 2)
+    num_words = np.diff(word_offsets)//2
+    word_rows = np.repeat(np.arange(num_rows), num_words)
+
+    #gaps between consecutive words of the same utterance
+    same = word_rows[1:] == word_rows[:-1]
+    gaps = np.where(same, words[1:, 0] - words[:-1, 1], 0.)
+    pause = np.bincount(word_rows[1:][same], weights=gaps[same], minlength=num_rows)
+    duration = np.zeros(num_rows)
+    has_words = num_words > 0
+    firsts = word_offsets[:-1][has_words]//2
+    lasts = word_offsets[1:][has_words]//2 - 1
+    duration[has_words] = words[lasts, 1] - words[firsts, 0]
+
+    phone_times = corpus['phone times']
+    phone_offsets = column_array(phone_times.offsets, np.int64)
+    phones = column_array(phone_times.data, np.float64).reshape(-1, 2)
+    num_phones = np.diff(phone_offsets)//2
+
+    #labels are the one part that needs a pass over strings
+    label_codes = {}
+    labels = np.full(len(phones), -1, np.int32)
+    for row, value in enumerate(corpus['phones']):
+        tokens = [token for token in value.split() if token != '|']
+        if len(tokens) != num_phones[row]:
+            continue
+        start = phone_offsets[row]//2
+        labels[start:start+len(tokens)] = [label_codes.setdefault(token, len(label_codes))
+                for token in tokens]
+
+    valid = labels >= 0
+    tables = {
+        'phone_row': np.repeat(np.arange(num_rows), num_phones)[valid],
+        'phone_label': labels[valid],
+        'phone_duration': (phones[:, 1] - phones[:, 0])[valid],
+        'num_words': num_words,
+        'num_phones': np.bincount(np.repeat(np.arange(num_rows), num_phones)[valid],
+            minlength=num_rows),
+        'duration': duration,
+        'pause': pause,
+    }
+    for group in GROUPS:
+        tables[group] = column_array(corpus[group].codes, np.int32)
+    return tables, list(label_codes)
+
+
+class StatsCache:
+    """Cached tables (see build_tables) and summaries of a corpus
+    store.
+
+    Everything is saved under path with the corpus_key it was
+    computed from; when the corpus store changes the key changes
+    and the cached tables.npz and summary_*.json are removed, so
+    reports never mix corpus versions. Other files under path are
+    left alone.
+    """
+
+    def __init__(self, corpus_path='data/corpus/', path='data/stats/'):
+
+        self.corpus_path = corpus_path
+        self.path = path
+        self.key = corpus_key(corpus_path)
+        os.makedirs(path, exist_ok=True)
+
+        key_fname = os.path.join(path, 'key.txt')
+        stored_key = None
+        if os.path.exists(key_fname):
+            with open(key_fname, 'r') as f:
+                stored_key = f.read().strip()
+        if stored_key != self.key:
+            #only what the cache wrote, path may be shared
+            for fname in os.listdir(path):
+                if fname.startswith(('tables.npz', 'summary_')):
+                    os.remove(os.path.join(path, fname))
+            with open(key_fname, 'w') as f:
+                f.write(self.key)
+
+        self._tables = None
+
+    def tables(self):
+        """Returns the tables and labels of build_tables (computed
+        once per corpus version)"""
+
+        if self._tables is not None:
+            return self._tables
+
+        fname = os.path.join(self.path, 'tables.npz')
+        if os.path.exists(fname):
+            with np.load(fname) as saved:
+                tables = {name: saved[name] for name in saved.files if name != 'labels'}
+                labels = list(saved['labels'])
+        else:
+            tables, labels = build_tables(self.corpus_path)
+            np.savez(fname+'.tmp.npz', labels=np.array(labels, dtype=str), **tables)
+            os.replace(fname+'.tmp.npz', fname)
+        self._tables = tables, labels
+        return self._tables
+
+    def summary(self, by):
+        """Returns the summary rows of summarize(by) (computed
+        once per corpus version and by)"""
+
+        fname = os.path.join(self.path, 'summary_'+'_'.join(_fname(key) for key in by)+'.json')
+        if os.path.exists(fname):
+            with open(fname, 'r') as f:
+                return json.load(f)
+
+        tables, labels = self.tables()
+        rows = summarize(tables, labels, by, CorpusStore(self.corpus_path))
+        with open(fname, 'w') as f:
+            json.dump(rows, f)
+        return rows
+
+def group_stats(groups, values, num_groups):
+    """Returns the count, mean, std, median, 10th and 90th
+    percentile of values for each group (groups are codes
+    0..num_groups-1), all groups at once
+
+    Returns:
+        Dict[np.ndarray]
+    """
+
+    counts = np.bincount(groups, minlength=num_groups)
+    sums = np.bincount(groups, weights=values, minlength=num_groups)
+    squares = np.bincount(groups, weights=values*values, minlength=num_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums/counts
+        std = np.sqrt(np.maximum(squares/counts - mean*mean, 0)*counts/(counts-1))
+
+    #quantiles from values sorted by group then value
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    def quantile(q):
+        position = starts + q*np.maximum(counts-1, 0)
+        low = np.floor(position).astype(int)
+        high = np.minimum(low+1, starts+np.maximum(counts-1, 0))
+        frac = position - low
+        result = np.full(num_groups, np.nan)
+        has = counts > 0
+        result[has] = ordered[low[has]]*(1-frac[has]) + ordered[high[has]]*frac[has]
+        return result
+
+    return {'count': counts, 'mean': mean, 'std': std, 'median': quantile(0.5),
+            'p10': quantile(0.1), 'p90': quantile(0.9)}
+
+def summarize(tables, labels, by, corpus):
+    """Returns a summary row (dict) for each group of by (list of
+    GROUPS and/or 'phone'): phone duration statistics and, unless
+    grouped by phone, words, seconds of speech, speech rate (words
+    and phones per second) and pause ratio (time between words
+    over utterance duration)
+
+    Returns:
+        List[Dict]
+    """
+
+    phone_keys = [tables['phone_label'] if key == 'phone' else tables[key][tables['phone_row']]
+            for key in by]
+    names = [labels if key == 'phone' else corpus[key].pool for key in by]
+
+    if len(tables['phone_row']):
+        combos, groups = np.unique(np.stack(phone_keys, axis=1), axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+    else:
+        combos, groups = np.zeros((0, len(by)), int), np.zeros(0, int)
+    stats = group_stats(groups, tables['phone_duration'], len(combos))
+
+    if 'phone' not in by:
+        #utterance level measures, keyed the same way
+        lookup = {tuple(combo): idx for idx, combo in enumerate(combos.tolist())}
+        utterance_keys = np.stack([tables[key] for key in by], axis=1)
+        utterance_groups = np.array([lookup.get(tuple(key), -1) for key in utterance_keys.tolist()], int)
+        has = utterance_groups >= 0
+        totals = {name: np.bincount(utterance_groups[has], weights=tables[name][has], minlength=len(combos))
+                for name in ['num_words', 'num_phones', 'duration', 'pause']}
+
+    rows = []
+    for idx, combo in enumerate(combos.tolist()):
+        row = {key: names[k][code] for k, (key, code) in enumerate(zip(by, combo))}
+        row['phones'] = int(stats['count'][idx])
+        for name in ['mean', 'std', 'median', 'p10', 'p90']:
+            row['duration '+name] = float(stats[name][idx])
+        if 'phone' not in by:
+            seconds = totals['duration'][idx]
+            row['words'] = int(totals['num_words'][idx])
+            row['seconds'] = float(seconds)
+            row['words/sec'] = float(totals['num_words'][idx]/seconds) if seconds else float('nan')
+            row['phones/sec'] = float(totals['num_phones'][idx]/seconds) if seconds else float('nan')
+            row['pause ratio'] = float(totals['pause'][idx]/seconds) if seconds else float('nan')
+        rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Phone duration, speech rate and pause statistics of aligned BNC utterances')
+
+    parser.add_argument('--by', type=str, nargs='+', default=['speaker'],
+                        choices=GROUPS+['phone'],
+                        help='columns to group by')
+    parser.add_argument('--corpus', type=str, default='data/corpus/',
+                        help='corpus store made with align.py --corpus')
+    parser.add_argument('--cache', type=str, default='data/stats/',
+                        help='directory of cached statistics')
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = StatsCache(args.corpus, args.cache).summary(args.by)
+    if rows:
+        print('\t'.join(rows[0]))
+        for row in rows:
+            print('\t'.join(f"{value:.4f}" if isinstance(value, float) else str(value)
+                for value in row.values()))
+    print(f"{len(rows)} groups in {time.perf_counter()-start:.2f}s", file=sys.stderr)
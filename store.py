@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+
+def file_digest(fname):
+    """Returns the sha256 of the contents of fname, or 'missing'"""
+    digest = hashlib.sha256()
+    try:
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return 'missing'
+    return digest.hexdigest()
+
+def unit_key(content, textgrid_fnames, settings=()):
+    """Returns the key of one transcript: a hash of the html of the
+    transcript, its TextGrids and the settings it is aligned with
+    (e.g., parser and aligner). The version of the aligner code is
+    stored next to the key rather than in it (see ArtifactStore)."""
+
+    key = hashlib.sha256()
+    key.update(repr(settings).encode('utf-8'))
+    key.update(hashlib.sha256(content).digest())
+    for fname in textgrid_fnames:
+        key.update(fname.encode('utf-8'))
+        key.update(file_digest(fname).encode('utf-8'))
+    return key.hexdigest()
+
+
+class ArtifactStore:
+    """Aligned transcripts stored one file per transcript.
+
+    Each artifact holds the key of the inputs it was built from
+    (see unit_key), the version of the aligner code that built it
+    and the result of aligning the transcript. A rebuild redoes the
+    transcripts whose html or TextGrids changed; what to do with
+    those built by another version is up to the caller (see
+    align._align_transcript_job).
+    """
+
+    def __init__(self, path='data/artifacts/'):
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def fname(self, html):
+        return os.path.join(self.path, html.split('/')[-1]+'.pkl')
+
+    def get(self, html, key):
+        """Returns the stored (version, result) for html if it was
+        built from the inputs of key, otherwise None"""
+
+        stored = self.load(html)
+        if stored is None or stored[0] != key:
+            return None
+        return stored[1], stored[2]
+
+    def load(self, html):
+        """Returns the stored (key, version, result) for html, or
+        None if there is none"""
+
+        import dill
+
+        try:
+            with open(self.fname(html), 'rb') as f:
+                stored = dill.load(f)
+        except (FileNotFoundError, EOFError):
+            return None
+        #artifacts from before versions were stored have none
+        if len(stored) == 2:
+            return stored[0], None, stored[1]
+        return stored
+
+    def put(self, html, key, version, result):
+        """Stores result as the artifact for html built from the
+        inputs of key by aligner version"""
+
+        import dill
+
+        fname = self.fname(html)
+        with open(fname+'.tmp', 'wb') as f:
+            dill.dump((key, version, result), f)
+        os.replace(fname+'.tmp', fname)
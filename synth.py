@@ -0,0 +1,213 @@
+import html as html_lib
+import os
+import random
+
+#Entries utterances are made of: (text in the transcript, the
+#cleaned words the aligner should give, the words of the TextGrid
+#as (mark, phones)). Besides plain words they cover the quirks the
+#aligner and normalize.UTTERANCE_RULES handle: split contractions,
+#{oov} words, clitics split off in the transcript, hyphens, '&',
+#commas without a space, d'you and bracketed non-speech.
+ENTRIES = [
+    ('the', ['the'], [('the', ['DH', 'AH0'])]),
+    ('cat', ['cat'], [('cat', ['K', 'AE1', 'T'])]),
+    ('sat', ['sat'], [('sat', ['S', 'AE1', 'T'])]),
+    ('on', ['on'], [('on', ['AA1', 'N'])]),
+    ('mat', ['mat'], [('mat', ['M', 'AE1', 'T'])]),
+    ('so', ['so'], [('so', ['S', 'OW1'])]),
+    ('Brenda', ['brenda'], [('brenda', ['B', 'R', 'EH1', 'N', 'D', 'AH0'])]),
+    ('handyman', ['handyman'], [('handyman', ['HH', 'AE1', 'N', 'D', 'IY0', 'M', 'AE2', 'N'])]),
+    ('well,', ['well'], [('well', ['W', 'EH1', 'L'])]),
+    ('yes?', ['yes'], [('yes', ['Y', 'EH1', 'S'])]),
+    ("don't", ["don't"], [('do', ['D', 'OW1']), ("n't", ['N', 'T'])]),
+    ('cannot', ['cannot'], [('can', ['K', 'AE1', 'N']), ('not', ['N', 'AA1', 'T'])]),
+    ('gronnies', ['gronnies'], [('{oov}', ['G', 'R', 'AA1', 'N', 'IY0', 'Z'])]),
+    ("it 's", ["it's"], [("it's", ['IH1', 'T', 'S'])]),
+    ("you 'll", ["you'll"], [("you'll", ['Y', 'UW1', 'L'])]),
+    ("o 'clock", ["o'clock"], [("o'clock", ['AH0', 'K', 'L', 'AA1', 'K'])]),
+    ('tea-time', ['tea', 'time'], [('tea', ['T', 'IY1']), ('time', ['T', 'AY1', 'M'])]),
+    ('rock & roll', ['rock', 'androll'], [('rock', ['R', 'AA1', 'K']),
+        ('and', ['AH0', 'N', 'D']), ('roll', ['R', 'OW1', 'L'])]),
+    ('yes,no', ['yes', 'no'], [('yes', ['Y', 'EH1', 'S']), ('no', ['N', 'OW1'])]),
+    ("d'you", ["d'you"], [('d', ['D']), ('you', ['Y', 'UW1'])]),
+    ('[laugh]', [], [('{lg}', ['sil'])]),
+]
+
+#Grid only tokens the aligner skips, put between words
+GAPS = ['{gap_anonymization}', '{xx}', '{br}']
+
+PHONE_DURATION = 0.05
+PAUSE = 0.2
+
+
+def make_utterance(rng, num_entries):
+    """Returns the transcript text, cleaned words and TextGrid words
+    of a random utterance of num_entries entries"""
+
+    entries = [rng.choice(ENTRIES) for _ in range(num_entries)]
+    #bracketed non-speech alone would leave nothing to align
+    if not any(entry[1] for entry in entries):
+        entries.append(ENTRIES[0])
+
+    grid_words = []
+    for _, _, marks in entries:
+        grid_words.extend(marks)
+        if rng.random() < 0.05:
+            grid_words.append((rng.choice(GAPS), ['sil']))
+    #not capitalised, the clitic rules (e.g., o 'clock) are case sensitive
+    text = ' '.join(entry[0] for entry in entries) + '.'
+    cleaned = [word for entry in entries for word in entry[1]]
+    return text, cleaned, grid_words
+
+def textgrid_text(tiers, xmax):
+    """Returns a TextGrid (long text format) with interval tiers
+    given as (name, [(start, end, mark)])"""
+
+    lines = ['File type = "ooTextFile"', 'Object class = "TextGrid"', '',
+            'xmin = 0 ', f'xmax = {xmax} ', 'tiers? <exists> ',
+            f'size = {len(tiers)} ', 'item []: ']
+    for num, (name, intervals) in enumerate(tiers, 1):
+        lines += [f'    item [{num}]:', '        class = "IntervalTier" ',
+                f'        name = "{name}" ', '        xmin = 0 ', f'        xmax = {xmax} ',
+                f'        intervals: size = {len(intervals)} ']
+        for idx, (start, end, mark) in enumerate(intervals, 1):
+            mark = mark.replace('"', '""')
+            lines += [f'        intervals [{idx}]:', f'            xmin = {start} ',
+                    f'            xmax = {end} ', f'            text = "{mark}" ']
+    return '\n'.join(lines) + '\n'
+
+def make_tape(rng, utterances_per_tape):
+    """Returns the utterances (text, cleaned words) of a tape and
+    the text of its TextGrid (phone and word tiers, with a pause
+    after some utterances)"""
+
+    phones, words, utterances = [], [], []
+    t = 0.
+    for _ in range(utterances_per_tape):
+        text, cleaned, grid_words = make_utterance(rng, rng.randint(1, 8))
+        utterances.append((text, cleaned))
+        for mark, marks in grid_words:
+            start = t
+            for phone in marks:
+                end = round(t+PHONE_DURATION, 5)
+                phones.append((t, end, phone))
+                t = end
+            words.append((start, t, mark))
+        if rng.random() < 0.3:
+            end = round(t+PAUSE, 5)
+            phones.append((t, end, 'sil'))
+            words.append((t, end, 'sp'))
+            t = end
+    return utterances, textgrid_text([('phone', phones), ('word', words)], t)
+
+def page_text(name, speakers, tapes):
+    """Returns a transcript page like those on the BNC site: a
+    speaker table (unless speakers is empty) and a table of turns
+    for each tape"""
+
+    escape = html_lib.escape
+    parts = [f'<html><head><title>{name}</title></head><body>']
+    if speakers:
+        parts.append(f'<h4>{len(speakers)} speakers recorded</h4><table>')
+        for speaker, (real_name, age_cat, gender, age) in speakers.items():
+            parts.append(f'<tr><td>{speaker} ({real_name})</td><td>{age_cat}</td>'
+                    f'<td>{gender}</td><td>({real_name}, age {age}, retired)</td></tr>')
+        parts.append('</table>')
+    parts.append(f'<h4>Transcript of {name}</h4>')
+
+    for tape_num, turns in enumerate(tapes, 1):
+        parts.append(f'<h4>Tape {tape_num}</h4><table>')
+        for speaker, acts in turns:
+            lines = '\n'.join(f'[{num}] {escape(text)}' for num, text in acts)
+            parts.append(f'<tr><td>Someone ({speaker})</td><td>{lines}\n</td></tr>')
+        parts.append('</table>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+def write_corpus(root, num_transcripts=4, tapes_per_transcript=2,
+        utterances_per_tape=100, seed=0):
+    """Writes a synthetic corpus laid out like data/ under root:
+    data/filelist-{html,wav,textgrid}.txt, the TextGrids in
+    data/AudioBNCTextGrids/ and the transcript pages in pages/
+    (for align.py --mirror root/pages/). Every utterance can be
+    aligned, and expected.tsv has the cleaned text the aligner
+    should give for each (tab separated html, tape, utterance num,
+    cleaned text).
+
+    Returns:
+        int: Number of utterances.
+    """
+
+    rng = random.Random(seed)
+    textgrid_path = os.path.join(root, 'data', 'AudioBNCTextGrids')
+    pages_path = os.path.join(root, 'pages')
+    os.makedirs(textgrid_path, exist_ok=True)
+    os.makedirs(pages_path, exist_ok=True)
+
+    htmls, wavs, textgrids, expected = [], [], [], []
+    for num in range(num_transcripts):
+        name = f'S{num:04d}'
+        html = f'http://bnc.phon.ox.ac.uk/transcripts-html/{name}.html'
+        recording = f'021A-C{num:04d}X0001XX-AAZZP0'
+        htmls.append(html)
+        wavs.append(f'http://bnc.phon.ox.ac.uk/data/{recording}.wav')
+
+        #every 10th page has no speaker table (like HYG)
+        speakers = {}
+        if num % 10 != 9:
+            for idx in range(rng.randint(1, 4)):
+                speakers[f'{name}PS00{idx}'] = (rng.choice(['Brenda', 'Bob', 'Pat']),
+                        f'Ag{rng.randint(0, 5)}', rng.choice(['f', 'm']), rng.randint(5, 90))
+        speaker_ids = list(speakers) or [f'{name}PSUNK']
+
+        tapes = []
+        for tape_num in range(1, tapes_per_transcript+1):
+            fname = f'{recording}_{num:04d}01_{name}_{tape_num}.TextGrid'
+            utterances, grid = make_tape(rng, utterances_per_tape)
+            with open(os.path.join(textgrid_path, fname), 'w') as f:
+                f.write(grid)
+            textgrids.append('http://bnc.phon.ox.ac.uk/data/'+fname)
+
+            turns = []
+            idx = 0
+            while idx < len(utterances):
+                size = rng.randint(1, 4)
+                acts = [(idx+k+1, text) for k, (text, _) in enumerate(utterances[idx:idx+size])]
+                turns.append((rng.choice(speaker_ids), acts))
+                for k, (_, cleaned) in enumerate(utterances[idx:idx+size]):
+                    expected.append((html, f'Tape {tape_num}', str(idx+k+1), ' '.join(cleaned)))
+                idx += size
+            tapes.append(turns)
+
+        with open(os.path.join(pages_path, name+'.html'), 'w') as f:
+            f.write(page_text(name, speakers, tapes))
+
+    for kind, urls in [('html', htmls), ('wav', wavs), ('textgrid', textgrids)]:
+        with open(os.path.join(root, 'data', f'filelist-{kind}.txt'), 'w') as f:
+            f.write('\n'.join(urls)+'\n')
+    with open(os.path.join(root, 'expected.tsv'), 'w') as f:
+        for row in expected:
+            f.write('\t'.join(row)+'\n')
+    return len(expected)
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Writing a synthetic BNC style corpus (pages and TextGrids)')
+
+    parser.add_argument('root', type=str,
+                        help='directory to write the corpus to')
+    parser.add_argument('--transcripts', type=int, default=4,
+                        help='number of transcript pages')
+    parser.add_argument('--tapes', type=int, default=2,
+                        help='number of tapes (TextGrids) per transcript')
+    parser.add_argument('--utterances', type=int, default=100,
+                        help='number of utterances per tape')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed')
+
+    args = parser.parse_args()
+
+    num = write_corpus(args.root, args.transcripts, args.tapes, args.utterances, args.seed)
+    print(f"Wrote {num} utterances to {args.root}")
@@ -0,0 +1,35 @@
+import os
+import sys
+
+#the modules are scripts at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+def make_row(num, text, phones, speaker='S0000PS000'):
+    """Returns a corpus store row of an utterance whose words take
+    a second each"""
+    words = text.split()
+    word_times = []
+    for idx in range(len(words)):
+        word_times += [float(idx), float(idx+1)]
+    return {'transcript num': 0, 'tape': 'Tape 1', 'speaker': speaker, 'gender': 'f',
+            'age': '34', 'tape utterance num': str(num), 'speaker utterance num': num,
+            'utterance text': text, 'cleaned text': text, 'phones': phones,
+            'start time': 0., 'end time': float(len(words)),
+            'wav fname': 'a.wav', 'TextGrid fname': 'a_1.TextGrid',
+            'transcript html': 'http://bnc.phon.ox.ac.uk/transcripts-html/S0000.html',
+            'link': '', 'word times': word_times, 'phone times': []}
+
+@pytest.fixture
+def corpus_path(tmp_path):
+    """A corpus store of three utterances"""
+    from corpus import CorpusWriter
+
+    path = str(tmp_path/'corpus')+'/'
+    with CorpusWriter(path) as writer:
+        writer.add(make_row(1, 'the cat sat', 'DH AH0 | K AE1 T | S AE1 T | '))
+        writer.add(make_row(2, 'so brenda', 'S OW1 | B R EH1 N D AH0 | '))
+        writer.add(make_row(3, 'the mat', 'DH AH0 | M AE1 T | '))
+    return path
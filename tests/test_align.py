@@ -0,0 +1,117 @@
+import inspect
+
+import pytest
+
+import normalize
+import tiers
+from align import aligner_version
+
+
+@pytest.mark.parametrize('module', [normalize, tiers])
+def test_version_covers_modules(module, monkeypatch):
+    before = aligner_version()
+    getsource = inspect.getsource
+    monkeypatch.setattr(inspect, 'getsource',
+            lambda obj: getsource(obj) + ('#changed' if obj is module else ''))
+    assert aligner_version() != before
+
+from align import FileSet, align_fileset
+from BNCClasses import Chunk, Tape, Utterance
+from synth import textgrid_text
+
+TEXTGRID = '021A-C0000X0001XX-AAZZP0_000001_S0000_1.TextGrid'
+
+#TextGrid words and their phones; the second utterance of the
+#transcript ('hello there') is not what was said ('well yes')
+GRID = [('the', ['DH', 'AH0']), ('cat', ['K', 'AE1', 'T']), ('well', ['W', 'EH1', 'L']),
+        ('yes', ['Y', 'EH1', 'S']), ('so', ['S', 'OW1']), ('brenda', ['B', 'R', 'EH1', 'N', 'D', 'AH0']),
+        ('on', ['AA1', 'N']), ('mat', ['M', 'AE1', 'T'])]
+UTTERANCES = ['the cat.', 'hello there.', 'so brenda.', 'on mat.']
+
+
+@pytest.fixture
+def textgrid_path(tmp_path, monkeypatch):
+    #load_tiers caches under data/tiercache/
+    monkeypatch.chdir(tmp_path)
+    phones, words = [], []
+    t = 0
+    for mark, marks in GRID:
+        start = t
+        for phone in marks:
+            phones.append((t/10, (t+1)/10, phone))
+            t += 1
+        words.append((start/10, t/10, mark))
+    (tmp_path/TEXTGRID).write_text(textgrid_text([('phone', phones), ('word', words)], t/10))
+    return str(tmp_path)+'/'
+
+def align_tape(textgrid_path, aligner):
+    tape = Tape('Tape 1')
+    tape.chunks.append(Chunk('S0000PS000', [1, 2, 3, 4], [Utterance(text) for text in UTTERANCES]))
+    f = FileSet('http://bnc.phon.ox.ac.uk/data/'+TEXTGRID,
+            'http://bnc.phon.ox.ac.uk/data/021A-C0000X0001XX-AAZZP0.wav',
+            'http://bnc.phon.ox.ac.uk/transcripts-html/S0000.html')
+    tape, errors, issues = align_fileset(f, tape, textgrid_path, None, aligner)
+    assert errors == []
+    return {utterance.text: utterance for utterance in tape.chunks[0].transcribed_utterances}, issues
+
+def test_greedy_stops_at_mismatch(textgrid_path):
+    aligned, issues = align_tape(textgrid_path, 'greedy')
+    assert list(aligned) == ['the cat.']
+    assert len(issues) == 3 and issues[0].startswith('utterance hello there.')
+
+def test_dp_recovers_after_mismatch(textgrid_path):
+    aligned, issues = align_tape(textgrid_path, 'dp')
+    assert list(aligned) == ['the cat.', 'so brenda.', 'on mat.']
+    assert len(issues) == 1 and issues[0].startswith('utterance hello there.')
+    assert aligned['so brenda.'].words == ' so brenda'
+    assert aligned['so brenda.'].start == pytest.approx(1.1)
+    assert aligned['on mat.'].phones == 'AA1 N | M AE1 T | '
+
+import align
+from align import _align_transcript_job
+
+
+def test_realign_issues_after_version_change(tmp_path, monkeypatch):
+    aligned = []
+
+    def align_transcript(html, *args):
+        aligned.append(html)
+        #(transcript, errors, alignment issues of each FileSet)
+        issues = [['utterance zzz\n']] if 'issues' in html else [[]]
+        return html, [[]], issues
+
+    monkeypatch.setattr(align, 'align_transcript', align_transcript)
+    htmls = ['clean.html', 'issues.html']
+
+    def run(version, realign_issues):
+        aligned.clear()
+        for html in htmls:
+            args = (html, html.encode('utf-8'), [], 'bs4', '', None, 'greedy')
+            _align_transcript_job((args, str(tmp_path)+'/', version, realign_issues))
+        return list(aligned)
+
+    assert run('v1', False) == htmls
+    assert run('v1', False) == []
+    #a new version realigns only the transcripts with issues
+    assert run('v2', True) == ['issues.html']
+    #and everything without realign_issues (clean.html is still v1)
+    assert run('v2', False) == ['clean.html']
+    assert run('v3', False) == htmls
+
+def test_word_in_phone_hole(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    #no phone from 0.2 to 0.3, where cat ends
+    (tmp_path/TEXTGRID).write_text(textgrid_text([
+        ('phone', [(0, 0.1, 'DH'), (0.1, 0.2, 'K'), (0.3, 0.4, 'S'), (0.4, 0.5, 'OW1')]),
+        ('word', [(0, 0.1, 'the'), (0.1, 0.25, 'cat'), (0.3, 0.5, 'so')])], 0.5))
+
+    tape = Tape('Tape 1')
+    tape.chunks.append(Chunk('S0000PS000', [1, 2], [Utterance('the cat.'), Utterance('so.')]))
+    f = FileSet('http://bnc.phon.ox.ac.uk/data/'+TEXTGRID,
+            'http://bnc.phon.ox.ac.uk/data/021A-C0000X0001XX-AAZZP0.wav',
+            'http://bnc.phon.ox.ac.uk/transcripts-html/S0000.html')
+    tape, errors, issues = align_fileset(f, tape, str(tmp_path)+'/', None)
+
+    assert errors == []
+    assert len(issues) == 1 and issues[0].startswith('utterance the cat.')
+    assert [utterance.text for utterance in tape.chunks[0].transcribed_utterances] == ['so.']
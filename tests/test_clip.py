@@ -0,0 +1,28 @@
+from clip import clip_batch
+from synth import textgrid_text
+
+GOOD = '021A-C0000X0001XX-AAZZP0_000001_S0000_1.TextGrid'
+MISSING = '021A-C0001X0001XX-AAZZP0_000101_S0001_1.TextGrid'
+
+
+def test_failures_do_not_stop_batch(tmp_path, monkeypatch):
+    #load_tiers caches under data/tiercache/
+    monkeypatch.chdir(tmp_path)
+    textgrid_path = str(tmp_path/'grids')+'/'
+    (tmp_path/'grids').mkdir()
+    (tmp_path/'grids'/GOOD).write_text(textgrid_text([
+        ('phone', [(0, 0.5, 'K'), (0.5, 1, 'AE1')]),
+        ('word', [(0, 1, 'cat')])], 1))
+    #recordings that cannot be sliced
+    (tmp_path/'wavs').mkdir()
+    for fname in [GOOD, MISSING]:
+        (tmp_path/'wavs'/(fname.split('_')[0]+'.wav')).write_bytes(b'not a wav')
+    outpath = str(tmp_path/'out')+'/'
+
+    clips = [(MISSING, 0., 1., 0., 'missing'), (GOOD, 0., 1., 0., 'good')]
+    failed = clip_batch(clips, getwav=True, workers=2, textgrid_path=textgrid_path,
+            outpath=outpath, wav_dir=str(tmp_path/'wavs'))
+
+    assert [(out_fname, error.split()[0]) for out_fname, error in failed] == [
+            ('missing', 'TextGrid'), ('missing', 'wav:'), ('good', 'wav:')]
+    assert (tmp_path/'out'/'textgrids'/'good.TextGrid').exists()
@@ -0,0 +1,12 @@
+from fetch import iter_pages
+
+
+def test_lazy_urls(tmp_path):
+    (tmp_path/'mirror').mkdir()
+    for name in ['A.html', 'B.html']:
+        (tmp_path/'mirror'/name).write_bytes(name.encode('utf-8'))
+    urls = (f'http://bnc.phon.ox.ac.uk/transcripts-html/{name}' for name in ['A.html', 'B.html'])
+
+    pages = list(iter_pages(urls, str(tmp_path/'cache')+'/', workers=2,
+        mirror=str(tmp_path/'mirror')))
+    assert [content for _, content in pages] == [b'A.html', b'B.html']
@@ -0,0 +1,19 @@
+import pytest
+
+from query import WordPattern
+
+
+def test_near():
+    assert WordPattern('thank ~3 much').match('thank you very much') == [(0, 3)]
+    assert WordPattern('much ~3 thank').match('thank you very much') == [(0, 3)]
+    assert WordPattern('thank ~2 much').match('thank you very much') == []
+
+@pytest.mark.parametrize('query', ['a ~0 b', 'a ~-1 b', 'a ~ b', 'a ~x b'])
+def test_bad_distance(query):
+    with pytest.raises(ValueError):
+        WordPattern(query)
+
+@pytest.mark.parametrize('query', ['a ~2 b ~2 c', 'a ~2 ~2 b', '~2 a', 'a ~2'])
+def test_chained_or_dangling(query):
+    with pytest.raises(ValueError):
+        WordPattern(query)
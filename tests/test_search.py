@@ -0,0 +1,29 @@
+import pytest
+
+from search import PhonePattern, open_index
+
+
+def test_words(corpus_path, tmp_path):
+    index = open_index(corpus_path, str(tmp_path/'words')+'/', 'words')
+    assert [hit.utterance for hit in index.search('the')] == [0, 2]
+    assert [hit.utterance for hit in index.search('the cat')] == [0]
+
+def test_phones(corpus_path, tmp_path):
+    index = open_index(corpus_path, str(tmp_path/'phones')+'/', 'phones')
+    assert [hit.utterance for hit in index.search('AE T')] == [0, 0, 2]
+
+@pytest.mark.parametrize('kind', ['words', 'phones'])
+@pytest.mark.parametrize('query', ['', '   '])
+def test_empty_query(corpus_path, tmp_path, kind, query):
+    index = open_index(corpus_path, str(tmp_path/kind)+'/', kind)
+    with pytest.raises(ValueError, match='empty query'):
+        index.search(query)
+
+@pytest.mark.parametrize('query', ['[]', '[|]', 'AE [AE|]', '[|EH2] T'])
+def test_empty_phone_class(query):
+    with pytest.raises(ValueError, match='Empty phone class'):
+        PhonePattern(query)
+
+def test_phone_class(corpus_path, tmp_path):
+    index = open_index(corpus_path, str(tmp_path/'phones')+'/', 'phones')
+    assert [hit.utterance for hit in index.search('[AE|OW] T')] == [0, 0, 2]
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from server import SearchServer
+
+
+def test_query_pool(corpus_path, tmp_path):
+    server = SearchServer(corpus_path, str(tmp_path/'index')+'/', workers=2)
+    try:
+        executor = server.executor
+        for pattern in ['the .', 'cat ~1 sat']:
+            status, _, body, _ = server.respond('/query', {'pattern': [pattern]})
+            assert status == 200
+        #one pool for the life of the server
+        assert server.executor is executor
+        hits = server.query({'pattern': ['the .']})
+        assert [(hit.utterance, hit.position) for hit in hits] == [(0, 0), (2, 0)]
+    finally:
+        server.close()
+
+def test_concurrent_requests_search_once(corpus_path, tmp_path):
+    server = SearchServer(corpus_path, str(tmp_path/'index')+'/')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return ['hits']
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(server.cached('key', compute)))
+            for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(cache_hit for _, cache_hit in results) == [False, True, True, True]
+
+def test_bad_pattern_is_bad_request(corpus_path, tmp_path):
+    import asyncio
+    import json
+
+    server = SearchServer(corpus_path, str(tmp_path/'index')+'/')
+
+    async def get(target):
+        reader = asyncio.StreamReader()
+        reader.feed_data(f'GET {target} HTTP/1.1\r\nHost: x\r\n\r\n'.encode('latin-1'))
+        reader.feed_eof()
+        written = []
+
+        class Writer:
+            def write(self, data):
+                written.append(data)
+            async def drain(self):
+                pass
+            def close(self):
+                pass
+
+        await server.handle(reader, Writer())
+        return b''.join(written)
+
+    for target in ['/search?kind=phones&q=%5B%5D', '/query?kind=phones&pattern=%5B%7C%5D']:
+        response = asyncio.run(get(target))
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 400')
+        assert 'Empty phone class' in json.loads(body)['error']
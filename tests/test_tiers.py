@@ -0,0 +1,14 @@
+from array import array
+
+import pytest
+
+from tiers import Tier
+
+
+def test_span():
+    tier = Tier('phone', array('d', [0, 1, 3]), array('d', [1, 2, 4]), ['a', 'b', 'c'])
+    assert tier.span(0.5, 3.5) == (1, 3)
+    #2.5 is in the hole between b and c, 5 is after the tier
+    for start, end in [(0.5, 2.5), (2.5, 3.5), (0.5, 5)]:
+        with pytest.raises(ValueError):
+            tier.span(start, end)
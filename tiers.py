@@ -0,0 +1,246 @@
+import mmap
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+#Same attribute names as textgrid.Interval
+Interval = namedtuple("Interval", "minTime, maxTime, mark")
+
+
+class Tier:
+    """Compact interval tier of a TextGrid.
+
+    Start and end times are stored in two arrays of doubles and
+    the marks in a list, so looking up the intervals for a stretch
+    of time is a bisect over the end times and does not create an
+    Interval object per interval. Intervals are assumed to be sorted
+    and non-overlapping (as in an IntervalTier).
+    """
+
+    def __init__(self, name, starts, ends, marks):
+
+        self.name = name
+        self.starts = starts
+        self.ends = ends
+        self.marks = marks
+
+    @classmethod
+    def from_textgrid(cls, tier):
+        """Returns a Tier built from a textgrid.IntervalTier"""
+        starts = array('d', [interval.minTime for interval in tier])
+        ends = array('d', [interval.maxTime for interval in tier])
+        marks = [interval.mark for interval in tier]
+        return cls(tier.name, starts, ends, marks)
+
+    def __len__(self):
+        return len(self.marks)
+
+    def __getitem__(self, i):
+        return Interval(self.starts[i], self.ends[i], self.marks[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def index_containing(self, time):
+        """Returns the index of the interval containing time, or None
+        if time is outside the tier. Like textgrid's indexContaining, a
+        time on the boundary of two intervals belongs to the first."""
+        i = bisect_left(self.ends, time)
+        if i != len(self.ends) and self.starts[i] <= time:
+            return i
+
+    def span(self, start, end):
+        """Returns (start_idx, end_idx) such that [start_idx:end_idx]
+        are the intervals from start to end (i.e. after the interval
+        containing start, up to the one containing end). Raises a
+        ValueError if start or end is in no interval (outside the
+        tier or in a hole left by dropped intervals)."""
+        start_idx = self.index_containing(start)
+        end_idx = self.index_containing(end)
+        if start_idx is None or end_idx is None:
+            raise ValueError(f"{self.name} tier has no interval at {start if start_idx is None else end}")
+        return start_idx+1, end_idx+1
+
+    def marks_between(self, start, end):
+        """Returns the marks of the intervals from start to end"""
+        start_idx, end_idx = self.span(start, end)
+        return self.marks[start_idx:end_idx]
+
+
+#Quoted strings (with "" escapes), numbers not inside [n] item labels,
+#and the <exists> flag; everything else in a TextGrid is ignored
+TOKEN = re.compile(r'"((?:[^"]|"")*)"|(?<![\w\[.])([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w\].])|<exists>')
+
+def _decode(raw):
+    """Returns the text of a TextGrid given its bytes (utf-16 with 
+    a BOM, otherwise utf-8 with bad bytes replaced)"""
+    if raw[:2] in (b'\xff\xfe', b'\xfe\xff'):
+        return raw.decode('utf-16')
+    return raw.decode('utf-8', errors='replace').lstrip('\ufeff')
+
+def _tokens(text):
+    """Yields the strings (as str) and numbers (as float) in text"""
+    for m in TOKEN.finditer(text):
+        string, number = m.groups()
+        if string is not None:
+            yield string.replace('""', '"')
+        elif number is not None:
+            yield float(number)
+
+def read_textgrid(fname, round_digits=5):
+    """Returns the tiers of a Praat TextGrid (long or short text format). 
+
+    The file is read as a stream of tokens (like Praat does), so 
+    it does not depend on the exact line layout. It is also 
+    tolerant of the problems that make textgrid.TextGrid.fromFile 
+    fail on some AudioBNC grids: unknown encodings, a truncated 
+    last tier, and overlapping or out of order intervals 
+    (these are sorted and overlaps dropped). As in textgrid, times 
+    are rounded to round_digits and empty (zero length) intervals 
+    are skipped.
+
+    Returns: 
+        List[Tier]: Tiers in the order of the file. Point tiers 
+                    have equal start and end times. 
+    """
+
+    with open(fname, 'rb') as f:
+        tokens = _tokens(_decode(f.read()))
+
+    def number():
+        token = next(tokens)
+        if not isinstance(token, float):
+            raise ValueError(f"Expected a number in {fname}, got {token!r}")
+        return token
+
+    header = [next(tokens), next(tokens)]
+    if not str(header[0]).startswith('ooTextFile') or header[1] != 'TextGrid':
+        raise ValueError(f"{fname} is not a TextGrid: {header}")
+    number(), number()
+    num_tiers = int(number())
+
+    tiers = []
+    for _ in range(num_tiers):
+        try:
+            tier_class, name = next(tokens), next(tokens)
+            number(), number()
+            size = int(number())
+        except StopIteration:
+            break
+        intervals = []
+        try:
+            for _ in range(size):
+                if tier_class == 'IntervalTier':
+                    start, end = round(number(), round_digits), round(number(), round_digits)
+                else:
+                    start = end = round(number(), round_digits)
+                mark = next(tokens)
+                if start < end or tier_class != 'IntervalTier':
+                    intervals.append((start, end, mark))
+        #Truncated file, keep what was read
+        except StopIteration:
+            pass
+
+        intervals.sort(key=lambda x: x[0])
+        starts, ends, marks = array('d'), array('d'), []
+        for start, end, mark in intervals:
+            if ends and start < ends[-1]:
+                continue
+            starts.append(start)
+            ends.append(end)
+            marks.append(mark)
+        tiers.append(Tier(name, starts, ends, marks))
+    return tiers
+
+#Binary tier cache: header, then for each tier its name, the start and 
+#end times as float64 (8 byte aligned, so they can be used straight 
+#from a memory map) and the marks joined by NUL
+CACHE_MAGIC = b'BNCTIER1'
+CACHE_HEADER = struct.Struct('<8sqqI')
+CACHE_TIER = struct.Struct('<QQQ')
+
+def _padding(offset):
+    return -offset % 8
+
+def write_tier_cache(tiers, cache_fname, mtime_ns, size):
+    """Writes tiers to cache_fname, keyed by the mtime and size 
+    of the TextGrid they were read from"""
+
+    tmp_fname = cache_fname+'.tmp'
+    with open(tmp_fname, 'wb') as f:
+        offset = f.write(CACHE_HEADER.pack(CACHE_MAGIC, mtime_ns, size, len(tiers)))
+        for tier in tiers:
+            name = tier.name.encode('utf-8')
+            marks = '\0'.join(tier.marks).encode('utf-8')
+            offset += f.write(CACHE_TIER.pack(len(tier), len(name), len(marks)))
+            offset += f.write(name)
+            offset += f.write(b'\0'*_padding(offset))
+            offset += f.write(array('d', tier.starts).tobytes())
+            offset += f.write(array('d', tier.ends).tobytes())
+            offset += f.write(marks)
+    os.replace(tmp_fname, cache_fname)
+
+def read_tier_cache(cache_fname, mtime_ns, size):
+    """Returns the tiers in cache_fname, or None if the cache 
+    is missing or was written for a different version of 
+    the TextGrid (mtime or size differs). Times are memoryviews 
+    into a memory map of the cache."""
+
+    try:
+        with open(cache_fname, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        magic, cached_mtime, cached_size, num_tiers = CACHE_HEADER.unpack_from(buf, 0)
+    except struct.error:
+        return None
+    if magic != CACHE_MAGIC or cached_mtime != mtime_ns or cached_size != size:
+        return None
+
+    view = memoryview(buf)
+    offset = CACHE_HEADER.size
+    tiers = []
+    for _ in range(num_tiers):
+        n, name_len, marks_len = CACHE_TIER.unpack_from(buf, offset)
+        offset += CACHE_TIER.size
+        name = bytes(view[offset:offset+name_len]).decode('utf-8')
+        offset += name_len
+        offset += _padding(offset)
+        starts = view[offset:offset+8*n].cast('d')
+        offset += 8*n
+        ends = view[offset:offset+8*n].cast('d')
+        offset += 8*n
+        marks = bytes(view[offset:offset+marks_len]).decode('utf-8')
+        offset += marks_len
+        marks = marks.split('\0') if n else []
+        tiers.append(Tier(name, starts, ends, marks))
+    return tiers
+
+def load_tiers(fname, cache_path='data/tiercache/'):
+    """Returns the tiers of TextGrid fname (see read_textgrid). 
+    
+    If cache_path is given, parsed tiers are stored there in a binary 
+    cache keyed by the mtime and size of fname, so loading the same 
+    grid again skips parsing. 
+
+    Returns: 
+        List[Tier]: Tiers in the order of the file.
+    """
+
+    if cache_path is None:
+        return read_textgrid(fname)
+
+    stat = os.stat(fname)
+    cache_fname = os.path.join(cache_path, os.path.basename(fname)+'.tiers')
+    tiers = read_tier_cache(cache_fname, stat.st_mtime_ns, stat.st_size)
+    if tiers is None:
+        tiers = read_textgrid(fname)
+        os.makedirs(cache_path, exist_ok=True)
+        write_tier_cache(tiers, cache_fname, stat.st_mtime_ns, stat.st_size)
+    return tiers
@@ -0,0 +1,79 @@
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+#Format of a wav file: the raw fmt chunk (copied to clips as is),
+#the sampling rate, bytes per frame, and the offset and size of
+#the sample data
+WavFormat = namedtuple("WavFormat", "fmt, rate, block_align, data_offset, data_size")
+
+CHUNK = struct.Struct('<4sI')
+
+
+def read_format(buf):
+    """Returns the WavFormat of the RIFF/WAVE file in buf (bytes or
+    a memory map). Only the chunk headers are read.
+
+    Returns:
+        WavFormat
+    """
+
+    if buf[0:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while offset + CHUNK.size <= len(buf):
+        chunk_id, size = CHUNK.unpack_from(buf, offset)
+        offset += CHUNK.size
+        if chunk_id == b'fmt ':
+            fmt = bytes(buf[offset:offset+size])
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            _, _, rate, _, block_align = struct.unpack_from('<HHIIH', fmt)
+            #Some recorders leave the size at 0 or too large
+            size = min(size, len(buf)-offset) if size else len(buf)-offset
+            return WavFormat(fmt, rate, block_align, offset, size)
+        #chunks are padded to an even size
+        offset += size + (size & 1)
+    raise ValueError("No data chunk")
+
+def slice_wav(wav_fname, start, end, out_fname):
+    """Writes start to end (in seconds) of wav_fname to out_fname.
+
+    The input is memory mapped and the frames from start to end
+    are copied after a new header, so nothing is decoded and only
+    the pages of the clip are read. Times outside the recording
+    are clipped to it (like the ?t= links).
+
+    Returns:
+        int: Number of bytes of sample data written.
+    """
+
+    with open(wav_fname, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        wav = read_format(buf)
+        num_frames = wav.data_size // wav.block_align
+        start_frame = min(max(int(round(start*wav.rate)), 0), num_frames)
+        end_frame = min(max(int(round(end*wav.rate)), start_frame), num_frames)
+        first = wav.data_offset + start_frame*wav.block_align
+        last = wav.data_offset + end_frame*wav.block_align
+
+        size = last-first
+        fmt_pad = b'\0' if len(wav.fmt) & 1 else b''
+        riff_size = 4 + CHUNK.size + len(wav.fmt) + len(fmt_pad) + CHUNK.size + size + (size & 1)
+
+        with open(out_fname+'.tmp', 'wb') as out:
+            out.write(CHUNK.pack(b'RIFF', riff_size) + b'WAVE')
+            out.write(CHUNK.pack(b'fmt ', len(wav.fmt)) + wav.fmt + fmt_pad)
+            out.write(CHUNK.pack(b'data', size))
+            out.write(buf[first:last])
+            if size & 1:
+                out.write(b'\0')
+        os.replace(out_fname+'.tmp', out_fname)
+    finally:
+        buf.close()
+    return size